@@ -2,16 +2,18 @@ from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Query, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
-from .database import get_db
+from .database import ReadSessionLocal, get_db
 from .models.db_models import AdminUser
 
 # Security configurations
 SECRET_KEY = "your-secret-key-change-this-in-production"  # TODO: Move to env
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 24 hours
+STREAM_TOKEN_EXPIRE_SECONDS = 60  # Only needs to outlive opening the stream
+STREAM_TOKEN_SCOPE = "stats_stream"
 
 # Password hashing - support both pbkdf2_sha256 (preferred) and bcrypt (legacy)
 # bcrypt marked as deprecated for automatic migration on next login
@@ -51,23 +53,29 @@ def decode_access_token(token: str) -> dict:
     except JWTError:
         return None
 
-async def get_current_admin(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
-) -> AdminUser:
-    """Get current authenticated admin user"""
+def create_stream_token(username: str) -> str:
+    """Create a short-lived JWT that only opens the live stats stream"""
+    return create_access_token(
+        data={"sub": username, "scope": STREAM_TOKEN_SCOPE},
+        expires_delta=timedelta(seconds=STREAM_TOKEN_EXPIRE_SECONDS)
+    )
+
+def _admin_from_token(token: str, db: Session, scope: Optional[str] = None) -> AdminUser:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     
-    token = credentials.credentials
     payload = decode_access_token(token)
     
     if payload is None:
         raise credentials_exception
     
+    # Full admin tokens carry no scope; scoped tokens are only good for their own endpoint
+    if payload.get("scope") != scope:
+        raise credentials_exception
+    
     username: str = payload.get("sub")
     if username is None:
         raise credentials_exception
@@ -78,6 +86,29 @@ async def get_current_admin(
     
     return user
 
+async def get_current_admin(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: Session = Depends(get_db)
+) -> AdminUser:
+    """Get current authenticated admin user"""
+    return _admin_from_token(credentials.credentials, db)
+
+async def get_current_admin_from_stream_token(
+    token: str = Query(..., description="Stream token from POST /admin/stats/stream/token (EventSource cannot send headers)")
+) -> AdminUser:
+    """Get current admin from a ?token= stream token.
+
+    Only short-lived stream tokens are accepted, so the full admin JWT never
+    lands in a URL (and from there in access logs and browser history).
+    Uses its own short-lived session: a get_db dependency would hold a
+    connection open for the whole life of a long-running stream.
+    """
+    db = ReadSessionLocal()
+    try:
+        return _admin_from_token(token, db, scope=STREAM_TOKEN_SCOPE)
+    finally:
+        db.close()
+
 def authenticate_admin(db: Session, username: str, password: str) -> Optional[AdminUser]:
     """Authenticate admin user"""
     user = db.query(AdminUser).filter(AdminUser.username == username).first()
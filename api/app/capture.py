@@ -0,0 +1,156 @@
+"""Opt-in capture of /detect traffic for replay (scripts/replay_capture.py).
+
+With CAPTURE_ENABLED, a CAPTURE_SAMPLE_RATE share of /detect requests is
+written to CAPTURE_DIR: the image bytes as received plus size, content type,
+options, arrival time and the gap since the previous /detect request. API
+keys, client addresses and file names are never recorded.
+
+Each worker process writes its own segment files
+(capture-<utc time>-<pid>.bin). A segment starts with one JSON header line,
+followed by records: one JSON metadata line, then `size` bytes of image. A
+new segment is started at CAPTURE_SEGMENT_MB, and the oldest segments are
+deleted once the directory exceeds CAPTURE_MAX_MB.
+
+Records are queued without blocking and written from a background task;
+when the queue is full they are dropped (capture_dropped).
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+from .config import settings
+from .metrics import metrics
+
+FORMAT = "captcha-capture/1"
+QUEUE_MAXSIZE = 256
+
+class CaptureWriter:
+    """Samples /detect requests into rotating segment files"""
+
+    def __init__(self):
+        self._queue = None
+        self._task = None
+        self._file = None
+        self._last_arrival = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._task is not None
+
+    def record(self, image_bytes: bytes, content_type: Optional[str], include_visual: bool,
+               save_file: bool, timeout: Optional[float]):
+        """Sample one request; never blocks"""
+        if not self.enabled:
+            return
+        now = time.time()
+        gap = now - self._last_arrival if self._last_arrival is not None else None
+        self._last_arrival = now
+        if random.random() >= settings.CAPTURE_SAMPLE_RATE:
+            return
+
+        meta = {
+            "ts": round(now, 6),
+            "gap": round(gap, 6) if gap is not None else None,
+            "size": len(image_bytes),
+            "content_type": content_type,
+            "include_visual": include_visual,
+            "save_file": save_file,
+            "timeout": timeout,
+            "digest": hashlib.blake2b(image_bytes, digest_size=16).hexdigest(),
+        }
+        try:
+            self._queue.put_nowait((meta, image_bytes))
+        except asyncio.QueueFull:
+            metrics.inc("capture_dropped")
+
+    def _open_segment(self):
+        directory = Path(settings.CAPTURE_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"capture-{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}-{os.getpid()}.bin"
+        self._file = open(path, "ab")
+        header = {"format": FORMAT, "sample_rate": settings.CAPTURE_SAMPLE_RATE, "pid": os.getpid()}
+        self._file.write(json.dumps(header).encode() + b"\n")
+        self._prune()
+
+    def _prune(self):
+        """Delete the oldest segments (of any worker) while over CAPTURE_MAX_MB"""
+        segments = []
+        for path in Path(settings.CAPTURE_DIR).glob("capture-*.bin"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue  # Removed by another worker
+            segments.append((stat.st_mtime, path, stat.st_size))
+        segments.sort()
+        total = sum(size for _, _, size in segments)
+        current = Path(self._file.name) if self._file else None
+        for _, path, size in segments:
+            if total <= settings.CAPTURE_MAX_MB * 1024 * 1024:
+                break
+            if path == current:
+                continue
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+            metrics.inc("capture_segments_dropped")
+
+    def _write(self, batch: list):
+        """Append records to the current segment, rotating it when full (blocking)"""
+        for meta, image_bytes in batch:
+            if self._file is None or self._file.tell() >= settings.CAPTURE_SEGMENT_MB * 1024 * 1024:
+                if self._file is not None:
+                    self._file.close()
+                self._open_segment()
+            self._file.write(json.dumps(meta).encode() + b"\n")
+            self._file.write(image_bytes)
+        self._file.flush()
+        metrics.inc("capture_records", len(batch))
+
+    def _drain(self) -> list:
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                return batch
+
+    async def run(self):
+        while True:
+            batch = [await self._queue.get()] + self._drain()
+            # None is queued by stop(), after every record
+            stopping = batch[-1] is None
+            batch = [entry for entry in batch if entry is not None]
+            if batch:
+                try:
+                    await asyncio.to_thread(self._write, batch)
+                except Exception as e:
+                    metrics.inc("capture_dropped", len(batch))
+                    print(f"⚠ Failed to write {len(batch)} captured requests: {e}")
+            if stopping:
+                return
+
+    def start(self):
+        if settings.CAPTURE_ENABLED and self._task is None:
+            self._queue = asyncio.Queue(maxsize=QUEUE_MAXSIZE)
+            self._task = asyncio.create_task(self.run())
+            print(f"✓ Capturing {settings.CAPTURE_SAMPLE_RATE:.0%} of /detect requests to {settings.CAPTURE_DIR}")
+
+    async def stop(self):
+        """Stop capturing, write what is queued and close the segment"""
+        task, self._task = self._task, None
+        if task is None:
+            return
+        await self._queue.put(None)
+        await task
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+capture_writer = CaptureWriter()
@@ -0,0 +1,68 @@
+"""Single-flight coalescing of identical concurrent work.
+
+Captcha farms often submit the same image from several clients at the same
+moment. While a detection for a given (image hash, model, options) is running,
+identical requests in this worker await the same task instead of running
+their own inference. Nothing is kept after the task finishes, so this is not
+a result cache: it only helps during bursts, before any cache would be warm.
+
+Each caller may bring a deadline. A caller stops waiting at its own
+deadline, and the shared task is cancelled once no caller is left waiting.
+"""
+import asyncio
+import time
+from typing import Awaitable, Callable, Hashable, Optional
+from .metrics import metrics
+
+class _Flight:
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.deadlines = []  # one per waiting caller, None = no deadline
+
+class SingleFlight:
+    """One in-flight task per key, shared by every concurrent caller"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight = {}
+        metrics.gauge(f"{name}_inflight", lambda: len(self._inflight))
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable], deadline: Optional[float] = None):
+        """Result of fn() for this key; asyncio.TimeoutError at `deadline` (time.monotonic())"""
+        flight = self._inflight.get(key)
+        if flight is None:
+            # fn() may refuse (e.g. a full queue) before anything is registered
+            flight = self._inflight[key] = _Flight(asyncio.ensure_future(fn()))
+            flight.task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            metrics.inc(f"{self.name}_coalesced")
+        flight.deadlines.append(deadline)
+        try:
+            # A caller that leaves must not cancel the work the others are waiting for
+            waiter = asyncio.shield(flight.task)
+            if deadline is None:
+                return await waiter
+            return await asyncio.wait_for(waiter, deadline - time.monotonic())
+        finally:
+            flight.deadlines.remove(deadline)
+            if not flight.deadlines and not flight.task.done():
+                # Nobody is waiting any more
+                flight.task.cancel()
+                if self._inflight.get(key) is flight:
+                    del self._inflight[key]
+
+    def deadline(self, key: Hashable) -> Optional[float]:
+        """Latest deadline of the callers waiting on key; None if any of them has none"""
+        flight = self._inflight.get(key)
+        if flight is None or not flight.deadlines or None in flight.deadlines:
+            return None
+        return max(flight.deadlines)
+
+    def _finish(self, key: Hashable, task: asyncio.Future):
+        flight = self._inflight.get(key)
+        if flight is not None and flight.task is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # Retrieved here in case every caller went away
+
+detect_flight = SingleFlight("detect")
@@ -1,3 +1,4 @@
+from pydantic import Field
 from pydantic_settings import BaseSettings
 from typing import List
 import os
@@ -22,12 +23,115 @@ class Settings(BaseSettings):
     # Models should be uploaded via admin dashboard to /app/models directory
     MODEL_PATH: str = "/app/models/active_model.pt" if os.path.exists("/app") else "./models/active_model.pt"
     
+    # Serve /api/v1/detect from this process. false = admin-only process: the inference
+    # stack (torch, OpenCV) is never imported
+    ENABLE_INFERENCE: bool = True
+    # Identical images detected concurrently in a worker share one inference
+    DETECT_COALESCE: bool = True
+    # Detections run at once per worker; waiting requests are shared fairly between API keys
+    # by priority_weight. Requests queued per key before 429 (0 = unlimited, per key override)
+    INFERENCE_SLOTS: int = 1
+    SCHEDULER_MAX_QUEUE: int = 32
+    # Adaptive load shedding: admitted detections per worker (running + queued) are limited
+    # so that queueing delay stays near the target; the rest get 503 (target 0 = off)
+    SHED_TARGET_DELAY_MS: int = 250
+    SHED_INTERVAL_MS: int = 1000
+    SHED_MAX_ADMITTED: int = 64
+    
+    # Job API (/api/v1/jobs): bulk detection drained in the background by every worker,
+    # in batches, at JOB_PRIORITY_WEIGHT relative to a weight-1 API key
+    JOB_WORKER: bool = True
+    JOB_BATCH_SIZE: int = 8
+    JOB_PRIORITY_WEIGHT: float = Field(0.1, gt=0)
+    JOB_MAX_IMAGES: int = 500  # per job (multipart allows at most 1000 files per request)
+    JOB_MAX_PENDING_IMAGES: int = 10000  # images in unfinished jobs per key (per-key override, 0 = unlimited)
+    JOB_RESULT_TTL_HOURS: int = 24
+    JOB_MAX_WAIT_SECONDS: int = 30  # long-poll limit of GET /jobs/{id}?wait=
+    JOB_POLL_SECONDS: float = 1.0
+    JOB_LEASE_SECONDS: int = 300  # claimed images not finished by then (worker died) are queued again
+    
+    # Traffic capture for scripts/replay_capture.py (off by default): share of /detect
+    # requests recorded (image, options, timing; no API keys), segment size and total cap
+    CAPTURE_ENABLED: bool = False
+    CAPTURE_SAMPLE_RATE: float = 0.05
+    CAPTURE_DIR: str = "/app/capture" if os.path.exists("/app") else "./capture"
+    CAPTURE_SEGMENT_MB: int = 32
+    CAPTURE_MAX_MB: int = 512
+    
+    # WebSocket detection stream (/api/v1/ws): images processed at once per connection
+    # (further frames wait in TCP buffers), largest image, and how often the key is re-checked
+    WS_MAX_IN_FLIGHT: int = 16
+    WS_MAX_FRAME_KB: int = 1024
+    WS_RECHECK_SECONDS: float = 5.0
+    
+    # Pre-fork server (python -m api.app.server): worker processes (0 = one per CPU core)
+    # and how often the master checks for model activations
+    SERVER_WORKERS: int = 0
+    SERVER_RELOAD_POLL_SECONDS: float = 2.0
+    
     # Temporary files
     TEMP_RESULTS_DIR: str = "/app/temp_results" if os.path.exists("/app") else "./temp_results"
     
-    # Rate Limiting
+    # SQLite engine profile (WAL, pooled read-only connections for admin stats)
+    SQLITE_SYNCHRONOUS: str = "NORMAL"  # FULL = fsync every commit, NORMAL = fsync at WAL checkpoints
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000
+    SQLITE_CACHE_SIZE_KB: int = 20000
+    SQLITE_MMAP_SIZE_MB: int = 256
+    SQLITE_READ_POOL_SIZE: int = 4
+    
+    # Rate Limiting (token bucket per API key, shared across workers)
+    # RATE_LIMIT requests per RATE_LIMIT_WINDOW_SECONDS, 0 = unlimited
+    # Per-key overrides are stored on ApiKey.rate_limit / ApiKey.rate_limit_burst
     RATE_LIMIT: int = 100
+    RATE_LIMIT_WINDOW_SECONDS: int = 60
+    RATE_LIMIT_BURST: int = 0  # Bucket capacity, 0 = same as RATE_LIMIT
+    RATE_LIMIT_CACHE_SECONDS: int = 30  # How long key limits are cached per worker
+    RATE_LIMIT_CACHE_SIZE: int = 10000  # Most recently used keys kept in that cache
+    
+    # Model uploads: size limit, suggested chunk size for resumable uploads, session expiry
+    MODEL_UPLOAD_MAX_MB: int = 2048
+    MODEL_UPLOAD_CHUNK_MB: int = 8
+    MODEL_UPLOAD_EXPIRE_HOURS: int = 24
     
+    # Benchmark new models in a child process after upload (load time, RSS, latency)
+    MODEL_PROFILE_ON_UPLOAD: bool = True
+    MODEL_PROFILE_RUNS: int = 20
+    MODEL_PROFILE_BATCH: int = 8
+    MODEL_PROFILE_TIMEOUT_SECONDS: int = 600
+    
+    # Load models from a cached TorchScript export (built once per model and library version)
+    MODEL_ARTIFACTS: bool = True
+    MODEL_EXPORT_TIMEOUT_SECONDS: int = 900
+    
+    # Canary/shadow evaluation: side-by-side comparisons per second per worker (run in inference
+    # slots live traffic leaves over, skipped while busy), and how often workers re-read the rollout
+    ROLLOUT_COMPARE_PER_SECOND: float = 1.0
+    ROLLOUT_REFRESH_SECONDS: int = 10
+    
+    # Dashboard stats are cached per worker and shared by all admin viewers
+    DASHBOARD_CACHE_SECONDS: int = 5
+    # Live dashboard stream: tick interval and sliding window (in ticks) for rates/percentiles
+    LIVE_TICK_SECONDS: float = 2.0
+    LIVE_WINDOW_TICKS: int = 30
+    
+    # API key usage counters are batched in memory and flushed on this interval
+    USAGE_FLUSH_INTERVAL_MS: int = 500
+    
+    # Request logs are queued and bulk-inserted by a background writer
+    LOG_QUEUE_MAXSIZE: int = 10000
+    LOG_FLUSH_INTERVAL_MS: int = 250
+    LOG_BATCH_SIZE: int = 500
+    LOG_SAMPLE_THRESHOLD: float = 0.8  # Queue fill ratio where successful requests start being sampled
+    LOG_SAMPLE_RATE: int = 10  # Keep 1 in N successful requests while sampling
+    
+    # Request log retention: raw rows older than LOG_RETENTION_DAYS move to monthly
+    # archive files, archives older than LOG_ARCHIVE_MONTHS are deleted (0 = no archive)
+    LOG_RETENTION_DAYS: int = 30
+    LOG_ARCHIVE_MONTHS: int = 12
+    RETENTION_INTERVAL_MINUTES: int = 10
+    RETENTION_BATCH_SIZE: int = 2000
+    RETENTION_VACUUM_PAGES: int = 2000
+
     class Config:
         case_sensitive = True
         env_file = ".env"
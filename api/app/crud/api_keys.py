@@ -1,7 +1,8 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, select, tuple_, update
 from datetime import datetime, timedelta
-from typing import List, Optional
+from typing import List, Optional, Tuple
 import secrets
 from ..models.db_models import ApiKey, ExpirationType
 from ..models.schemas import ApiKeyCreate, ApiKeyUpdate, ApiKeyRenew
@@ -27,6 +28,11 @@ def create_api_key(db: Session, key_data: ApiKeyCreate, created_by: str = "admin
         expiration_type=key_data.expiration_type,
         expires_at=expires_at,
         daily_limit=key_data.daily_limit,
+        rate_limit=key_data.rate_limit,
+        rate_limit_burst=key_data.rate_limit_burst,
+        priority_weight=key_data.priority_weight,
+        max_queue_length=key_data.max_queue_length,
+        job_image_quota=key_data.job_image_quota,
         notes=key_data.notes,
         created_by=created_by
     )
@@ -42,7 +48,22 @@ def get_api_key(db: Session, key_id: int) -> Optional[ApiKey]:
 def get_api_key_by_value(db: Session, key_value: str) -> Optional[ApiKey]:
     return db.query(ApiKey).filter(ApiKey.key_value == key_value).first()
 
-def get_api_keys(db: Session, skip: int = 0, limit: int = 100, filter_status: Optional[str] = None) -> List[ApiKey]:
+async def get_api_key_by_value_async(db: AsyncSession, key_value: str) -> Optional[ApiKey]:
+    result = await db.execute(select(ApiKey).where(ApiKey.key_value == key_value))
+    return result.scalars().first()
+
+async def deactivate_api_key_async(db: AsyncSession, key_id: int):
+    await db.execute(update(ApiKey).where(ApiKey.id == key_id).values(is_active=False))
+    await db.commit()
+
+def get_api_keys(
+    db: Session,
+    skip: int = 0,
+    limit: int = 100,
+    filter_status: Optional[str] = None,
+    cursor: Optional[Tuple[datetime, int]] = None
+) -> List[ApiKey]:
+    """Newest-first keys; pass the (created_at, id) of the last key seen as `cursor` for the next page"""
     query = db.query(ApiKey)
     
     if filter_status == "active":
@@ -54,7 +75,11 @@ def get_api_keys(db: Session, skip: int = 0, limit: int = 100, filter_status: Op
         future = now + timedelta(days=7)
         query = query.filter(and_(ApiKey.expires_at != None, ApiKey.expires_at.between(now, future)))
     
-    return query.order_by(ApiKey.created_at.desc()).offset(skip).limit(limit).all()
+    if cursor is not None:
+        query = query.filter(tuple_(ApiKey.created_at, ApiKey.id) < tuple_(*cursor))
+    elif skip:
+        query = query.offset(skip)
+    return query.order_by(ApiKey.created_at.desc(), ApiKey.id.desc()).limit(limit).all()
 
 def update_api_key(db: Session, key_id: int, key_data: ApiKeyUpdate) -> Optional[ApiKey]:
     db_key = get_api_key(db, key_id)
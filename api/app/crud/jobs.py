@@ -0,0 +1,166 @@
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import case, delete, func, select, update
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+import secrets
+from ..models.db_models import DetectionJob, DetectionJobItem
+
+async def get_pending_job_images_async(db: AsyncSession, api_key_id: int) -> int:
+    """Images of a key's unfinished jobs that are not processed yet"""
+    result = await db.execute(
+        select(func.sum(DetectionJob.image_count - DetectionJob.done_count - DetectionJob.failed_count))
+        .where(DetectionJob.api_key_id == api_key_id, DetectionJob.status != "done")
+    )
+    return result.scalar() or 0
+
+async def create_job_async(
+    db: AsyncSession,
+    api_key_id: int,
+    images: List[Tuple[Optional[str], bytes]],
+    include_visual: bool = False
+) -> DetectionJob:
+    job = DetectionJob(
+        id=secrets.token_hex(16),
+        api_key_id=api_key_id,
+        include_visual=include_visual,
+        image_count=len(images)
+    )
+    db.add(job)
+    db.add_all([
+        DetectionJobItem(job_id=job.id, position=position, filename=filename, image=image)
+        for position, (filename, image) in enumerate(images)
+    ])
+    await db.commit()
+    return job
+
+async def get_job_async(db: AsyncSession, job_id: str, api_key_id: int) -> Optional[DetectionJob]:
+    """A job, only if it belongs to the key"""
+    result = await db.execute(
+        select(DetectionJob).where(DetectionJob.id == job_id, DetectionJob.api_key_id == api_key_id)
+    )
+    return result.scalars().first()
+
+async def get_job_items_async(db: AsyncSession, job_id: str) -> list:
+    """Item rows without the image (position, filename, status, result, error)"""
+    result = await db.execute(
+        select(
+            DetectionJobItem.position, DetectionJobItem.filename, DetectionJobItem.status,
+            DetectionJobItem.result, DetectionJobItem.error
+        )
+        .where(DetectionJobItem.job_id == job_id)
+        .order_by(DetectionJobItem.position)
+    )
+    return result.all()
+
+async def delete_job_async(db: AsyncSession, job_id: str):
+    await db.execute(delete(DetectionJobItem).where(DetectionJobItem.job_id == job_id))
+    await db.execute(delete(DetectionJob).where(DetectionJob.id == job_id))
+    await db.commit()
+
+async def claim_job_items_async(db: AsyncSession, limit: int) -> list:
+    """Mark up to `limit` queued items as running under a new claim token, oldest first.
+
+    Returns (id, job_id, image, include_visual) rows. The token makes this safe
+    when several workers claim at the same time: each gets only its own rows.
+    """
+    token = secrets.token_hex(16)
+    ids = (await db.execute(
+        select(DetectionJobItem.id)
+        .where(DetectionJobItem.status == "queued")
+        .order_by(DetectionJobItem.id)
+        .limit(limit)
+    )).scalars().all()
+    if not ids:
+        return []
+    await db.execute(
+        update(DetectionJobItem)
+        .where(DetectionJobItem.id.in_(ids), DetectionJobItem.status == "queued")
+        .values(status="running", claim=token, claimed_at=datetime.utcnow())
+    )
+    await db.commit()
+
+    result = await db.execute(
+        select(DetectionJobItem.id, DetectionJobItem.job_id, DetectionJobItem.image, DetectionJob.include_visual)
+        .join(DetectionJob, DetectionJob.id == DetectionJobItem.job_id)
+        .where(DetectionJobItem.claim == token)
+        .order_by(DetectionJobItem.id)
+    )
+    rows = result.all()
+    job_ids = {row.job_id for row in rows}
+    if job_ids:
+        await db.execute(
+            update(DetectionJob)
+            .where(DetectionJob.id.in_(job_ids), DetectionJob.status == "queued")
+            .values(status="running")
+        )
+        await db.commit()
+    return rows
+
+async def complete_job_items_async(db: AsyncSession, outcomes: list, result_ttl: timedelta):
+    """Store (item_id, job_id, result_json, error, model_id) outcomes and finish completed jobs.
+
+    Items that are no longer running (job deleted, or re-queued after the lease
+    ran out) are left alone, so an outcome is never counted twice.
+    """
+    now = datetime.utcnow()
+    done_by_job, failed_by_job = {}, {}
+    for item_id, job_id, result, error, model_id in outcomes:
+        stored = await db.execute(
+            update(DetectionJobItem)
+            .where(DetectionJobItem.id == item_id, DetectionJobItem.status == "running")
+            .values(
+                status="failed" if error else "done",
+                result=result,
+                error=error,
+                model_id=model_id,
+                image=None
+            )
+        )
+        if stored.rowcount:
+            counts = failed_by_job if error else done_by_job
+            counts[job_id] = counts.get(job_id, 0) + 1
+
+    for job_id in done_by_job.keys() | failed_by_job.keys():
+        done = DetectionJob.done_count + done_by_job.get(job_id, 0)
+        failed = DetectionJob.failed_count + failed_by_job.get(job_id, 0)
+        finished = done + failed >= DetectionJob.image_count
+        await db.execute(
+            update(DetectionJob)
+            .where(DetectionJob.id == job_id)
+            .values(
+                done_count=done,
+                failed_count=failed,
+                status=case((finished, "done"), else_=DetectionJob.status),
+                finished_at=case((finished, now), else_=None),
+                expires_at=case((finished, now + result_ttl), else_=None)
+            )
+        )
+    await db.commit()
+
+async def release_job_items_async(db: AsyncSession, item_ids: list):
+    """Give claimed items back to the queue unprocessed"""
+    await db.execute(
+        update(DetectionJobItem)
+        .where(DetectionJobItem.id.in_(item_ids), DetectionJobItem.status == "running")
+        .values(status="queued", claim=None, claimed_at=None)
+    )
+    await db.commit()
+
+async def requeue_stale_job_items_async(db: AsyncSession, older_than: datetime) -> int:
+    """Queue again items whose worker died before finishing them"""
+    result = await db.execute(
+        update(DetectionJobItem)
+        .where(DetectionJobItem.status == "running", DetectionJobItem.claimed_at < older_than)
+        .values(status="queued", claim=None, claimed_at=None)
+    )
+    await db.commit()
+    return result.rowcount
+
+def delete_expired_jobs(db: Session, now: datetime) -> int:
+    """Delete finished jobs (and their results) past expires_at"""
+    expired = select(DetectionJob.id).where(DetectionJob.expires_at < now)
+    db.execute(delete(DetectionJobItem).where(DetectionJobItem.job_id.in_(expired)))
+    count = db.execute(delete(DetectionJob).where(DetectionJob.expires_at < now)).rowcount
+    db.commit()
+    return count
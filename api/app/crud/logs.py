@@ -1,8 +1,9 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, func, select, tuple_
 from datetime import datetime, timedelta
-from typing import List
-from ..models.db_models import RequestLog, ApiKey
+from typing import List, Optional, Tuple
+from ..models.db_models import RequestLog, ApiKey, UsageRollup
 
 def create_request_log(
     db: Session,
@@ -30,14 +31,50 @@ def create_request_log(
     db.refresh(log)
     return log
 
-def get_request_logs(db: Session, skip: int = 0, limit: int = 50, api_key_id: int = None) -> List[RequestLog]:
-    query = db.query(RequestLog)
+def get_request_logs(
+    db: Session,
+    skip: int = 0,
+    limit: int = 50,
+    api_key_id: int = None,
+    cursor: Optional[Tuple[datetime, int]] = None,
+    status_code: Optional[int] = None,
+    endpoint: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+) -> list:
+    """Newest-first logs joined with their key name, as (RequestLog, api_key_name) rows.
+
+    Pass the (timestamp, id) of the last row seen as `cursor` for the next page;
+    `skip` is only applied without a cursor.
+    """
+    query = db.query(RequestLog, ApiKey.name).outerjoin(ApiKey, ApiKey.id == RequestLog.api_key_id)
     if api_key_id:
         query = query.filter(RequestLog.api_key_id == api_key_id)
-    return query.order_by(RequestLog.timestamp.desc()).offset(skip).limit(limit).all()
+    if status_code is not None:
+        query = query.filter(RequestLog.status_code == status_code)
+    if endpoint:
+        query = query.filter(RequestLog.endpoint == endpoint)
+    if start is not None:
+        query = query.filter(RequestLog.timestamp >= start)
+    if end is not None:
+        query = query.filter(RequestLog.timestamp < end)
+    if cursor is not None:
+        query = query.filter(tuple_(RequestLog.timestamp, RequestLog.id) < tuple_(*cursor))
+    elif skip:
+        query = query.offset(skip)
+    return query.order_by(RequestLog.timestamp.desc(), RequestLog.id.desc()).limit(limit).all()
 
 def get_today_request_count(db: Session, api_key_id: int) -> int:
+    """Today's requests for a key from the hourly rollups, like the async variant"""
+    today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    return db.query(func.sum(UsageRollup.request_count)).filter(
+        and_(UsageRollup.api_key_id == api_key_id, UsageRollup.hour >= today_start)
+    ).scalar() or 0
+
+async def get_today_request_count_async(db: AsyncSession, api_key_id: int) -> int:
+    """Today's requests for a key from the hourly rollups (at most 24 rows, unaffected by log sampling)"""
     today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-    return db.query(func.count(RequestLog.id)).filter(
-        and_(RequestLog.api_key_id == api_key_id, RequestLog.timestamp >= today_start)
-    ).scalar()
+    result = await db.execute(select(func.sum(UsageRollup.request_count)).where(
+        and_(UsageRollup.api_key_id == api_key_id, UsageRollup.hour >= today_start)
+    ))
+    return result.scalar() or 0
@@ -33,10 +33,12 @@ def activate_model(db: Session, model_id: int) -> Optional[ModelFile]:
         # Deactivate all models
         db.query(ModelFile).update({ModelFile.is_active: False}, synchronize_session='fetch')
         
-        # Activate the selected model
+        # Activate the selected model (promoting a rollout candidate ends its rollout)
         model = db.query(ModelFile).filter(ModelFile.id == model_id).first()
         if model:
             model.is_active = True
+            model.rollout_mode = None
+            model.rollout_percent = None
             db.commit()
             db.refresh(model)
         return model
@@ -52,3 +54,29 @@ def delete_model_file(db: Session, model_id: int) -> bool:
     db.delete(model)
     db.commit()
     return True
+
+def get_rollout_model(db: Session) -> Optional[ModelFile]:
+    return db.query(ModelFile).filter(ModelFile.rollout_mode != None).first()
+
+def set_rollout(db: Session, model_id: int, mode: str, percent: float) -> Optional[ModelFile]:
+    """Make a model the only rollout candidate"""
+    model = db.query(ModelFile).filter(ModelFile.id == model_id).first()
+    if not model:
+        return None
+    db.query(ModelFile).filter(ModelFile.id != model_id).update(
+        {ModelFile.rollout_mode: None, ModelFile.rollout_percent: None}, synchronize_session=False
+    )
+    model.rollout_mode = mode
+    model.rollout_percent = percent
+    db.commit()
+    db.refresh(model)
+    return model
+
+def clear_rollout(db: Session, model_id: int) -> Optional[ModelFile]:
+    model = db.query(ModelFile).filter(ModelFile.id == model_id).first()
+    if model:
+        model.rollout_mode = None
+        model.rollout_percent = None
+        db.commit()
+        db.refresh(model)
+    return model
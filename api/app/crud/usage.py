@@ -0,0 +1,101 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import func
+from datetime import datetime
+from typing import List, Optional
+import json
+from ..models.db_models import COMPARISON_COUNTERS, ModelComparison, UsageRollup, LatencySketch
+from ..rollups import LATENCY_BUCKETS_MS
+from ..sketches import DDSketch
+
+def get_usage_totals(db: Session, since: Optional[datetime] = None) -> dict:
+    """Summed rollups (requests, successes, errors, latency) from an hour onwards"""
+    query = db.query(
+        func.coalesce(func.sum(UsageRollup.request_count), 0),
+        func.coalesce(func.sum(UsageRollup.success_count), 0),
+        func.coalesce(func.sum(UsageRollup.error_count), 0),
+        func.coalesce(func.sum(UsageRollup.latency_sum_ms), 0.0)
+    )
+    if since is not None:
+        query = query.filter(UsageRollup.hour >= since)
+    requests, successes, errors, latency_sum = query.one()
+    return {
+        "request_count": requests,
+        "success_count": successes,
+        "error_count": errors,
+        "latency_sum_ms": latency_sum,
+    }
+
+def get_usage_series(db: Session, since: datetime, api_key_id: Optional[int] = None) -> List[dict]:
+    """Hourly usage series, for one key or summed over all keys"""
+    query = db.query(
+        UsageRollup.hour,
+        func.sum(UsageRollup.request_count),
+        func.sum(UsageRollup.error_count),
+        func.sum(UsageRollup.latency_sum_ms),
+        func.group_concat(UsageRollup.latency_histogram, "|")
+    ).filter(UsageRollup.hour >= since)
+    if api_key_id:
+        query = query.filter(UsageRollup.api_key_id == api_key_id)
+    rows = query.group_by(UsageRollup.hour).order_by(UsageRollup.hour).all()
+
+    series = []
+    for hour, requests, errors, latency_sum, histograms in rows:
+        histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        for part in (histograms or "").split("|"):
+            if part:
+                for index, count in enumerate(json.loads(part)):
+                    histogram[index] += count
+        series.append({
+            "hour": hour,
+            "request_count": requests,
+            "error_count": errors,
+            "avg_response_time_ms": round(latency_sum / requests, 2) if requests else 0.0,
+            "latency_histogram": histogram,
+        })
+    return series
+
+def get_latency_sketches(
+    db: Session,
+    start: datetime,
+    end: Optional[datetime] = None,
+    api_key_id: Optional[int] = None,
+    model_id: Optional[int] = None,
+    group_by: Optional[str] = None
+) -> dict:
+    """Merged latency sketches for hours in [start, end), keyed by api_key_id/model_id or None"""
+    query = db.query(LatencySketch.api_key_id, LatencySketch.model_id, LatencySketch.sketch).filter(
+        LatencySketch.hour >= start
+    )
+    if end is not None:
+        query = query.filter(LatencySketch.hour < end)
+    if api_key_id:
+        query = query.filter(LatencySketch.api_key_id == api_key_id)
+    if model_id is not None:
+        query = query.filter(LatencySketch.model_id == model_id)
+
+    merged = {}
+    for key_id, row_model_id, data in query.yield_per(1000):
+        group = key_id if group_by == "key" else row_model_id if group_by == "model" else None
+        sketch = merged.get(group)
+        if sketch is None:
+            sketch = merged[group] = DDSketch()
+        sketch.merge(DDSketch.from_json(data))
+    return merged
+
+def get_model_comparisons(db: Session, start: datetime, end: Optional[datetime] = None) -> dict:
+    """Merged rollout comparisons for hours in [start, end), keyed by (primary_model_id, candidate_model_id, mode)"""
+    query = db.query(ModelComparison).filter(ModelComparison.hour >= start)
+    if end is not None:
+        query = query.filter(ModelComparison.hour < end)
+
+    merged = {}
+    for row in query.yield_per(1000):
+        key = (row.primary_model_id, row.candidate_model_id, row.mode)
+        entry = merged.get(key)
+        if entry is None:
+            entry = merged[key] = {"primary": DDSketch(), "candidate": DDSketch(), **dict.fromkeys(COMPARISON_COUNTERS, 0)}
+        for name in COMPARISON_COUNTERS:
+            entry[name] += getattr(row, name)
+        entry["primary"].merge(DDSketch.from_json(row.primary_sketch))
+        entry["candidate"].merge(DDSketch.from_json(row.candidate_sketch))
+    return merged
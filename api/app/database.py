@@ -1,24 +1,95 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+import enum
 import os
 from pathlib import Path
+from .config import settings
 
 # Database directory
 DB_DIR = Path("/app/database") if os.path.exists("/app") else Path("./database")
-DB_DIR.mkdir(parents=True, exist_ok=True)
+
+def ensure_db_dir():
+    """Create the database directory (at startup, not on import)"""
+    DB_DIR.mkdir(parents=True, exist_ok=True)
 
 # SQLite database URL
 SQLALCHEMY_DATABASE_URL = f"sqlite:///{DB_DIR}/app.db"
+ASYNC_SQLALCHEMY_DATABASE_URL = f"sqlite+aiosqlite:///{DB_DIR}/app.db"
+
+def sqlite_pragmas(readonly: bool = False) -> list:
+    """Connection pragmas for the production SQLite profile"""
+    pragmas = [
+        f"PRAGMA busy_timeout={settings.SQLITE_BUSY_TIMEOUT_MS}",
+        f"PRAGMA cache_size=-{settings.SQLITE_CACHE_SIZE_KB}",
+        f"PRAGMA mmap_size={settings.SQLITE_MMAP_SIZE_MB * 1024 * 1024}",
+        "PRAGMA temp_store=MEMORY",
+    ]
+    if readonly:
+        pragmas.append("PRAGMA query_only=ON")
+    else:
+        # Only takes effect on new databases (older ones: POST /admin/stats/retention/vacuum);
+        # lets retention free pages incrementally
+        pragmas.append("PRAGMA auto_vacuum=INCREMENTAL")
+        # WAL lets readers run while the writer commits; NORMAL only fsyncs at checkpoints
+        pragmas.append("PRAGMA journal_mode=WAL")
+        pragmas.append(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+    return pragmas
+
+def apply_sqlite_profile(target_engine, readonly: bool = False):
+    """Run the profile pragmas on every new pooled connection of an engine"""
+    pragmas = sqlite_pragmas(readonly)
 
-# Create engine
-engine = create_engine(
+    @event.listens_for(target_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+    return target_engine
+
+# Writer engine (admin writes, migrations, fallback reads)
+engine = apply_sqlite_profile(create_engine(
     SQLALCHEMY_DATABASE_URL,
     connect_args={"check_same_thread": False}
+))
+
+# Read-only pool for admin stats queries, never blocks or is blocked by the writer in WAL mode
+read_engine = apply_sqlite_profile(create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    pool_size=settings.SQLITE_READ_POOL_SIZE,
+    max_overflow=0
+), readonly=True)
+
+# Async engines for the request path so SQLite I/O never blocks the event loop.
+# Request-path writes (usage, logs, key auto-disable) share a single serialized
+# writer connection; key lookups use a separate read-only pool. aiosqlite defaults
+# to NullPool (a new connection and thread per session), so pool explicitly.
+async_engine = create_async_engine(
+    ASYNC_SQLALCHEMY_DATABASE_URL,
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=1,
+    max_overflow=0
+)
+apply_sqlite_profile(async_engine.sync_engine)
+
+async_read_engine = create_async_engine(
+    ASYNC_SQLALCHEMY_DATABASE_URL,
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=settings.SQLITE_READ_POOL_SIZE,
+    max_overflow=0
 )
+apply_sqlite_profile(async_read_engine.sync_engine, readonly=True)
 
 # Session
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+AsyncReadSessionLocal = async_sessionmaker(async_read_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 
 # Base class for models
 Base = declarative_base()
@@ -30,3 +101,69 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# Dependency to get a read-only DB session (admin stats)
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def begin_immediate(db: AsyncSession):
+    """Take the database write lock now, as the session's first statement, so a
+    read-check-write in this transaction is atomic across worker processes"""
+    await db.execute(text("BEGIN IMMEDIATE"))
+
+# Dependency to get async DB session
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# Dependency to get a read-only async DB session (request-path lookups)
+async def get_async_read_db():
+    async with AsyncReadSessionLocal() as db:
+        yield db
+
+def _sql_default(column) -> str:
+    """Render a column's scalar Python default as a SQLite DEFAULT clause"""
+    if column.default is None or not column.default.is_scalar:
+        return ""
+    value = column.default.arg
+    if isinstance(value, enum.Enum):
+        value = value.value
+    if isinstance(value, bool):
+        return f" DEFAULT {int(value)}"
+    if isinstance(value, (int, float)):
+        return f" DEFAULT {value}"
+    if isinstance(value, str):
+        escaped = value.replace("'", "''")
+        return f" DEFAULT '{escaped}'"
+    return ""
+
+def migrate_schema(bind=None) -> list:
+    """Add columns and indexes declared on the models but missing from an existing database.
+
+    create_all() only creates missing tables, so databases created by older
+    versions never receive new columns. New columns must be nullable or have
+    a scalar default. Returns the list of applied changes.
+    """
+    bind = bind or engine
+    applied = []
+    inspector = inspect(bind)
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {col["name"] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                col_type = column.type.compile(dialect=bind.dialect)
+                conn.execute(text(
+                    f'ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}{_sql_default(column)}'
+                ))
+                applied.append(f"{table.name}.{column.name}")
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+    return applied
@@ -1,21 +1,21 @@
 from fastapi import HTTPException, Security, Depends, Request
 from fastapi.security.api_key import APIKeyHeader
 from starlette.status import HTTP_403_FORBIDDEN, HTTP_429_TOO_MANY_REQUESTS
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime
+from typing import Optional
 from .config import settings
-from .database import get_db
-from .crud.api_keys import get_api_key_by_value
-from .crud.logs import get_today_request_count
+from .database import get_async_read_db, AsyncSessionLocal
+from .crud.api_keys import get_api_key_by_value_async, deactivate_api_key_async
+from .crud.logs import get_today_request_count_async
+from .models.db_models import ApiKey
+from .usage import usage_tracker
+from .log_writer import request_log_writer
 
 api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
 
-async def get_api_key(
-    request: Request,
-    api_key_header: str = Security(api_key_header),
-    db: Session = Depends(get_db)
-):
-    """Validate API key from database with expiration and rate limit checks"""
+async def check_api_key(db: AsyncSession, api_key_header: Optional[str]) -> ApiKey:
+    """Key record for an API key value after expiration and daily limit checks (raises HTTPException)"""
     if not api_key_header:
         raise HTTPException(
             status_code=HTTP_403_FORBIDDEN, 
@@ -23,7 +23,7 @@ async def get_api_key(
         )
     
     # Get key from database
-    key_record = get_api_key_by_value(db, api_key_header)
+    key_record = await get_api_key_by_value_async(db, api_key_header)
     if not key_record:
         raise HTTPException(
             status_code=HTTP_403_FORBIDDEN, 
@@ -40,9 +40,9 @@ async def get_api_key(
     # Check if expired
     if key_record.expires_at:
         if datetime.utcnow() > key_record.expires_at:
-            # Auto-disable expired key
-            key_record.is_active = False
-            db.commit()
+            # Auto-disable expired key (through the writer, lookups use a read-only session)
+            async with AsyncSessionLocal() as write_db:
+                await deactivate_api_key_async(write_db, key_record.id)
             raise HTTPException(
                 status_code=HTTP_403_FORBIDDEN, 
                 detail="API key has expired"
@@ -50,19 +50,33 @@ async def get_api_key(
     
     # Check daily limit
     if key_record.daily_limit and key_record.daily_limit > 0:
-        today_requests = get_today_request_count(db, key_record.id)
+        today_requests = await get_today_request_count_async(db, key_record.id) + request_log_writer.pending_today(key_record.id)
         if today_requests >= key_record.daily_limit:
             raise HTTPException(
                 status_code=HTTP_429_TOO_MANY_REQUESTS, 
                 detail=f"Daily request limit ({key_record.daily_limit}) exceeded"
             )
     
-    # Update last_used_at and increment counter
-    key_record.last_used_at = datetime.utcnow()
-    key_record.request_count += 1
-    db.commit()
+    return key_record
+
+async def get_api_key(
+    request: Request,
+    api_key_header: str = Security(api_key_header),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    """Validate API key from database with expiration and rate limit checks"""
+    key_record = await check_api_key(db, api_key_header)
+    
+    # Return the pooled read connection now rather than after a possibly slow detection
+    await db.close()
+    
+    # Update last_used_at and increment counter (batched, flushed in the background)
+    usage_tracker.record(key_record.id)
     
-    # Store key info in request state for logging
+    # Store key info in request state for logging and inference scheduling
     request.state.api_key_id = key_record.id
+    request.state.priority_weight = key_record.priority_weight
+    request.state.max_queue_length = key_record.max_queue_length
+    request.state.job_image_quota = key_record.job_image_quota
     
     return api_key_header
\ No newline at end of file
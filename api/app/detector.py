@@ -1,73 +1,215 @@
-from ultralytics import YOLO
+"""Model loading and YOLO inference.
+
+ultralytics (which imports torch) and OpenCV are imported on first use or by
+preload(), so importing this module is cheap. Admin-only code can ask for the
+model status without paying for the inference stack.
+"""
 from .config import settings
+from .metrics import metrics
 import tempfile
 import base64
-import cv2
-import numpy as np
 import os
+import threading
+import time
 from datetime import datetime
 from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy as np
 
 # Lazy-loaded model
 _model = None
+_model_id = None  # ModelFile.id of the loaded model
 _model_load_error = None
+_predict_kwargs = {}  # Fixed input size when running a compiled artifact
 
-def get_model():
-    """Get YOLO model from database active model."""
-    global _model, _model_load_error
-    
-    if _model is None and _model_load_error is None:
-        try:
-            # Import here to avoid circular dependency
-            from .database import SessionLocal
-            from .crud.models import get_active_model
-            
-            # Get active model from database
-            db = SessionLocal()
+# Canary/shadow candidate (see rollout.py): (model_id, model, predict kwargs) once loaded
+_candidate = None
+_candidate_loading = None  # model_id being loaded in the background
+_candidate_retry = None  # (model_id, failed attempts, time.monotonic() of the next attempt)
+_candidate_generation = 0  # bumped by release_candidate, so a load finishing afterwards is dropped
+_candidate_lock = threading.Lock()
+CANDIDATE_RETRY_SECONDS = 5  # doubled after every failed load
+CANDIDATE_RETRY_MAX_SECONDS = 300
+# YOLO predictors keep per-call state, so one model instance runs one inference at a time
+_model_locks = {}
+_load_lock = threading.Lock()
+# False in the pre-fork master, which exports missing artifacts in a forked process instead
+SCHEDULE_ARTIFACT_BUILDS = True
+# Recent plot + PNG encode time, to skip visualizations a client deadline leaves no time for
+_visual_seconds = 0.0
+
+def preload():
+    """Import the inference stack ahead of the first request (blocking; run in a thread at startup)"""
+    import cv2  # noqa: F401
+    from ultralytics import YOLO  # noqa: F401
+
+def _load(model_path: str, digest: str = None):
+    """(model, predict kwargs): the compiled artifact when one exists for these weights, else the .pt"""
+    from ultralytics import YOLO
+    if settings.MODEL_ARTIFACTS and digest:
+        from .model_artifacts import find_artifact, schedule_build
+        found = find_artifact(digest)
+        if found is None:
+            # Load the .pt this time; the next start or activation uses the artifact
+            if SCHEDULE_ARTIFACT_BUILDS:
+                schedule_build(model_path, digest)
+        else:
+            path, meta = found
             try:
-                active_model = get_active_model(db)
-                if not active_model:
-                    _model_load_error = "No active model found. Please upload and activate a model via the admin dashboard."
-                    print(f"⚠ WARNING: {_model_load_error}")
-                    return None
-                
-                model_path = active_model.file_path
-                print(f"📦 Using active model from database: {model_path}")
-            finally:
-                db.close()
+                start = time.perf_counter()
+                model = YOLO(str(path), task=meta.get("task", "detect"))
+                print(f"✓ Using compiled artifact {path.name} ({(time.perf_counter() - start) * 1000:.0f}ms)")
+                return model, {"imgsz": meta["imgsz"]}
+            except Exception as e:
+                print(f"⚠ Compiled artifact unusable, loading {model_path}: {e}")
+    return YOLO(model_path), {}
+
+def _load_active_model():
+    global _model, _model_id, _model_load_error, _predict_kwargs
+    try:
+        # Import here to avoid circular dependency
+        from .database import SessionLocal
+        from .crud.models import get_active_model
             
-            # Check if model file exists
-            if not os.path.exists(model_path):
-                _model_load_error = f"Model file not found at {model_path}. Please re-upload the model."
+        # Get active model from database
+        db = SessionLocal()
+        try:
+            active_model = get_active_model(db)
+            if not active_model:
+                _model_load_error = "No active model found. Please upload and activate a model via the admin dashboard."
                 print(f"⚠ WARNING: {_model_load_error}")
-                return None
+                return
+                
+            model_path = active_model.file_path
+            model_id = active_model.id
+            digest = active_model.sha256
+            print(f"📦 Using active model from database: {model_path}")
+        finally:
+            db.close()
             
-            # Check if path is directory
-            if os.path.isdir(model_path):
-                _model_load_error = f"Model path is a directory: {model_path}."
-                print(f"⚠ WARNING: {_model_load_error}")
-                return None
+        # Check if model file exists
+        if not os.path.exists(model_path):
+            _model_load_error = f"Model file not found at {model_path}. Please re-upload the model."
+            print(f"⚠ WARNING: {_model_load_error}")
+            return
             
-            # Load model
-            _model = YOLO(model_path)
-            print(f"✓ Model loaded successfully: {model_path}")
+        # Check if path is directory
+        if os.path.isdir(model_path):
+            _model_load_error = f"Model path is a directory: {model_path}."
+            print(f"⚠ WARNING: {_model_load_error}")
+            return
             
-        except Exception as e:
-            _model_load_error = str(e)
-            print(f"✗ ERROR loading model: {_model_load_error}")
-            return None
-    
+        # Load model
+        _model, _predict_kwargs = _load(model_path, digest)
+        _model_id = model_id
+        print(f"✓ Model loaded successfully: {model_path}")
+            
+    except Exception as e:
+        _model_load_error = str(e)
+        print(f"✗ ERROR loading model: {_model_load_error}")
+
+def get_model():
+    """Get YOLO model from database active model."""
+    if _model is None and _model_load_error is None:
+        # Detections run on the request threadpool; only one of them loads the model
+        with _load_lock:
+            if _model is None and _model_load_error is None:
+                _load_active_model()
     return _model
 
-def _encode_visualization(vis_ndarray: np.ndarray) -> str:
+def get_loaded_model_id():
+    """ModelFile.id of the currently loaded model, or None"""
+    return _model_id if _model is not None else None
+
+def get_model_status() -> str:
+    """'loaded', 'error' (last load attempt failed) or 'not_loaded'; never triggers a load"""
+    if _model is not None:
+        return "loaded"
+    if _model_load_error is not None:
+        return "error"
+    return "not_loaded"
+
+def warm_up():
+    """Load the active model and run one inference, so layer fusion and lazy setup happen now (blocking)"""
+    import cv2
+    import numpy as np
+    model, model_id, predict_kwargs = require_model()
+    size = predict_kwargs.get("imgsz", 640)
+    success, png = cv2.imencode('.png', np.full((size, size, 3), 255, dtype=np.uint8))
+    run_model(model, model_id, predict_kwargs, png.tobytes())
+
+def require_model():
+    """(model, model_id, predict kwargs) of the active model; raises RuntimeError if unavailable"""
+    model = get_model()
+    if model is None:
+        raise RuntimeError(f"Model not available. {_model_load_error or 'Please upload a model first.'}")
+    return model, _model_id, _predict_kwargs
+
+def get_candidate_model(model_id: int, model_path: str, digest: str = None):
+    """(model, predict kwargs) of a rollout candidate; (None, {}) until it has loaded
+
+    The first call starts loading it on a background thread, so requests are
+    served by the active model alone meanwhile. A failed load is retried after
+    a backoff of CANDIDATE_RETRY_SECONDS, doubling up to CANDIDATE_RETRY_MAX_SECONDS.
+    """
+    global _candidate_loading
+    candidate = _candidate
+    if candidate is not None and candidate[0] == model_id:
+        return candidate[1], candidate[2]
+    with _candidate_lock:
+        if _candidate_loading is not None:
+            return None, {}
+        if _candidate_retry is not None and _candidate_retry[0] == model_id and time.monotonic() < _candidate_retry[2]:
+            return None, {}
+        _candidate_loading = model_id
+        generation = _candidate_generation
+    threading.Thread(
+        target=_load_candidate, args=(model_id, model_path, digest, generation),
+        name="candidate-load", daemon=True
+    ).start()
+    return None, {}
+
+def _load_candidate(model_id: int, model_path: str, digest: str, generation: int):
+    global _candidate, _candidate_loading, _candidate_retry
+    try:
+        model, kwargs = _load(model_path, digest)
+    except Exception as e:
+        with _candidate_lock:
+            failures = _candidate_retry[1] + 1 if _candidate_retry is not None and _candidate_retry[0] == model_id else 1
+            delay = min(CANDIDATE_RETRY_MAX_SECONDS, CANDIDATE_RETRY_SECONDS * 2 ** (failures - 1))
+            _candidate_retry = (model_id, failures, time.monotonic() + delay)
+            _candidate_loading = None
+        print(f"⚠ Candidate model {model_id} failed to load (attempt {failures}), retrying in {delay}s: {e}")
+        return
+    with _candidate_lock:
+        current = generation == _candidate_generation
+        if current:
+            _candidate = (model_id, model, kwargs)
+            _candidate_retry = None
+        _candidate_loading = None
+    if current:
+        print(f"✓ Candidate model loaded: {model_path}")
+
+def release_candidate():
+    global _candidate, _candidate_retry, _candidate_generation
+    with _candidate_lock:
+        _candidate = None
+        _candidate_retry = None
+        _candidate_generation += 1
+
+def _encode_visualization(vis_ndarray: "np.ndarray") -> str:
     """Encode numpy image (BGR) to PNG and then base64"""
+    import cv2
     success, png = cv2.imencode('.png', vis_ndarray)
     if not success:
         return None
     return base64.b64encode(png.tobytes()).decode('ascii')
 
-def _save_visualization(vis_ndarray: np.ndarray, original_filename: str = None) -> str:
+def _save_visualization(vis_ndarray: "np.ndarray", original_filename: str = None) -> str:
     """Save visualization to temp folder and return the path"""
+    import cv2
     # Create temp results directory if not exists
     temp_dir = Path(settings.TEMP_RESULTS_DIR)
     temp_dir.mkdir(parents=True, exist_ok=True)
@@ -86,25 +228,34 @@ def _save_visualization(vis_ndarray: np.ndarray, original_filename: str = None)
     
     return str(output_path)
 
-def detect_image_bytes(image_bytes: bytes, include_visual: bool = True, save_file: bool = False, original_filename: str = None) -> dict:
-    """Run YOLO detection on image bytes and return structured result.
+def _extract_boxes(r) -> list:
+    boxes = []
+    if hasattr(r, 'boxes') and len(r.boxes):
+        coords = r.boxes.xyxy.cpu().numpy()
+        confs = r.boxes.conf.cpu().numpy()
+        classes = r.boxes.cls.cpu().numpy()
+        for c, conf, cl in zip(coords, confs, classes):
+            boxes.append({'xyxy': [float(v) for v in c], 'confidence': float(conf), 'class': int(cl)})
+    return boxes
 
-    Args:
-        image_bytes: raw image bytes (PNG/JPEG)
-        include_visual: include base64 PNG visualization in the result
-        save_file: save visualization to temp folder
-        original_filename: original filename for better naming
+def run_model(
+    model,
+    model_id: int,
+    predict_kwargs: dict,
+    image_bytes: bytes,
+    include_visual: bool = False,
+    save_file: bool = False,
+    original_filename: str = None,
+    blocking: bool = True,
+    deadline: float = None
+):
+    """(result, inference ms) for one model; None if blocking=False and the model is busy
 
-    Returns: {
-        'boxes': [ { 'xyxy': [x1,y1,x2,y2], 'confidence': float, 'class': int }, ... ],
-        'visualization': base64_png_or_none (only present if include_visual=True),
-        'saved_path': file_path_or_none (only present if save_file=True)
-    }
+    `deadline` (time.monotonic()) is when the client gives up; the visualization is
+    skipped if it would not be ready by then.
     """
-    # Check if model is available
-    model = get_model()
-    if model is None:
-        raise RuntimeError(f"Model not available. {_model_load_error or 'Please upload a model first.'}")
+    global _visual_seconds
+    lock = _model_locks.setdefault(model_id, threading.Lock())
     
     # write to temp file because ultralytics model expects a path or array; path is simplest
     tmp_path = None
@@ -113,31 +264,38 @@ def detect_image_bytes(image_bytes: bytes, include_visual: bool = True, save_fil
             tmp.write(image_bytes)
             tmp_path = tmp.name
 
-        results = model(tmp_path)
+        if not lock.acquire(blocking=blocking):
+            return None
+        try:
+            start = time.perf_counter()
+            results = model(tmp_path, **predict_kwargs)
+            inference_ms = (time.perf_counter() - start) * 1000
+        finally:
+            lock.release()
 
         if len(results) == 0:
-            return {'boxes': [], 'visualization': None}
+            return {'boxes': [], 'visualization': None}, inference_ms
 
         r = results[0]
-
-        boxes = []
-        if hasattr(r, 'boxes') and len(r.boxes):
-            coords = r.boxes.xyxy.cpu().numpy()
-            confs = r.boxes.conf.cpu().numpy()
-            classes = r.boxes.cls.cpu().numpy()
-            for c, conf, cl in zip(coords, confs, classes):
-                boxes.append({'xyxy': [float(v) for v in c], 'confidence': float(conf), 'class': int(cl)})
+        boxes = _extract_boxes(r)
 
         # visualization (optional)
         vis_b64 = None
         saved_path = None
+        visual_skipped = False
+        if include_visual and deadline is not None and time.monotonic() + _visual_seconds > deadline:
+            visual_skipped = True
+            metrics.inc("visualizations_skipped")
         
-        if include_visual or save_file:
+        if (include_visual and not visual_skipped) or save_file:
             try:
+                start = time.perf_counter()
                 vis = r.plot()  # returns numpy BGR image
                 
-                if include_visual:
+                if include_visual and not visual_skipped:
                     vis_b64 = _encode_visualization(vis)
+                    elapsed = time.perf_counter() - start
+                    _visual_seconds = 0.8 * _visual_seconds + 0.2 * elapsed if _visual_seconds else elapsed
                 
                 if save_file:
                     saved_path = _save_visualization(vis, original_filename)
@@ -148,13 +306,79 @@ def detect_image_bytes(image_bytes: bytes, include_visual: bool = True, save_fil
         result = {'boxes': boxes}
         if include_visual:
             result['visualization'] = vis_b64
+        if visual_skipped:
+            result['visualization_skipped'] = True
         if save_file:
             result['saved_path'] = saved_path
 
-        return result
+        return result, inference_ms
     finally:
         try:
             if tmp_path and os.path.exists(tmp_path):
                 os.remove(tmp_path)
         except Exception:
             pass
+
+def run_batch(model, model_id: int, predict_kwargs: dict, images: list, include_visual: bool = False) -> list:
+    """Detect several images in one model call (blocking); one (result, error) per image.
+
+    If the batch fails as a whole, the images are retried one by one so that a
+    bad image only fails itself.
+    """
+    lock = _model_locks.setdefault(model_id, threading.Lock())
+    tmp_paths = []
+    try:
+        for image_bytes in images:
+            with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp:
+                tmp.write(image_bytes)
+                tmp_paths.append(tmp.name)
+        try:
+            with lock:
+                results = model(tmp_paths, **predict_kwargs)
+        except Exception:
+            results = None
+
+        outcomes = []
+        if results is None or len(results) != len(images):
+            for image_bytes in images:
+                try:
+                    outcomes.append((run_model(model, model_id, predict_kwargs, image_bytes, include_visual)[0], None))
+                except Exception as e:
+                    outcomes.append((None, str(e)))
+            return outcomes
+
+        for r in results:
+            result = {'boxes': _extract_boxes(r)}
+            if include_visual:
+                try:
+                    result['visualization'] = _encode_visualization(r.plot())
+                except Exception:
+                    result['visualization'] = None
+            outcomes.append((result, None))
+        return outcomes
+    finally:
+        for tmp_path in tmp_paths:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+def detect_image_bytes(image_bytes: bytes, include_visual: bool = True, save_file: bool = False, original_filename: str = None) -> dict:
+    """Run YOLO detection on image bytes and return structured result.
+
+    Args:
+        image_bytes: raw image bytes (PNG/JPEG)
+        include_visual: include base64 PNG visualization in the result
+        save_file: save visualization to temp folder
+        original_filename: original filename for better naming
+
+    Returns: {
+        'boxes': [ { 'xyxy': [x1,y1,x2,y2], 'confidence': float, 'class': int }, ... ],
+        'visualization': base64_png_or_none (only present if include_visual=True),
+        'saved_path': file_path_or_none (only present if save_file=True)
+    }
+    """
+    # Check if model is available
+    model, model_id, predict_kwargs = require_model()
+    result, _ = run_model(model, model_id, predict_kwargs, image_bytes, include_visual, save_file, original_filename)
+    return result
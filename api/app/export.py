@@ -0,0 +1,162 @@
+"""Streaming request-log export (CSV, NDJSON, Parquet).
+
+Rows are read in (timestamp, id) order, one keyset page of _CHUNK_ROWS at a
+time, each in its own short read transaction, and encoded page by page. A
+slow client therefore holds no read connection or WAL snapshot between
+pages, and memory stays constant for any time range. The ordering is
+stable: an interrupted export resumes by passing the timestamp and id of
+the last row received as after_timestamp / after_id. Parquet needs the
+optional pyarrow package.
+
+The export is not a billing record. Rows older than LOG_RETENTION_DAYS are
+in the monthly archive files (retention.py), not here, and under load the
+log writer keeps only 1 in LOG_SAMPLE_RATE successful requests and drops
+logs when its queue is full. Usage rollups count every request.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+from typing import Iterator, Optional
+from sqlalchemy import select, tuple_
+from .database import read_engine
+from .models.db_models import ApiKey, RequestLog
+
+EXPORT_FORMATS = ("csv", "ndjson", "parquet")
+EXPORT_COLUMNS = [
+    "id", "timestamp", "api_key_id", "api_key_name", "endpoint", "status_code",
+    "response_time_ms", "model_id", "file_size_bytes", "ip_address", "user_agent", "error_message",
+]
+MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson", "parquet": "application/vnd.apache.parquet"}
+
+_CHUNK_ROWS = 5000
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def _rows(
+    start: datetime,
+    end: datetime,
+    api_key_id: Optional[int] = None,
+    after: Optional[tuple] = None
+) -> Iterator[tuple]:
+    columns = [getattr(RequestLog, name) if name != "api_key_name" else ApiKey.name for name in EXPORT_COLUMNS]
+    query = (
+        select(*columns)
+        .outerjoin(ApiKey, ApiKey.id == RequestLog.api_key_id)
+        .where(RequestLog.timestamp >= start, RequestLog.timestamp < end)
+        .order_by(RequestLog.timestamp, RequestLog.id)
+    )
+    if api_key_id:
+        query = query.where(RequestLog.api_key_id == api_key_id)
+
+    while True:
+        page = query.limit(_CHUNK_ROWS)
+        if after is not None:
+            page = page.where(tuple_(RequestLog.timestamp, RequestLog.id) > tuple_(*after))
+        # Connection returned before the page is sent, however slow the client is
+        with read_engine.connect() as conn:
+            rows = conn.execute(page).fetchall()
+        yield from rows
+        if len(rows) < _CHUNK_ROWS:
+            return
+        after = (rows[-1][1], rows[-1][0])  # (timestamp, id)
+
+def _chunked(rows: Iterator[tuple]) -> Iterator[list]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= _CHUNK_ROWS:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _csv_chunks(rows: Iterator[tuple]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for chunk in _chunked(rows):
+        writer.writerows(
+            [value.isoformat() if isinstance(value, datetime) else value for value in row] for row in chunk
+        )
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+def _ndjson_chunks(rows: Iterator[tuple]) -> Iterator[bytes]:
+    for chunk in _chunked(rows):
+        yield "".join(
+            json.dumps(dict(zip(EXPORT_COLUMNS, row)), default=datetime.isoformat) + "\n" for row in chunk
+        ).encode()
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands written bytes back to the generator"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def take(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+def _parquet_chunks(rows: Iterator[tuple]) -> Iterator[bytes]:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ("id", pa.int64()), ("timestamp", pa.timestamp("us")), ("api_key_id", pa.int64()),
+        ("api_key_name", pa.string()), ("endpoint", pa.string()), ("status_code", pa.int32()),
+        ("response_time_ms", pa.float64()), ("model_id", pa.int64()), ("file_size_bytes", pa.int64()),
+        ("ip_address", pa.string()), ("user_agent", pa.string()), ("error_message", pa.string()),
+    ])
+    sink = _ChunkSink()
+    # One row group per chunk, written out as soon as it is encoded
+    with pq.ParquetWriter(sink, schema, compression="snappy") as writer:
+        for chunk in _chunked(rows):
+            columns = list(zip(*chunk))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema
+            ))
+            yield sink.take()
+    yield sink.take()
+
+def _gzip(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def stream_request_logs(
+    fmt: str,
+    start: datetime,
+    end: datetime,
+    api_key_id: Optional[int] = None,
+    after: Optional[tuple] = None,
+    gzip: bool = False
+) -> Iterator[bytes]:
+    """Encoded export body; iterate it from a worker thread (StreamingResponse does)"""
+    encoders = {"csv": _csv_chunks, "ndjson": _ndjson_chunks, "parquet": _parquet_chunks}
+    chunks = encoders[fmt](_rows(start, end, api_key_id=api_key_id, after=after))
+    return _gzip(chunks) if gzip else chunks
@@ -0,0 +1,123 @@
+"""Background processing for the job API (see routers/jobs.py).
+
+Submitted images are stored in detection_job_items, so queued work survives
+restarts. Every worker process runs a JobWorker. It claims up to
+JOB_BATCH_SIZE queued images and runs them through the model in one call.
+Each batch waits for an inference slot in its own scheduler queue, weighted
+JOB_PRIORITY_WEIGHT. Interactive /detect traffic therefore goes first, but
+jobs are never starved.
+
+If a worker dies mid-batch, its claimed images are queued again after
+JOB_LEASE_SECONDS. Finished jobs keep their results for JOB_RESULT_TTL_HOURS,
+and the retention job deletes them after that.
+"""
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta
+from fastapi.concurrency import run_in_threadpool
+from . import detector
+from .config import settings
+from .crud import jobs as crud_jobs
+from .database import AsyncSessionLocal, SessionLocal
+from .metrics import metrics
+from .scheduler import inference_scheduler
+
+JOBS_QUEUE = "jobs"  # scheduler queue shared by all job batches
+REQUEUE_INTERVAL_SECONDS = 60
+
+def _detect_batch(rows: list) -> list:
+    """(item_id, job_id, result_json, error, model_id) per claimed row (blocking)"""
+    model, model_id, predict_kwargs = detector.require_model()
+    outcomes = []
+    for include_visual in (False, True):
+        group = [row for row in rows if bool(row.include_visual) == include_visual]
+        if not group:
+            continue
+        results = detector.run_batch(model, model_id, predict_kwargs, [row.image for row in group], include_visual)
+        for row, (result, error) in zip(group, results):
+            outcomes.append((
+                row.id, row.job_id,
+                json.dumps(result) if result is not None else None,
+                error,
+                model_id if error is None else None
+            ))
+    return outcomes
+
+class JobWorker:
+    """Drains queued job images in batches at low priority"""
+
+    def __init__(self):
+        self._task = None
+        self._requeued_at = 0.0
+
+    def start(self):
+        if settings.JOB_WORKER and settings.ENABLE_INFERENCE and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                processed = await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠ Job worker error: {e}")
+                processed = 0
+            if not processed:
+                await asyncio.sleep(settings.JOB_POLL_SECONDS)
+
+    async def run_once(self) -> int:
+        """Claim and process one batch; returns the number of images processed"""
+        if time.monotonic() - self._requeued_at > REQUEUE_INTERVAL_SECONDS:
+            self._requeued_at = time.monotonic()
+            async with AsyncSessionLocal() as db:
+                requeued = await crud_jobs.requeue_stale_job_items_async(
+                    db, datetime.utcnow() - timedelta(seconds=settings.JOB_LEASE_SECONDS)
+                )
+            if requeued:
+                print(f"⚠ Job worker: re-queued {requeued} images from an interrupted batch")
+
+        # Nothing to do without a model; don't claim images just to give them back
+        if await run_in_threadpool(detector.get_model) is None:
+            return 0
+
+        async with AsyncSessionLocal() as db:
+            rows = await crud_jobs.claim_job_items_async(db, settings.JOB_BATCH_SIZE)
+        if not rows:
+            return 0
+
+        try:
+            ticket = inference_scheduler.enter(JOBS_QUEUE, settings.JOB_PRIORITY_WEIGHT, 0, cost=len(rows), shed=False)
+            async with ticket:
+                outcomes = await ticket.hold(run_in_threadpool(_detect_batch, rows))
+        except BaseException:
+            async with AsyncSessionLocal() as db:
+                await crud_jobs.release_job_items_async(db, [row.id for row in rows])
+            raise
+
+        async with AsyncSessionLocal() as db:
+            await crud_jobs.complete_job_items_async(db, outcomes, timedelta(hours=settings.JOB_RESULT_TTL_HOURS))
+        failed = sum(1 for outcome in outcomes if outcome[3])
+        metrics.inc("job_images_processed", len(outcomes) - failed)
+        metrics.inc("job_images_failed", failed)
+        return len(outcomes)
+
+def prune_expired_jobs() -> int:
+    """Delete finished jobs past their expiry (run by the retention job)"""
+    db = SessionLocal()
+    try:
+        return crud_jobs.delete_expired_jobs(db, datetime.utcnow())
+    finally:
+        db.close()
+
+job_worker = JobWorker()
@@ -0,0 +1,149 @@
+"""Live admin dashboard updates over server-sent events.
+
+Requests are recorded into in-memory counters (no database access). Every
+LIVE_TICK_SECONDS, one broadcaster task per worker publishes its counters to
+the host's shared telemetry file (see telemetry.py). If the worker has open
+streams, it turns every worker's ticks into one event and fans the same
+serialized event out to all of them. The cost per tick is therefore the same
+for one dashboard tab or fifty, and the numbers cover all workers. A
+subscriber that falls behind misses ticks instead of buffering them.
+"""
+import asyncio
+import json
+import threading
+from datetime import datetime
+from .config import settings
+from .detector import get_loaded_model_id, get_model_status
+from .log_writer import request_log_writer
+from .metrics import metrics
+from .sketches import DDSketch, summarize
+from .telemetry import shared_telemetry
+
+class LiveStats:
+    """Per-tick request counters plus a subscriber fan-out"""
+
+    def __init__(self, tick_seconds: float, window_ticks: int):
+        self.tick_seconds = tick_seconds
+        # Rates and percentiles are reported over a sliding window of recent ticks
+        self.window_seconds = max(1, window_ticks) * tick_seconds
+        self._lock = threading.Lock()
+        self._reset()
+        self._subscribers = set()
+        self._last_model = None
+        self._last_id = 0  # last shared tick row included in an event
+        self._seq = 0
+        self._task = None
+
+    def _reset(self):
+        self._requests = 0
+        self._errors = 0
+        self._sketch = DDSketch()
+        self._key_usage = {}
+
+    def record(self, api_key_id: int, status_code: int, latency_ms: float):
+        with self._lock:
+            self._requests += 1
+            if status_code >= 400:
+                self._errors += 1
+            self._sketch.add(latency_ms)
+            self._key_usage[api_key_id] = self._key_usage.get(api_key_id, 0) + 1
+
+    def _publish_shared(self, counters: tuple, snapshot: dict, read: bool):
+        """Publish this worker's tick and metrics; with `read`, all workers' ticks since the last event (blocking)"""
+        row_id = shared_telemetry.publish_tick(
+            *counters, keep_seconds=self.window_seconds + 2 * self.tick_seconds
+        )
+        shared_telemetry.publish_metrics(snapshot)
+        if not read:
+            # No streams open here: the next event starts counting from now
+            self._last_id = row_id
+            return None
+        totals = shared_telemetry.read_ticks(self._last_id, self.window_seconds)
+        self._last_id = totals["last_id"]
+        return totals
+
+    async def _tick(self):
+        """Publish the tick; returns the event if anyone here is listening"""
+        with self._lock:
+            counters = (self._requests, self._errors, self._sketch, self._key_usage, request_log_writer.depth())
+            self._reset()
+        listening = bool(self._subscribers)
+        totals = await asyncio.to_thread(self._publish_shared, counters, metrics.snapshot(), listening)
+        if totals is None:
+            return None
+
+        window_requests = totals["window_requests"]
+        model = {"status": get_model_status(), "model_id": get_loaded_model_id()}
+        model_changed = self._last_model is not None and model != self._last_model
+        self._last_model = model
+        self._seq += 1
+
+        now = datetime.utcnow().isoformat()
+        return {
+            "seq": self._seq,
+            "time": now,
+            "tick_seconds": self.tick_seconds,
+            "window_seconds": self.window_seconds,
+            "workers": totals["workers"],
+            "requests": totals["requests"],
+            "errors": totals["errors"],
+            "request_rate": round(window_requests / self.window_seconds, 2),
+            "error_rate": round(totals["window_errors"] / window_requests * 100, 2) if window_requests else 0.0,
+            "latency": summarize(totals["window_sketch"]),
+            "log_queue_depth": totals["log_queue_depth"],
+            "key_usage": {key_id: {"requests": count, "last_used_at": now} for key_id, count in totals["key_usage"].items()},
+            "model": model,
+            "model_changed": model_changed,
+        }
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=4)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def _publish(self, message):
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                pass
+
+    async def run(self):
+        """Tick until cancelled; counters are reset every tick even with no subscribers"""
+        while True:
+            await asyncio.sleep(self.tick_seconds)
+            try:
+                event = await self._tick()
+            except Exception as e:
+                print(f"⚠ Live stats tick failed: {e}")
+                continue
+            if event is not None and self._subscribers:
+                self._publish(f"id: {event['seq']}\nevent: tick\ndata: {json.dumps(event)}\n\n")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Stop ticking and end all open streams"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # None ends a stream; make room for it even in a backed-up queue
+        for queue in list(self._subscribers):
+            while queue.full():
+                queue.get_nowait()
+            queue.put_nowait(None)
+
+live_stats = LiveStats(settings.LIVE_TICK_SECONDS, settings.LIVE_WINDOW_TICKS)
+metrics.gauge("live_stream_subscribers", live_stats.subscriber_count)
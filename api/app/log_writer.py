@@ -0,0 +1,161 @@
+"""Background request-log pipeline.
+
+The logging middleware enqueues a compact tuple per request into a bounded
+queue; a writer task bulk-inserts the queue into request_logs with one
+executemany per batch. When the queue is nearly full, successful requests
+are sampled (errors are always kept); when it is full, records are dropped.
+Queue depth, dropped and sampled-out counts are exported as metrics.
+
+Every record also feeds the hourly usage rollups and latency sketches (see
+rollups.py, sketches.py) before sampling. Their deltas, and the rollout
+comparison deltas (see rollout.py), are written in the same transaction as
+the log batch.
+"""
+import asyncio
+import random
+from datetime import datetime
+from .config import settings
+from .database import async_engine
+from .metrics import metrics
+from .models.db_models import RequestLog
+from .rollups import rollup_accumulator, apply_rollups
+from .sketches import sketch_accumulator, apply_sketches
+from .rollout import comparison_accumulator, apply_comparisons
+
+# Field order of the queued tuples
+LOG_FIELDS = (
+    "api_key_id", "endpoint", "status_code", "response_time_ms", "timestamp",
+    "ip_address", "user_agent", "error_message", "file_size_bytes", "model_id",
+)
+
+class RequestLogWriter:
+    """Bounded queue of request logs drained by a batching writer task"""
+
+    def __init__(self):
+        self._queue = None
+        self._task = None
+
+    @property
+    def queue(self) -> asyncio.Queue:
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=settings.LOG_QUEUE_MAXSIZE)
+        return self._queue
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def pending_today(self, api_key_id: int) -> int:
+        """Requests for a key today that are not yet in usage_rollups, for daily limits.
+
+        Counted in enqueue() before sampling and queue drops, so sampled-out and
+        dropped logs still count.
+        """
+        today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        return rollup_accumulator.pending_since(api_key_id, today_start)
+
+    def enqueue(
+        self,
+        api_key_id: int,
+        endpoint: str,
+        status_code: int,
+        response_time_ms: float,
+        ip_address: str = None,
+        user_agent: str = None,
+        error_message: str = None,
+        file_size_bytes: int = None,
+        model_id: int = None
+    ) -> bool:
+        """Queue a log record without blocking. Returns False if it was dropped."""
+        timestamp = datetime.utcnow()
+        rollup_accumulator.add(api_key_id, timestamp, status_code, response_time_ms)
+        sketch_accumulator.add(api_key_id, model_id, timestamp, response_time_ms)
+        
+        queue = self.queue
+        if status_code < 400 and queue.qsize() >= queue.maxsize * settings.LOG_SAMPLE_THRESHOLD:
+            # Under pressure keep every error but only 1 in LOG_SAMPLE_RATE successes
+            if random.randrange(settings.LOG_SAMPLE_RATE) != 0:
+                metrics.inc("request_logs_sampled_out")
+                return False
+        try:
+            queue.put_nowait((
+                api_key_id, endpoint, status_code, response_time_ms, timestamp,
+                ip_address, user_agent, error_message, file_size_bytes, model_id
+            ))
+        except asyncio.QueueFull:
+            metrics.inc("request_logs_dropped")
+            return False
+        metrics.inc("request_logs_enqueued")
+        return True
+
+    def _drain(self) -> list:
+        batch = []
+        while len(batch) < settings.LOG_BATCH_SIZE:
+            try:
+                batch.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return batch
+
+    async def _insert(self, batch: list, rollup_delta: dict, sketch_delta: dict, comparison_delta: dict):
+        rows = [dict(zip(LOG_FIELDS, record)) for record in batch]
+        async with async_engine.begin() as conn:
+            # The log INSERT takes the write lock before rollups/sketches are read and merged
+            if rows:
+                await conn.execute(RequestLog.__table__.insert(), rows)
+            await apply_rollups(conn, rollup_delta)
+            await apply_sketches(conn, sketch_delta)
+            await apply_comparisons(conn, comparison_delta)
+
+    async def _write(self, batch: list, rollup_delta: dict, sketch_delta: dict, comparison_delta: dict):
+        try:
+            await self._insert(batch, rollup_delta, sketch_delta, comparison_delta)
+            if rollup_delta:
+                rollup_accumulator.flush_count += 1
+            metrics.inc("request_logs_written", len(batch))
+        except Exception as e:
+            # Rollups, sketches and comparisons are retried with the next flush, raw logs are dropped
+            rollup_accumulator.merge_back(rollup_delta)
+            sketch_accumulator.merge_back(sketch_delta)
+            comparison_accumulator.merge_back(comparison_delta)
+            metrics.inc("request_logs_write_errors", len(batch))
+            print(f"⚠ Failed to write {len(batch)} request logs: {e}")
+
+    async def flush(self):
+        """Write everything currently queued, plus pending rollup, sketch and comparison deltas"""
+        rollup_delta = rollup_accumulator.take()
+        sketch_delta = sketch_accumulator.take()
+        comparison_delta = comparison_accumulator.take()
+        batch = self._drain() if self._queue is not None else []
+        if not batch and not rollup_delta and not sketch_delta and not comparison_delta:
+            return
+        await self._write(batch, rollup_delta, sketch_delta, comparison_delta)
+        while True:
+            batch = self._drain()
+            if not batch:
+                break
+            await self._write(batch, {}, {}, {})
+
+    async def run(self):
+        interval = settings.LOG_FLUSH_INTERVAL_MS / 1000
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Stop the writer and drain the queue"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+request_log_writer = RequestLogWriter()
+
+metrics.gauge("request_log_queue_depth", request_log_writer.depth)
@@ -1,19 +1,46 @@
+from .startup import startup_report  # first, so the report includes app imports
 from fastapi import FastAPI, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from contextlib import asynccontextmanager
+from typing import Optional
+import asyncio
+import math
 import time
 from .config import settings
 from .deps import get_api_key
-from .database import Base, engine, get_db
+from .database import Base, engine, async_engine, async_read_engine, ensure_db_dir, get_db, migrate_schema
 from .models.db_models import AdminUser
-from .auth import get_password_hash
+from .auth import get_password_hash, verify_password
+from .usage import usage_tracker
+from .log_writer import request_log_writer
+from .live import live_stats
+from .rollout import model_rollout
+from .retention import retention_loop
+from .jobs import job_worker
+from .capture import capture_writer
+from . import detector, model_store
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    # Startup: Create tables
+def _init_database():
+    ensure_db_dir()
+    model_store.ensure_dirs()
+    
+    # Create tables
     Base.metadata.create_all(bind=engine)
     
+    # Add columns introduced after the database was created
+    try:
+        for column in migrate_schema():
+            print(f"✓ Database migration: Added column {column}")
+    except Exception as e:
+        print(f"⚠ Schema migration warning: {e}")
+
+def _sync_admin() -> Optional[int]:
+    """Create the first admin from .env, or sync its username and email.
+
+    Returns the admin id whose password still has to be checked against .env
+    (see _sync_admin_password), or None.
+    """
     db = next(get_db())
     try:
         # Clean orphaned request logs (migration fix for NOT NULL constraint)
@@ -42,51 +69,165 @@ async def lifespan(app: FastAPI):
             db.commit()
             db.refresh(admin)
             print(f"✓ Admin created from .env: {settings.ADMIN_USERNAME}")
-        else:
-            # Update existing FIRST admin with .env credentials
-            updated = False
-            
-            # Update username if changed
-            if admin.username != settings.ADMIN_USERNAME:
-                admin.username = settings.ADMIN_USERNAME
-                updated = True
-                print(f"✓ Admin username updated: {settings.ADMIN_USERNAME}")
-            
-            # Update password if changed
-            from .auth import verify_password
-            try:
-                if not verify_password(settings.ADMIN_PASSWORD, admin.hashed_password):
-                    admin.hashed_password = get_password_hash(settings.ADMIN_PASSWORD)
-                    updated = True
-                    print(f"✓ Admin password updated from .env")
-            except:
-                admin.hashed_password = get_password_hash(settings.ADMIN_PASSWORD)
-                updated = True
-                print(f"✓ Admin password force-updated from .env")
-            
-            # Update email if changed (optional)
-            new_email = settings.ADMIN_EMAIL if settings.ADMIN_EMAIL else None
-            if admin.email != new_email:
-                admin.email = new_email
-                updated = True
-                if new_email:
-                    print(f"✓ Admin email updated: {new_email}")
-                else:
-                    print(f"✓ Admin email cleared (not configured)")
-            
-            if updated:
-                db.commit()
-                db.refresh(admin)
+            return None
+        
+        # Update existing FIRST admin with .env credentials
+        updated = False
+        
+        # Update username if changed
+        if admin.username != settings.ADMIN_USERNAME:
+            admin.username = settings.ADMIN_USERNAME
+            updated = True
+            print(f"✓ Admin username updated: {settings.ADMIN_USERNAME}")
+        
+        # Update email if changed (optional)
+        new_email = settings.ADMIN_EMAIL if settings.ADMIN_EMAIL else None
+        if admin.email != new_email:
+            admin.email = new_email
+            updated = True
+            if new_email:
+                print(f"✓ Admin email updated: {new_email}")
             else:
-                print(f"✓ Admin synced: {admin.username}")
+                print(f"✓ Admin email cleared (not configured)")
+        
+        if updated:
+            db.commit()
+        return admin.id
     except Exception as e:
         print(f"⚠ Startup warning: {e}")
+        return None
+    finally:
+        db.close()
+
+def _sync_admin_password(admin_id: int):
+    """Re-hash the admin password when .env changed it.
+
+    A full pbkdf2 verify, so it runs in a thread after startup instead of
+    delaying it. Until it finishes, the previous password still works.
+    """
+    db = next(get_db())
+    try:
+        admin = db.query(AdminUser).filter(AdminUser.id == admin_id).first()
+        if admin is None:
+            return
+        try:
+            if verify_password(settings.ADMIN_PASSWORD, admin.hashed_password):
+                print(f"✓ Admin synced: {admin.username}")
+                return
+            admin.hashed_password = get_password_hash(settings.ADMIN_PASSWORD)
+            print(f"✓ Admin password updated from .env")
+        except:
+            admin.hashed_password = get_password_hash(settings.ADMIN_PASSWORD)
+            print(f"✓ Admin password force-updated from .env")
+        db.commit()
+    except Exception as e:
+        print(f"⚠ Admin password sync warning: {e}")
     finally:
         db.close()
+
+def _run_backfills():
+    # Build hourly rollups from existing logs on first start after upgrading
+    from .rollups import rollups_empty, backfill_rollups
+    try:
+        if rollups_empty():
+            buckets = backfill_rollups()
+            if buckets:
+                print(f"✓ Usage rollups backfilled: {buckets} hourly buckets")
+    except Exception as e:
+        print(f"⚠ Usage rollup backfill warning: {e}")
+    
+    # Same for latency sketches (added after rollups, so checked separately)
+    from .sketches import sketches_empty, backfill_sketches
+    try:
+        if sketches_empty():
+            buckets = backfill_sketches()
+            if buckets:
+                print(f"✓ Latency sketches backfilled: {buckets} hourly buckets")
+    except Exception as e:
+        print(f"⚠ Latency sketch backfill warning: {e}")
+    
+    # Digests for models uploaded before content addressing (enables dedupe against them)
+    try:
+        hashed = model_store.backfill_model_hashes()
+        if hashed:
+            print(f"✓ Model digests computed for {hashed} existing model(s)")
+    except Exception as e:
+        print(f"⚠ Model digest backfill warning: {e}")
+    
+    from .profiler import reset_interrupted_profiles
+    try:
+        reset_interrupted_profiles()
+    except Exception as e:
+        print(f"⚠ Model profile reset warning: {e}")
+
+def run_startup_tasks() -> Optional[int]:
+    """One-time initialization (blocking): schema, admin, backfills.
+
+    Run by the lifespan, or once by the pre-fork master (see server.py).
+    Returns the admin id whose password still needs _sync_admin_password.
+    """
+    with startup_report.phase("database"):
+        _init_database()
+    with startup_report.phase("admin"):
+        admin_id = _sync_admin()
+    with startup_report.phase("backfills"):
+        _run_backfills()
+    return admin_id
+
+# Set by the pre-fork master once it has run the startup tasks and loaded the model
+PREFORKED = False
+
+async def _preload_inference():
+    started = time.perf_counter()
+    try:
+        await asyncio.to_thread(detector.preload)
+    except Exception as e:
+        print(f"⚠ Inference preload failed (imported on first request instead): {e}")
+    startup_report.record("inference_preload", started)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    preload_task = None
+    admin_id = None
+    if not PREFORKED:
+        startup_report.record("imports", startup_report.origin)
+        
+        # Import torch/ultralytics/OpenCV in a thread while the database initializes
+        if settings.ENABLE_INFERENCE:
+            preload_task = asyncio.create_task(_preload_inference())
+            await asyncio.sleep(0)  # let the task hand the import to its thread
+        
+        admin_id = await asyncio.to_thread(run_startup_tasks)
+    
+    usage_tracker.start()
+    request_log_writer.start()
+    live_stats.start()
+    retention_task = asyncio.create_task(retention_loop())
+    job_worker.start()
+    model_rollout.start()
+    capture_writer.start()
+    password_task = None
+    if admin_id is not None:
+        password_task = asyncio.create_task(asyncio.to_thread(_sync_admin_password, admin_id))
+    
+    if preload_task is not None:
+        await preload_task
+    if not PREFORKED:
+        startup_report.ready()
     
     yield
-    # Shutdown
-    pass
+    # Shutdown: stop pruning, the job worker and live streams, drain queued request logs and pending key usage
+    retention_task.cancel()
+    await job_worker.stop()
+    await capture_writer.stop()
+    if password_task is not None:
+        await password_task
+    await live_stats.stop()
+    model_rollout.shutdown()
+    await request_log_writer.stop()
+    await usage_tracker.stop()
+    await async_engine.dispose()
+    await async_read_engine.dispose()
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -102,6 +243,7 @@ if settings.BACKEND_CORS_ORIGINS:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["X-Next-Cursor"],
     )
 
 # Request logging middleware
@@ -111,45 +253,90 @@ async def log_requests(request: Request, call_next):
     
     response = await call_next(request)
     
-    # Log request if API key is present
+    # Log request if API key is present (queued, written in batches by the log writer)
     if hasattr(request.state, "api_key_id"):
         process_time = (time.time() - start_time) * 1000  # ms
-        
-        # Get database session
-        db = next(get_db())
-        from .crud.logs import create_request_log
-        
-        try:
-            create_request_log(
-                db,
-                api_key_id=request.state.api_key_id,
-                endpoint=request.url.path,
-                status_code=response.status_code,
-                response_time_ms=round(process_time, 2),
-                ip_address=request.client.host if request.client else None,
-                user_agent=request.headers.get("user-agent")
-            )
-        except Exception as e:
-            print(f"Failed to log request: {e}")
-        finally:
-            db.close()
+        request_log_writer.enqueue(
+            api_key_id=request.state.api_key_id,
+            endpoint=request.url.path,
+            status_code=response.status_code,
+            response_time_ms=round(process_time, 2),
+            ip_address=request.client.host if request.client else None,
+            user_agent=request.headers.get("user-agent"),
+            model_id=getattr(request.state, "model_id", None)
+        )
+        live_stats.record(request.state.api_key_id, response.status_code, process_time)
     
     return response
 
+# Per-key rate limiting (runs before the body is read)
+@app.middleware("http")
+async def rate_limit_requests(request: Request, call_next):
+    key_value = request.headers.get("x-api-key")
+    if not key_value or not request.url.path.startswith(settings.API_V1_STR):
+        return await call_next(request)
+    
+    from .ratelimit import check_rate_limit, rate_limit_headers
+    
+    try:
+        result = await check_rate_limit(key_value)
+    except Exception as e:
+        # Fail open: a limiter problem must not take the API down
+        print(f"⚠ Rate limiter error: {e}")
+        result = None
+    
+    if result is None:
+        return await call_next(request)
+    
+    headers = rate_limit_headers(result)
+    if not result.allowed:
+        return JSONResponse(
+            status_code=429,
+            content={"detail": f"Rate limit exceeded ({result.limit} requests per {settings.RATE_LIMIT_WINDOW_SECONDS}s)"},
+            headers=headers
+        )
+    
+    response = await call_next(request)
+    response.headers.update(headers)
+    return response
+
+# Client deadlines (X-Request-Timeout) start when the request arrives, so upload and
+# body parsing count against them. Registered last so it runs first.
+@app.middleware("http")
+async def start_request_deadline(request: Request, call_next):
+    timeout = request.headers.get("x-request-timeout")
+    if timeout:
+        try:
+            seconds = float(timeout)
+        except ValueError:
+            seconds = 0.0  # the endpoint's header validation answers 422
+        if seconds > 0 and math.isfinite(seconds):
+            request.state.deadline = time.monotonic() + seconds
+    return await call_next(request)
+
 @app.get("/")
 async def root():
     """Health check endpoint - always returns 200 OK"""
     return {"message": "Welcome to Captcha Solver API", "version": "2.0", "status": "running"}
 
 # Import and include routers
-from .routers import captcha, admin_auth, admin_keys, admin_models, admin_stats
+from .routers import admin_auth, admin_keys, admin_models, admin_stats
 
-# Public API routes (requires API key)
-app.include_router(
-    captcha.router,
-    prefix=settings.API_V1_STR,
-    dependencies=[Depends(get_api_key)]
-)
+# Public API routes (requires API key); admin-only processes skip them
+if settings.ENABLE_INFERENCE:
+    from .routers import captcha, jobs, ws
+    app.include_router(
+        captcha.router,
+        prefix=settings.API_V1_STR,
+        dependencies=[Depends(get_api_key)]
+    )
+    app.include_router(
+        jobs.router,
+        prefix=settings.API_V1_STR,
+        dependencies=[Depends(get_api_key)]
+    )
+    # Authenticates once per connection itself (HTTP dependencies don't apply to WebSockets)
+    app.include_router(ws.router, prefix=settings.API_V1_STR)
 
 # Admin routes (requires JWT)
 app.include_router(admin_auth.router)
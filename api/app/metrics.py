@@ -0,0 +1,34 @@
+"""In-process runtime metrics (counters and gauges) exposed via /admin/stats/metrics"""
+import threading
+from collections import defaultdict
+
+class Metrics:
+    """Thread-safe counters plus gauges computed on read"""
+
+    def __init__(self):
+        self._counters = defaultdict(int)
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: int = 1):
+        with self._lock:
+            self._counters[name] += value
+
+    def get(self, name: str) -> int:
+        return self._counters.get(name, 0)
+
+    def gauge(self, name: str, fn):
+        """Register a callable evaluated on every snapshot"""
+        self._gauges[name] = fn
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            data = dict(self._counters)
+        for name, fn in self._gauges.items():
+            try:
+                data[name] = fn()
+            except Exception:
+                data[name] = None
+        return data
+
+metrics = Metrics()
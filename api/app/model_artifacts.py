@@ -0,0 +1,107 @@
+"""Pre-compiled model artifacts for fast cold starts.
+
+Loading a .pt file unpickles the checkpoint and fuses conv+bn layers again
+in every process. Each model is therefore exported once, in a child process,
+to a fused TorchScript graph under MODELS_DIR/compiled. The file name holds
+the weights' SHA-256 and the torch/ultralytics versions that produced it, so
+a library upgrade changes the name and the artifact is rebuilt instead of
+loaded. A .json file next to it records the export size and task.
+"""
+import json
+import os
+import re
+import threading
+import time
+from importlib import metadata
+from pathlib import Path
+from typing import Optional, Tuple
+from .config import settings
+from .database import SessionLocal
+from .model_store import MODELS_DIR
+from .models.db_models import ModelFile
+from .profiler import child_lock, run_child
+
+ARTIFACTS_DIR = MODELS_DIR / "compiled"
+
+def runtime_tag() -> str:
+    """Library versions an artifact is only valid for, e.g. 'torch2.1.0-ultralytics8.0.200'"""
+    parts = []
+    for dist in ("torch", "ultralytics"):
+        try:
+            version = metadata.version(dist)
+        except metadata.PackageNotFoundError:
+            version = "none"
+        parts.append(f"{dist}{version}")
+    return re.sub(r"[^A-Za-z0-9.]+", "_", "-".join(parts))
+
+def artifact_path(digest: str) -> Path:
+    return ARTIFACTS_DIR / f"{digest}-{runtime_tag()}.torchscript"
+
+def find_artifact(digest: str) -> Optional[Tuple[Path, dict]]:
+    """(path, metadata) of a usable artifact for these weights, or None"""
+    path = artifact_path(digest)
+    try:
+        meta = json.loads(path.with_suffix(".json").read_text())
+    except (OSError, ValueError):
+        return None
+    return (path, meta) if path.exists() else None
+
+def remove_artifacts(digest: str, keep: Optional[Path] = None):
+    """Delete artifacts for a digest (all library versions), except `keep` and its metadata"""
+    if not ARTIFACTS_DIR.exists():
+        return
+    keep_names = {keep.name, keep.with_suffix(".json").name} if keep else set()
+    for path in ARTIFACTS_DIR.glob(f"{digest}-*"):
+        if path.name not in keep_names:
+            path.unlink(missing_ok=True)
+
+def build_artifact(model_path: str, digest: str) -> Optional[Path]:
+    """Export a model unless already built or being built by another worker (blocking)"""
+    dest = artifact_path(digest)
+    if find_artifact(digest):
+        return dest
+    ARTIFACTS_DIR.mkdir(parents=True, exist_ok=True)
+
+    lock_path = ARTIFACTS_DIR / f".{digest}.lock"
+    try:
+        os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        # A lock older than the export timeout was left by a killed worker
+        if time.time() - lock_path.stat().st_mtime > settings.MODEL_EXPORT_TIMEOUT_SECONDS:
+            lock_path.unlink(missing_ok=True)
+        return None
+
+    partial = dest.with_suffix(".partial")
+    try:
+        with child_lock:
+            result = run_child(
+                "api.app.model_export", model_path, str(partial),
+                timeout=settings.MODEL_EXPORT_TIMEOUT_SECONDS,
+            )
+        # Metadata first: the artifact only counts as built once both files exist
+        dest.with_suffix(".json").write_text(json.dumps({**result, "sha256": digest, "runtime": runtime_tag()}))
+        os.replace(partial, dest)
+        remove_artifacts(digest, keep=dest)
+        print(f"✓ Compiled artifact built for {digest[:12]}: {result['size_mb']}MB in {result['export_ms']}ms")
+        return dest
+    except Exception as e:
+        print(f"⚠ Compiled artifact build failed for {digest[:12]}: {e}")
+        return None
+    finally:
+        partial.unlink(missing_ok=True)
+        lock_path.unlink(missing_ok=True)
+
+def build_artifact_for_model(model_id: int):
+    """Background task after an upload"""
+    db = SessionLocal()
+    try:
+        model = db.query(ModelFile).filter(ModelFile.id == model_id).first()
+        source = (model.file_path, model.sha256) if model and model.sha256 else None
+    finally:
+        db.close()
+    if source:
+        build_artifact(*source)
+
+def schedule_build(model_path: str, digest: str):
+    """Build in a daemon thread, so the current load isn't delayed"""
+    threading.Thread(target=build_artifact, args=(model_path, digest), daemon=True).start()
@@ -0,0 +1,99 @@
+"""Standalone model benchmark, run in a child process by profiler.py.
+
+Loads one .pt file, then times single-image and batched inference on
+synthetic captchas at the model's input size. It prints a single JSON line
+on stdout. Keep imports light: this module must not touch the app database
+or settings.
+
+    python -m api.app.model_bench models/sha256/ab/<digest>.pt --runs 20 --batch 8
+"""
+import argparse
+import json
+import resource
+import statistics
+import string
+import time
+import cv2
+import numpy as np
+
+def synthetic_captcha(size: int, rng: np.random.Generator) -> np.ndarray:
+    """Noisy light background with a few random glyphs and strike-through lines (BGR)"""
+    image = rng.integers(170, 256, (size, size, 3), dtype=np.uint8)
+    for _ in range(8):
+        start = tuple(int(v) for v in rng.integers(0, size, 2))
+        end = tuple(int(v) for v in rng.integers(0, size, 2))
+        cv2.line(image, start, end, tuple(int(v) for v in rng.integers(0, 150, 3)), 1)
+    for _ in range(int(rng.integers(4, 8))):
+        char = str(rng.choice(list(string.ascii_uppercase + string.digits)))
+        origin = (int(rng.integers(0, size - size // 8)), int(rng.integers(size // 8, size)))
+        scale = float(rng.uniform(size / 400, size / 200))
+        color = tuple(int(v) for v in rng.integers(0, 120, 3))
+        cv2.putText(image, char, origin, cv2.FONT_HERSHEY_SIMPLEX, scale, color, max(1, size // 200))
+    return image
+
+def _timed_ms(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return (time.perf_counter() - start) * 1000
+
+def _summary(samples: list) -> dict:
+    ordered = sorted(samples)
+    return {
+        "median_ms": round(statistics.median(ordered), 2),
+        "p90_ms": round(ordered[min(len(ordered) - 1, int(0.9 * len(ordered)))], 2),
+    }
+
+def _input_size(model, default: int) -> int:
+    imgsz = model.overrides.get("imgsz") if hasattr(model, "overrides") else None
+    if not imgsz:
+        args = getattr(getattr(model, "model", None), "args", None) or {}
+        imgsz = args.get("imgsz") if isinstance(args, dict) else getattr(args, "imgsz", None)
+    if isinstance(imgsz, (list, tuple)):
+        imgsz = max(imgsz)
+    return int(imgsz or default)
+
+def benchmark(path: str, runs: int, batch: int, default_imgsz: int = 640) -> dict:
+    from ultralytics import YOLO  # imported before timing, so load_time_ms covers the weights only
+
+    start = time.perf_counter()
+    model = YOLO(path)
+    load_ms = (time.perf_counter() - start) * 1000
+    imgsz = _input_size(model, default_imgsz)
+
+    rng = np.random.default_rng(0)
+    images = [synthetic_captcha(imgsz, rng) for _ in range(max(batch, 4))]
+
+    def predict(source):
+        model.predict(source, imgsz=imgsz, verbose=False)
+
+    first_ms = _timed_ms(lambda: predict(images[0]))  # includes lazy initialization
+    single = [_timed_ms(lambda i=i: predict(images[i % len(images)])) for i in range(runs)]
+    batched = [_timed_ms(lambda: predict(images[:batch])) for _ in range(max(2, runs // batch))]
+    batch_summary = _summary(batched)
+
+    return {
+        "input_size": imgsz,
+        "load_time_ms": round(load_ms, 2),
+        "first_inference_ms": round(first_ms, 2),
+        "single": {"runs": runs, **_summary(single)},
+        "batch": {
+            "size": batch,
+            "runs": len(batched),
+            **batch_summary,
+            "per_image_ms": round(batch_summary["median_ms"] / batch, 2),
+        },
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark a YOLO .pt model on synthetic captchas")
+    parser.add_argument("path")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--batch", type=int, default=8)
+    parser.add_argument("--imgsz", type=int, default=640, help="Used when the model does not record its input size")
+    args = parser.parse_args()
+    print(json.dumps(benchmark(args.path, max(1, args.runs), max(1, args.batch), args.imgsz)))
+
+if __name__ == "__main__":
+    main()
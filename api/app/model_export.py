@@ -0,0 +1,50 @@
+"""Standalone TorchScript export, run in a child process by model_artifacts.py.
+
+Loads one .pt file and exports the fused model (conv+bn folded) as a
+TorchScript graph at the model's input size. It prints a single JSON line
+on stdout. Like model_bench.py, this module must not touch the app database
+or settings.
+
+    python -m api.app.model_export models/sha256/ab/<digest>.pt models/compiled/<name>.partial
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from .model_bench import _input_size
+
+def export(path: str, dest: str, default_imgsz: int = 640) -> dict:
+    from ultralytics import YOLO
+
+    start = time.perf_counter()
+    # The exporter writes next to its source file; export from a symlink in a scratch
+    # directory so nothing lands beside the content-addressed blob
+    with tempfile.TemporaryDirectory(dir=Path(dest).parent) as work:
+        link = Path(work) / "model.pt"
+        link.symlink_to(os.path.abspath(path))
+        model = YOLO(str(link))
+        imgsz = _input_size(model, default_imgsz)
+        exported = model.export(format="torchscript", imgsz=imgsz, device="cpu")
+        shutil.move(str(exported), dest)
+
+    return {
+        "format": "torchscript",
+        "task": model.task,
+        "imgsz": imgsz,
+        "export_ms": round((time.perf_counter() - start) * 1000, 2),
+        "size_mb": round(os.path.getsize(dest) / (1024 * 1024), 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a YOLO .pt model to TorchScript")
+    parser.add_argument("path")
+    parser.add_argument("dest")
+    parser.add_argument("--imgsz", type=int, default=640, help="Used when the model does not record its input size")
+    args = parser.parse_args()
+    print(json.dumps(export(args.path, args.dest, args.imgsz)))
+
+if __name__ == "__main__":
+    main()
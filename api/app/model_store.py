@@ -0,0 +1,265 @@
+"""Content-addressed model storage with streaming, resumable uploads.
+
+Uploads are written to a temporary file under MODELS_DIR/.uploads while a
+SHA-256 is computed over the same bytes, then renamed atomically to
+MODELS_DIR/sha256/<aa>/<digest>.pt. Identical weights therefore share one
+file and one ModelFile row.
+
+Large files can be sent in chunks through an upload session. Each session
+is a .part file plus a .json descriptor, so an interrupted upload continues
+from the last byte the server has, even after a restart. The running hash is
+kept in memory per session and recomputed from the .part file only when that
+state was lost.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Tuple
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from .config import settings
+from .database import SessionLocal
+from .models.db_models import ModelFile
+
+MODELS_DIR = Path("/app/models") if os.path.exists("/app") else Path("./models")
+BLOBS_DIR = MODELS_DIR / "sha256"
+UPLOADS_DIR = MODELS_DIR / ".uploads"
+# Bumped on every activation; the pre-fork master watches it to roll its workers (see server.py)
+ACTIVE_VERSION_FILE = MODELS_DIR / ".active_version"
+
+_READ_SIZE = 1024 * 1024
+
+# upload_id -> (bytes hashed, running sha256) for sessions whose chunks arrived in this worker
+_session_hashes = {}
+
+class UploadTooLarge(Exception):
+    """The upload crossed the size limit while it was being received"""
+
+def ensure_dirs():
+    for path in (MODELS_DIR, BLOBS_DIR, UPLOADS_DIR):
+        path.mkdir(parents=True, exist_ok=True)
+
+def publish_activation(model_id: int):
+    """Record an activation for other processes: '<model id> <timestamp>', replaced atomically"""
+    ensure_dirs()
+    tmp_path = ACTIVE_VERSION_FILE.with_suffix(".tmp")
+    tmp_path.write_text(f"{model_id} {time.time()}\n")
+    os.replace(tmp_path, ACTIVE_VERSION_FILE)
+
+def read_activation() -> Optional[str]:
+    try:
+        return ACTIVE_VERSION_FILE.read_text().strip()
+    except OSError:
+        return None
+
+def blob_path(digest: str) -> Path:
+    return BLOBS_DIR / digest[:2] / f"{digest}.pt"
+
+def hash_file(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_READ_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class TempUpload:
+    """A temp file under UPLOADS_DIR that hashes what is written to it (blocking calls)"""
+
+    def __init__(self, max_size: Optional[int] = None):
+        ensure_dirs()
+        self.path = UPLOADS_DIR / f"{uuid.uuid4().hex}.tmp"
+        self.max_size = max_size
+        self.size = 0
+        self._digest = hashlib.sha256()
+        self._file = open(self.path, "wb")
+
+    def write(self, data: bytes):
+        """Raises UploadTooLarge as soon as more than `max_size` bytes were written"""
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            raise UploadTooLarge(self.size)
+        self._digest.update(data)
+        self._file.write(data)
+
+    def finish(self) -> Tuple[Path, str, int]:
+        """Flush to disk: (temp file, sha256, size)"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        return self.path, self._digest.hexdigest(), self.size
+
+    def discard(self):
+        self._file.close()
+        self.path.unlink(missing_ok=True)
+
+def commit_blob(tmp_path: Path, digest: str) -> Path:
+    """Move a verified temp file to its content address; drops it if the blob already exists"""
+    final_path = blob_path(digest)
+    if final_path.exists():
+        tmp_path.unlink(missing_ok=True)
+        return final_path
+    final_path.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(tmp_path, final_path)  # atomic within one filesystem
+    return final_path
+
+def register_model(
+    db: Session,
+    digest: str,
+    path: Path,
+    size: int,
+    filename: str,
+    uploaded_by: str,
+    description: Optional[str] = None
+) -> Tuple[ModelFile, bool]:
+    """(ModelFile, created): returns the existing row for an already-known digest"""
+    existing = db.query(ModelFile).filter(ModelFile.sha256 == digest).first()
+    if existing:
+        return existing, False
+    model_file = ModelFile(
+        filename=filename,
+        file_path=str(path),
+        file_size_mb=round(size / (1024 * 1024), 2),
+        sha256=digest,
+        uploaded_by=uploaded_by,
+        description=description
+    )
+    db.add(model_file)
+    try:
+        db.commit()
+    except IntegrityError:
+        # Same weights registered concurrently
+        db.rollback()
+        return db.query(ModelFile).filter(ModelFile.sha256 == digest).first(), False
+    db.refresh(model_file)
+    return model_file, True
+
+# Resumable upload sessions
+
+def _session_paths(upload_id: str) -> Tuple[Path, Path]:
+    if not upload_id.isalnum():
+        raise KeyError(upload_id)
+    return UPLOADS_DIR / f"{upload_id}.json", UPLOADS_DIR / f"{upload_id}.part"
+
+def create_session(filename: str, size: int, uploaded_by: str, expected_sha256: Optional[str] = None) -> dict:
+    ensure_dirs()
+    cleanup_sessions()
+    upload_id = uuid.uuid4().hex
+    meta_path, part_path = _session_paths(upload_id)
+    meta = {
+        "upload_id": upload_id,
+        "filename": filename,
+        "size": size,
+        "sha256": expected_sha256.lower() if expected_sha256 else None,
+        "uploaded_by": uploaded_by,
+        "created_at": datetime.utcnow().isoformat(),
+    }
+    part_path.touch()
+    meta_path.write_text(json.dumps(meta))
+    _session_hashes[upload_id] = (0, hashlib.sha256())
+    return {**meta, "offset": 0}
+
+def get_session(upload_id: str) -> Optional[dict]:
+    try:
+        meta_path, part_path = _session_paths(upload_id)
+        meta = json.loads(meta_path.read_text())
+        return {**meta, "offset": part_path.stat().st_size}
+    except (KeyError, OSError, ValueError):
+        return None
+
+def append_chunk(upload_id: str, offset: int, data: bytes) -> int:
+    """Append bytes at `offset`, which must equal the current length (blocking). Returns the new offset."""
+    _, part_path = _session_paths(upload_id)
+    with open(part_path, "ab") as out:
+        # A retried chunk can reach another worker while the first attempt is still
+        # being written: the offset check, write and hash update must not interleave
+        fcntl.flock(out, fcntl.LOCK_EX)
+        try:
+            current = out.seek(0, os.SEEK_END)  # the length when the lock was granted
+            if current != offset:
+                raise ValueError(current)
+            out.write(data)
+            out.flush()
+            os.fsync(out.fileno())
+            new_offset = out.tell()
+
+            state = _session_hashes.get(upload_id)
+            if state is not None and state[0] == offset:
+                state[1].update(data)
+                _session_hashes[upload_id] = (new_offset, state[1])
+            else:
+                _session_hashes.pop(upload_id, None)
+        finally:
+            fcntl.flock(out, fcntl.LOCK_UN)
+    return new_offset
+
+def finish_session(upload_id: str) -> Tuple[Path, str, int]:
+    """Close a fully uploaded session: (temp file, sha256, size). Raises ValueError on mismatch."""
+    session = get_session(upload_id)
+    if session is None:
+        raise KeyError(upload_id)
+    if session["offset"] != session["size"]:
+        raise ValueError(f"Upload incomplete: {session['offset']} of {session['size']} bytes received")
+
+    meta_path, part_path = _session_paths(upload_id)
+    state = _session_hashes.pop(upload_id, None)
+    if state is not None and state[0] == session["size"]:
+        digest = state[1].hexdigest()
+    else:
+        digest = hash_file(part_path)
+    if session["sha256"] and session["sha256"] != digest:
+        discard_session(upload_id)
+        raise ValueError(f"SHA-256 mismatch: expected {session['sha256']}, got {digest}")
+
+    tmp_path = UPLOADS_DIR / f"{upload_id}.tmp"
+    os.replace(part_path, tmp_path)
+    meta_path.unlink(missing_ok=True)
+    return tmp_path, digest, session["size"]
+
+def discard_session(upload_id: str):
+    _session_hashes.pop(upload_id, None)
+    for path in _session_paths(upload_id):
+        path.unlink(missing_ok=True)
+
+def cleanup_sessions():
+    """Remove sessions and temp files untouched for MODEL_UPLOAD_EXPIRE_HOURS"""
+    if not UPLOADS_DIR.exists():
+        return
+    cutoff = time.time() - settings.MODEL_UPLOAD_EXPIRE_HOURS * 3600
+    # A session is its .json and .part together; only the .part changes while chunks
+    # arrive, so the session is as old as the newer of the two
+    files = {}
+    for path in UPLOADS_DIR.iterdir():
+        try:
+            mtime = path.stat().st_mtime
+        except OSError:
+            continue
+        newest, paths = files.get(path.stem, (0.0, []))
+        files[path.stem] = (max(newest, mtime), paths + [path])
+    for stem, (newest, paths) in files.items():
+        if newest < cutoff:
+            for path in paths:
+                path.unlink(missing_ok=True)
+            _session_hashes.pop(stem, None)
+
+def backfill_model_hashes() -> int:
+    """Hash models uploaded before digests were stored; files stay where they are"""
+    db = SessionLocal()
+    try:
+        updated = 0
+        for model in db.query(ModelFile).filter(ModelFile.sha256 == None).all():
+            if not os.path.isfile(model.file_path):
+                continue
+            digest = hash_file(model.file_path)
+            if db.query(ModelFile.id).filter(ModelFile.sha256 == digest).first():
+                continue  # legacy duplicate, left without a digest
+            model.sha256 = digest
+            db.commit()
+            updated += 1
+        return updated
+    finally:
+        db.close()
@@ -1,3 +1,3 @@
-from .db_models import ApiKey, RequestLog, ModelFile, AdminUser
+from .db_models import ApiKey, RequestLog, UsageRollup, LatencySketch, ModelFile, AdminUser
 
-__all__ = ["ApiKey", "RequestLog", "ModelFile", "AdminUser"]
+__all__ = ["ApiKey", "RequestLog", "UsageRollup", "LatencySketch", "ModelFile", "AdminUser"]
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Float, Text, ForeignKey, Enum
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Float, Text, ForeignKey, Enum, Index, LargeBinary, UniqueConstraint
 from sqlalchemy.orm import relationship
 from datetime import datetime
 import enum
@@ -15,11 +15,16 @@ class ApiKey(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(255), unique=True, index=True, nullable=False)
     key_value = Column(String(255), unique=True, index=True, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True, nullable=False)
     last_used_at = Column(DateTime, nullable=True)
     is_active = Column(Boolean, default=True, index=True)
     request_count = Column(Integer, default=0)
     daily_limit = Column(Integer, nullable=True)  # null = unlimited
+    rate_limit = Column(Integer, nullable=True)  # requests per window, null = global RATE_LIMIT, 0 = unlimited
+    rate_limit_burst = Column(Integer, nullable=True)  # bucket capacity, null = same as rate_limit
+    priority_weight = Column(Float, nullable=True)  # share of inference under contention, null = 1.0
+    max_queue_length = Column(Integer, nullable=True)  # waiting detections, null = SCHEDULER_MAX_QUEUE, 0 = unlimited
+    job_image_quota = Column(Integer, nullable=True)  # images in unfinished jobs, null = JOB_MAX_PENDING_IMAGES, 0 = unlimited
     expires_at = Column(DateTime, nullable=True, index=True)  # null = never expire
     expiration_type = Column(Enum(ExpirationType), default=ExpirationType.NEVER)
     expiration_notified = Column(Boolean, default=False)
@@ -31,6 +36,13 @@ class ApiKey(Base):
 
 class RequestLog(Base):
     __tablename__ = "request_logs"
+    # Log viewer filters; each ends in timestamp so filtered pages are read in (timestamp, id) order.
+    # The plain timestamp index already covers unfiltered keyset pages (id is the rowid).
+    __table_args__ = (
+        Index("ix_request_logs_key_timestamp", "api_key_id", "timestamp"),
+        Index("ix_request_logs_status_timestamp", "status_code", "timestamp"),
+        Index("ix_request_logs_endpoint_timestamp", "endpoint", "timestamp"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     api_key_id = Column(Integer, ForeignKey("api_keys.id"), nullable=False)
@@ -42,10 +54,37 @@ class RequestLog(Base):
     user_agent = Column(String(500), nullable=True)
     error_message = Column(Text, nullable=True)
     file_size_bytes = Column(Integer, nullable=True)
+    model_id = Column(Integer, nullable=True)  # model that served the request, if any
     
     # Relationship
     api_key = relationship("ApiKey", back_populates="request_logs")
 
+class UsageRollup(Base):
+    """Hourly per-key request aggregates, maintained by the request log writer"""
+    __tablename__ = "usage_rollups"
+    __table_args__ = (UniqueConstraint("api_key_id", "hour", name="uq_usage_rollups_key_hour"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    api_key_id = Column(Integer, ForeignKey("api_keys.id"), nullable=False)
+    hour = Column(DateTime, nullable=False, index=True)  # UTC, truncated to the hour
+    request_count = Column(Integer, default=0, nullable=False)
+    success_count = Column(Integer, default=0, nullable=False)  # status 200
+    error_count = Column(Integer, default=0, nullable=False)  # status >= 400
+    latency_sum_ms = Column(Float, default=0.0, nullable=False)
+    latency_histogram = Column(Text, nullable=True)  # JSON counts per rollups.LATENCY_BUCKETS_MS
+
+class LatencySketch(Base):
+    """Hourly DDSketch of response times per API key and model (see sketches.py)"""
+    __tablename__ = "latency_sketches"
+    __table_args__ = (UniqueConstraint("hour", "api_key_id", "model_id", name="uq_latency_sketches_bucket"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    hour = Column(DateTime, nullable=False, index=True)  # UTC, truncated to the hour
+    api_key_id = Column(Integer, ForeignKey("api_keys.id"), nullable=False)
+    model_id = Column(Integer, nullable=False, default=0)  # 0 = no model (errors before inference)
+    count = Column(Integer, default=0, nullable=False)
+    sketch = Column(Text, nullable=False)  # JSON bins
+
 class ModelFile(Base):
     __tablename__ = "models"
     
@@ -53,10 +92,78 @@ class ModelFile(Base):
     filename = Column(String(255), nullable=False)
     file_path = Column(String(500), unique=True, nullable=False)
     file_size_mb = Column(Float, nullable=False)
+    sha256 = Column(String(64), unique=True, index=True, nullable=True)  # content digest; null for legacy rows not yet hashed
     uploaded_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     is_active = Column(Boolean, default=False, index=True)
     uploaded_by = Column(String(255), default="admin")
     description = Column(Text, nullable=True)
+    profile_status = Column(String(20), nullable=True)  # pending, running, done, failed (see profiler.py)
+    profile = Column(Text, nullable=True)  # JSON benchmark result or {"error": ...}
+    profiled_at = Column(DateTime, nullable=True)
+    rollout_mode = Column(String(10), nullable=True)  # canary or shadow while evaluated against the active model (see rollout.py)
+    rollout_percent = Column(Float, nullable=True)  # canary: share of requests served; shadow: share of requests mirrored
+
+# Additive per-bucket counters of ModelComparison
+COMPARISON_COUNTERS = (
+    "samples", "agreements", "primary_boxes", "candidate_boxes",
+    "matched_boxes", "class_matches", "iou_sum", "candidate_errors",
+)
+
+class ModelComparison(Base):
+    """Hourly side-by-side results of a rollout candidate against the active model (see rollout.py)"""
+    __tablename__ = "model_comparisons"
+    __table_args__ = (
+        UniqueConstraint("hour", "primary_model_id", "candidate_model_id", "mode", name="uq_model_comparisons_bucket"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    hour = Column(DateTime, nullable=False, index=True)  # UTC, truncated to the hour
+    primary_model_id = Column(Integer, nullable=False)
+    candidate_model_id = Column(Integer, nullable=False)
+    mode = Column(String(10), nullable=False)
+    samples = Column(Integer, default=0, nullable=False)  # images run through both models
+    agreements = Column(Integer, default=0, nullable=False)  # images where every box matched with the same class
+    primary_boxes = Column(Integer, default=0, nullable=False)
+    candidate_boxes = Column(Integer, default=0, nullable=False)
+    matched_boxes = Column(Integer, default=0, nullable=False)  # pairs with IoU >= rollout.IOU_THRESHOLD
+    class_matches = Column(Integer, default=0, nullable=False)
+    iou_sum = Column(Float, default=0.0, nullable=False)
+    candidate_errors = Column(Integer, default=0, nullable=False)
+    primary_sketch = Column(Text, nullable=False)  # DDSketch JSON of inference ms
+    candidate_sketch = Column(Text, nullable=False)
+
+class DetectionJob(Base):
+    """A batch of images submitted through the job API, processed in the background (see jobs.py)"""
+    __tablename__ = "detection_jobs"
+    __table_args__ = (Index("ix_detection_jobs_key_status", "api_key_id", "status"),)
+    
+    id = Column(String(32), primary_key=True)  # random hex, returned to the client
+    api_key_id = Column(Integer, ForeignKey("api_keys.id"), nullable=False)
+    status = Column(String(10), default="queued", nullable=False)  # queued, running, done
+    include_visual = Column(Boolean, default=False, nullable=False)
+    image_count = Column(Integer, nullable=False)
+    done_count = Column(Integer, default=0, nullable=False)
+    failed_count = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+    expires_at = Column(DateTime, nullable=True, index=True)  # results are deleted after this (set when done)
+
+class DetectionJobItem(Base):
+    """One image of a DetectionJob; the image is dropped once it has been processed"""
+    __tablename__ = "detection_job_items"
+    __table_args__ = (Index("ix_detection_job_items_status_id", "status", "id"),)  # claim order
+    
+    id = Column(Integer, primary_key=True)
+    job_id = Column(String(32), ForeignKey("detection_jobs.id"), nullable=False, index=True)
+    position = Column(Integer, nullable=False)  # index in the submitted file list
+    filename = Column(String(255), nullable=True)
+    status = Column(String(10), default="queued", nullable=False)  # queued, running, done, failed
+    image = Column(LargeBinary, nullable=True)
+    claim = Column(String(32), nullable=True, index=True)  # token of the worker batch processing it
+    claimed_at = Column(DateTime, nullable=True)
+    result = Column(Text, nullable=True)  # JSON detection result
+    error = Column(Text, nullable=True)
+    model_id = Column(Integer, nullable=True)
 
 class AdminUser(Base):
     __tablename__ = "admin_users"
@@ -1,4 +1,5 @@
 from pydantic import BaseModel, Field, field_validator
+import json
 from datetime import datetime
 from typing import Optional, List
 from enum import Enum
@@ -16,11 +17,21 @@ class ApiKeyCreate(BaseModel):
     expires_at: Optional[datetime] = None  # For type=date
     duration_days: Optional[int] = None  # For type=duration
     daily_limit: Optional[int] = Field(None, ge=0)
+    rate_limit: Optional[int] = Field(None, ge=0)  # None = global RATE_LIMIT, 0 = unlimited
+    rate_limit_burst: Optional[int] = Field(None, ge=1)
+    priority_weight: Optional[float] = Field(None, gt=0, le=100)  # None = 1.0
+    max_queue_length: Optional[int] = Field(None, ge=0)  # None = SCHEDULER_MAX_QUEUE, 0 = unlimited
+    job_image_quota: Optional[int] = Field(None, ge=0)  # None = JOB_MAX_PENDING_IMAGES, 0 = unlimited
     notes: Optional[str] = None
 
 class ApiKeyUpdate(BaseModel):
     name: Optional[str] = Field(None, min_length=3, max_length=255)
     daily_limit: Optional[int] = Field(None, ge=0)
+    rate_limit: Optional[int] = Field(None, ge=0)
+    rate_limit_burst: Optional[int] = Field(None, ge=1)
+    priority_weight: Optional[float] = Field(None, gt=0, le=100)  # None = 1.0
+    max_queue_length: Optional[int] = Field(None, ge=0)  # None = SCHEDULER_MAX_QUEUE, 0 = unlimited
+    job_image_quota: Optional[int] = Field(None, ge=0)  # None = JOB_MAX_PENDING_IMAGES, 0 = unlimited
     notes: Optional[str] = None
     is_active: Optional[bool] = None
 
@@ -38,6 +49,11 @@ class ApiKeyResponse(BaseModel):
     is_active: bool
     request_count: int
     daily_limit: Optional[int]
+    rate_limit: Optional[int] = None
+    rate_limit_burst: Optional[int] = None
+    priority_weight: Optional[float] = None
+    max_queue_length: Optional[int] = None
+    job_image_quota: Optional[int] = None
     expires_at: Optional[datetime]
     expiration_type: str
     notes: Optional[str]
@@ -69,14 +85,40 @@ class ModelFileResponse(BaseModel):
     id: int
     filename: str
     file_size_mb: float
+    sha256: Optional[str] = None
     uploaded_at: datetime
     is_active: bool
     uploaded_by: str
     description: Optional[str]
+    profile_status: Optional[str] = None
+    profile: Optional[dict] = None  # load_time_ms, peak_rss_mb, single/batch latency; or error
+    profiled_at: Optional[datetime] = None
+    rollout_mode: Optional[str] = None  # canary or shadow
+    rollout_percent: Optional[float] = None
+    
+    @field_validator('profile', mode='before')
+    @classmethod
+    def parse_profile(cls, v):
+        return json.loads(v) if isinstance(v, str) else v
     
     class Config:
         from_attributes = True
 
+class ModelUploadCreate(BaseModel):
+    filename: str = Field(..., min_length=4, max_length=255)
+    size: int = Field(..., gt=0)  # Total bytes
+    sha256: Optional[str] = Field(None, pattern="^[0-9a-fA-F]{64}$")  # Verified on completion if given
+
+class ModelUploadStatus(BaseModel):
+    upload_id: str
+    filename: str
+    size: int
+    offset: int  # Bytes received so far; send the next chunk from here
+    chunk_size: int  # Suggested chunk size in bytes
+
+class ModelUploadComplete(BaseModel):
+    description: Optional[str] = None
+
 # Admin Auth Schemas
 class AdminLogin(BaseModel):
     username: str
@@ -99,10 +141,67 @@ class DashboardStats(BaseModel):
     total_requests_month: int
     success_rate: float
     avg_response_time_ms: float
+    p50_response_time_ms: Optional[float] = None  # last 24h, from latency sketches
+    p90_response_time_ms: Optional[float] = None
+    p99_response_time_ms: Optional[float] = None
     active_keys_count: int
     total_keys_count: int
     expiring_keys_count: int
     current_model: Optional[ModelFileResponse]
+    model_status: Optional[str] = None  # "loaded", "not_loaded" or "error" in the serving worker
+
+class LatencyPercentiles(BaseModel):
+    api_key_id: Optional[int] = None
+    model_id: Optional[int] = None  # 0 = requests that never reached a model
+    count: int
+    p50_ms: Optional[float]
+    p90_ms: Optional[float]
+    p99_ms: Optional[float]
+
+class LatencyStatsResponse(BaseModel):
+    start: datetime
+    end: datetime
+    group_by: str
+    relative_accuracy: float
+    groups: List[LatencyPercentiles]
+
+class ModelRolloutUpdate(BaseModel):
+    mode: str = Field(..., pattern="^(canary|shadow)$")
+    percent: float = Field(..., ge=0, le=100)  # canary: share of requests served; shadow: share mirrored
+
+class ModelComparisonStats(BaseModel):
+    primary_model_id: int
+    candidate_model_id: int
+    mode: str
+    samples: int
+    candidate_errors: int
+    agreement_rate: Optional[float]  # % of images where both models found the same boxes and classes
+    box_match_rate: Optional[float]  # % of boxes matched one-to-one at IoU >= iou_threshold
+    class_match_rate: Optional[float]  # % of matched boxes with the same class
+    mean_iou: Optional[float]
+    primary_boxes: int
+    candidate_boxes: int
+    primary_latency: LatencyPercentiles  # inference time only, same images for both models
+    candidate_latency: LatencyPercentiles
+
+class RolloutStatsResponse(BaseModel):
+    start: datetime
+    end: datetime
+    iou_threshold: float
+    candidate: Optional[ModelFileResponse]
+    comparisons: List[ModelComparisonStats]
+
+class UsagePoint(BaseModel):
+    hour: datetime
+    request_count: int
+    error_count: int
+    avg_response_time_ms: float
+    latency_histogram: List[int]
+
+class UsageSeriesResponse(BaseModel):
+    api_key_id: Optional[int]
+    latency_buckets_ms: List[int]  # upper bounds; the histogram has one extra overflow bucket
+    points: List[UsagePoint]
 
 class RequestLogResponse(BaseModel):
     id: int
@@ -117,6 +216,25 @@ class RequestLogResponse(BaseModel):
     class Config:
         from_attributes = True
 
+# Job API Schemas
+class JobItemResult(BaseModel):
+    index: int  # position in the submitted file list
+    filename: Optional[str]
+    status: str  # queued, running, done, failed
+    result: Optional[dict] = None  # same shape as /detect
+    error: Optional[str] = None
+
+class JobResponse(BaseModel):
+    job_id: str
+    status: str  # queued, running, done
+    image_count: int
+    done_count: int
+    failed_count: int
+    created_at: datetime
+    finished_at: Optional[datetime]
+    expires_at: Optional[datetime]
+    results: Optional[List[JobItemResult]] = None
+
 # Test Interface Schema
 class DetectionTestRequest(BaseModel):
     api_key_id: int
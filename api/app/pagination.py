@@ -0,0 +1,31 @@
+"""Opaque keyset cursors for admin list endpoints.
+
+A cursor encodes the sort key of the last row on a page, e.g. (timestamp, id),
+so the next page is read with `WHERE (timestamp, id) < (:ts, :id)` straight
+from an index instead of skipping OFFSET rows. Endpoints return the cursor for
+the next page in the X-Next-Cursor header; it is absent on the last page.
+"""
+import base64
+import json
+from datetime import datetime
+from fastapi import HTTPException, Response
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def encode_cursor(timestamp: datetime, row_id: int) -> str:
+    raw = json.dumps([timestamp.isoformat(), row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple:
+    """(timestamp, id) from a cursor, 400 if it was not produced by encode_cursor"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def set_next_cursor(response: Response, rows: list, limit: int, sort_key):
+    """Set X-Next-Cursor when the page is full; sort_key(row) -> (timestamp, id)"""
+    if rows and len(rows) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(*sort_key(rows[-1]))
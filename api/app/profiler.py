@@ -0,0 +1,99 @@
+"""Background performance profiling of uploaded models.
+
+Each profile runs model_bench.py in a child process at low CPU priority, so
+loading the candidate model never touches the serving process's memory, and
+peak RSS is measured for that model alone. Profiles run one at a time per
+worker. Results are stored as JSON on ModelFile.profile.
+"""
+import json
+import os
+import subprocess
+import sys
+import threading
+from datetime import datetime
+from pathlib import Path
+from .config import settings
+from .database import SessionLocal
+from .models.db_models import ModelFile
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+
+# One heavy child process (benchmark or artifact export) at a time per worker
+child_lock = threading.Lock()
+
+def _update(model_id: int, **fields):
+    db = SessionLocal()
+    try:
+        db.query(ModelFile).filter(ModelFile.id == model_id).update(fields)
+        db.commit()
+    finally:
+        db.close()
+
+def run_child(module: str, *args, timeout: int) -> dict:
+    """Run `python -m <module> args...` at low priority and parse its last stdout line as JSON (blocking)"""
+    env = {**os.environ, "YOLO_VERBOSE": "False"}
+    with subprocess.Popen(
+        [sys.executable, "-m", module, *args],
+        cwd=PROJECT_ROOT,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+    ) as proc:
+        # Reniced from here: preexec_fn is not safe in a process with threads
+        try:
+            os.setpriority(os.PRIO_PROCESS, proc.pid, os.getpriority(os.PRIO_PROCESS, 0) + 10)
+        except OSError:
+            pass  # Already exited
+        try:
+            stdout, stderr = proc.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.communicate()
+            raise
+    if proc.returncode != 0:
+        raise RuntimeError((stderr or stdout).strip()[-500:] or f"exit code {proc.returncode}")
+    return json.loads(stdout.strip().splitlines()[-1])
+
+def _run_bench(path: str) -> dict:
+    return run_child(
+        "api.app.model_bench", path,
+        "--runs", str(settings.MODEL_PROFILE_RUNS),
+        "--batch", str(settings.MODEL_PROFILE_BATCH),
+        timeout=settings.MODEL_PROFILE_TIMEOUT_SECONDS,
+    )
+
+def run_profile(model_id: int):
+    """Benchmark a model and store the result (blocking; scheduled as a background task)"""
+    db = SessionLocal()
+    try:
+        model = db.query(ModelFile).filter(ModelFile.id == model_id).first()
+        path = model.file_path if model else None
+    finally:
+        db.close()
+    if path is None:
+        return
+
+    with child_lock:
+        _update(model_id, profile_status="running")
+        try:
+            result = _run_bench(path)
+            _update(model_id, profile_status="done", profile=json.dumps(result), profiled_at=datetime.utcnow())
+            print(f"✓ Model {model_id} profiled: load {result['load_time_ms']}ms, "
+                  f"single {result['single']['median_ms']}ms, peak RSS {result['peak_rss_mb']}MB")
+        except Exception as e:
+            _update(model_id, profile_status="failed", profile=json.dumps({"error": str(e)}), profiled_at=datetime.utcnow())
+            print(f"⚠ Model {model_id} profiling failed: {e}")
+
+def reset_interrupted_profiles() -> int:
+    """Mark profiles left pending/running by a previous process as failed, so they can be re-run"""
+    db = SessionLocal()
+    try:
+        count = db.query(ModelFile).filter(ModelFile.profile_status.in_(["pending", "running"])).update(
+            {"profile_status": "failed", "profile": json.dumps({"error": "Interrupted by restart"})},
+            synchronize_session=False
+        )
+        db.commit()
+        return count
+    finally:
+        db.close()
@@ -0,0 +1,164 @@
+"""Per-key token bucket rate limiting.
+
+Bucket state lives in a small SQLite file next to the main database so every
+uvicorn worker on the host shares the same limits without an external
+service. The file uses WAL with synchronous=OFF: a bucket update is a few
+microseconds and losing the last buckets on power loss only refills them.
+An update still waits for the file's write lock (up to 5s when another
+worker holds it), so it runs on a worker thread, never on the event loop.
+"""
+import asyncio
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+from sqlalchemy import select
+from .config import settings
+from .database import DB_DIR, AsyncReadSessionLocal
+from .models.db_models import ApiKey
+
+RATE_LIMIT_DB_PATH = DB_DIR / "ratelimit.db"
+
+class KeyLimit(NamedTuple):
+    api_key_id: int
+    limit: int  # requests per window, 0 = unlimited
+    burst: int  # bucket capacity
+
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    limit: int
+    remaining: int
+    reset_after: int  # seconds until the bucket is full again
+    retry_after: int  # seconds until the next request is allowed (0 if allowed)
+
+class TokenBucketLimiter:
+    """Token buckets stored in a shared SQLite table, one row per bucket"""
+
+    def __init__(self, path=RATE_LIMIT_DB_PATH):
+        self.path = str(path)
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "bucket TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def consume(self, bucket: str, limit: int, window_seconds: float, burst: int, cost: float = 1.0) -> RateLimitResult:
+        """Take `cost` tokens from a bucket refilled at limit/window_seconds per second"""
+        rate = limit / window_seconds
+        now = time.time()
+        conn = self._connection()
+        # BEGIN IMMEDIATE takes the write lock up front so read-modify-write is atomic across processes
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT tokens, updated_at FROM buckets WHERE bucket = ?", (bucket,)
+            ).fetchone()
+            if row is None:
+                tokens = float(burst)
+            else:
+                tokens = min(float(burst), row[0] + max(0.0, now - row[1]) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            conn.execute(
+                "INSERT INTO buckets (bucket, tokens, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(bucket) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at",
+                (bucket, tokens, now)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        return RateLimitResult(
+            allowed=allowed,
+            limit=limit,
+            remaining=int(tokens),
+            reset_after=math.ceil((burst - tokens) / rate),
+            retry_after=0 if allowed else max(1, math.ceil((cost - tokens) / rate))
+        )
+
+    def prune(self, older_than_seconds: float) -> int:
+        """Delete buckets untouched for a while (they would be full again anyway)"""
+        conn = self._connection()
+        cursor = conn.execute(
+            "DELETE FROM buckets WHERE updated_at < ?", (time.time() - older_than_seconds,)
+        )
+        return cursor.rowcount
+
+# Per-worker LRU of key_value -> (expires_at, KeyLimit), at most RATE_LIMIT_CACHE_SIZE keys.
+# Unknown keys are not cached: a client cycling made-up keys would only evict real ones,
+# and their requests fail the API key check anyway.
+_limit_cache = OrderedDict()
+_limit_cache_lock = threading.Lock()
+
+limiter = TokenBucketLimiter()
+
+async def get_key_limit(key_value: str) -> Optional[KeyLimit]:
+    """Resolve the effective limit for an API key value, cached for RATE_LIMIT_CACHE_SECONDS"""
+    now = time.monotonic()
+    with _limit_cache_lock:
+        cached = _limit_cache.get(key_value)
+        if cached and cached[0] > now:
+            _limit_cache.move_to_end(key_value)
+            return cached[1]
+
+    async with AsyncReadSessionLocal() as db:
+        result = await db.execute(
+            select(ApiKey.id, ApiKey.rate_limit, ApiKey.rate_limit_burst).where(ApiKey.key_value == key_value)
+        )
+        row = result.first()
+    if row is None:
+        return None
+
+    limit = settings.RATE_LIMIT if row.rate_limit is None else row.rate_limit
+    burst = row.rate_limit_burst or settings.RATE_LIMIT_BURST or limit
+    key_limit = KeyLimit(api_key_id=row.id, limit=limit, burst=max(burst, 1))
+
+    with _limit_cache_lock:
+        _limit_cache[key_value] = (now + settings.RATE_LIMIT_CACHE_SECONDS, key_limit)
+        _limit_cache.move_to_end(key_value)
+        while len(_limit_cache) > settings.RATE_LIMIT_CACHE_SIZE:
+            _limit_cache.popitem(last=False)
+    return key_limit
+
+def invalidate_key_limits():
+    """Drop cached limits so admin changes apply immediately in this worker"""
+    with _limit_cache_lock:
+        _limit_cache.clear()
+
+async def check_rate_limit(key_value: str) -> Optional[RateLimitResult]:
+    """Consume one request for an API key. Returns None if the key is unknown or unlimited."""
+    key_limit = await get_key_limit(key_value)
+    if key_limit is None or key_limit.limit <= 0:
+        return None
+    return await asyncio.to_thread(
+        limiter.consume,
+        f"key:{key_limit.api_key_id}",
+        limit=key_limit.limit,
+        window_seconds=settings.RATE_LIMIT_WINDOW_SECONDS,
+        burst=key_limit.burst
+    )
+
+def rate_limit_headers(result: RateLimitResult) -> dict:
+    """Standard RateLimit-* headers (plus Retry-After when rejected)"""
+    headers = {
+        "RateLimit-Limit": str(result.limit),
+        "RateLimit-Remaining": str(result.remaining),
+        "RateLimit-Reset": str(result.reset_after),
+        "RateLimit-Policy": f"{result.limit};w={settings.RATE_LIMIT_WINDOW_SECONDS}",
+    }
+    if not result.allowed:
+        headers["Retry-After"] = str(result.retry_after)
+    return headers
@@ -0,0 +1,246 @@
+"""Request-log retention: monthly archive files and background pruning.
+
+request_logs only keeps the last LOG_RETENTION_DAYS of raw rows. Older rows
+are moved in small batches into per-month SQLite files under
+database/archive/ (request_logs_YYYY_MM.db), each batch in its own short
+transaction so the job never holds the write lock for long. A whole month
+is dropped in O(1) by deleting its file once it is older than
+LOG_ARCHIVE_MONTHS. Freed pages are returned with incremental vacuum.
+
+Archiving uses INSERT OR IGNORE keyed on the log id, so a crash between
+copying a batch and deleting it from the live table is harmless.
+"""
+import asyncio
+import fcntl
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from sqlalchemy.dialects import sqlite as sqlite_dialect
+from sqlalchemy.schema import CreateTable
+from .config import settings
+from .database import DB_DIR
+from .metrics import metrics
+from .models.db_models import RequestLog
+
+ARCHIVE_DIR = DB_DIR / "archive"
+APP_DB_PATH = DB_DIR / "app.db"
+LOCK_PATH = DB_DIR / "retention.lock"
+
+_LOG_COLUMNS = [column.name for column in RequestLog.__table__.columns]
+_ARCHIVE_DDL = str(CreateTable(RequestLog.__table__).compile(dialect=sqlite_dialect.dialect())).replace(
+    "CREATE TABLE", "CREATE TABLE IF NOT EXISTS", 1
+)
+_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"  # how SQLAlchemy stores DateTime in SQLite
+
+def archive_path(month: str):
+    """Archive file for a 'YYYY-MM' month"""
+    return ARCHIVE_DIR / f"request_logs_{month.replace('-', '_')}.db"
+
+def _connect(path) -> sqlite3.Connection:
+    conn = sqlite3.connect(str(path), timeout=settings.SQLITE_BUSY_TIMEOUT_MS / 1000)
+    conn.execute(f"PRAGMA busy_timeout={settings.SQLITE_BUSY_TIMEOUT_MS}")
+    return conn
+
+def _first_kept_month(now: datetime) -> str:
+    """Oldest 'YYYY-MM' archive month still within LOG_ARCHIVE_MONTHS (counting the current month)"""
+    year, month = now.year, now.month - settings.LOG_ARCHIVE_MONTHS + 1
+    while month <= 0:
+        year, month = year - 1, month + 12
+    return f"{year:04d}-{month:02d}"
+
+def _archive_rows(rows: list, keep_from: str):
+    """Copy rows into their month's archive file, skipping months that would be dropped anyway"""
+    by_month = {}
+    ts_index = _LOG_COLUMNS.index("timestamp")
+    for row in rows:
+        month = str(row[ts_index])[:7]
+        if month >= keep_from:
+            by_month.setdefault(month, []).append(row)
+
+    placeholders = ", ".join("?" for _ in _LOG_COLUMNS)
+    for month, month_rows in by_month.items():
+        conn = _connect(archive_path(month))
+        try:
+            conn.execute(_ARCHIVE_DDL)
+            # Archives created before a column was added to request_logs
+            existing = {row[1] for row in conn.execute("PRAGMA table_info(request_logs)")}
+            for column in RequestLog.__table__.columns:
+                if column.name not in existing:
+                    conn.execute(
+                        f"ALTER TABLE request_logs ADD COLUMN {column.name} "
+                        f"{column.type.compile(dialect=sqlite_dialect.dialect())}"
+                    )
+            conn.executemany(
+                f"INSERT OR IGNORE INTO request_logs ({', '.join(_LOG_COLUMNS)}) VALUES ({placeholders})",
+                month_rows
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+def prune_request_logs(now: datetime = None) -> dict:
+    """Move or delete raw logs past the retention horizon, one short batch at a time"""
+    now = now or datetime.utcnow()
+    cutoff = (now - timedelta(days=settings.LOG_RETENTION_DAYS)).strftime(_TIMESTAMP_FORMAT)
+    archive = settings.LOG_ARCHIVE_MONTHS > 0
+    if archive:
+        ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+
+    moved = 0
+    conn = _connect(APP_DB_PATH)
+    try:
+        while True:
+            rows = conn.execute(
+                f"SELECT {', '.join(_LOG_COLUMNS)} FROM request_logs "
+                f"WHERE timestamp < ? ORDER BY timestamp LIMIT ?",
+                (cutoff, settings.RETENTION_BATCH_SIZE)
+            ).fetchall()
+            if not rows:
+                break
+            if archive:
+                _archive_rows(rows, _first_kept_month(now))
+            ids = [row[0] for row in rows]
+            conn.execute(
+                f"DELETE FROM request_logs WHERE id IN ({', '.join('?' for _ in ids)})", ids
+            )
+            conn.commit()
+            moved += len(rows)
+            if len(rows) < settings.RETENTION_BATCH_SIZE:
+                break
+            # Let the request-path writer in between batches
+            time.sleep(0.05)
+
+        # Give freed pages back to the filesystem a little at a time
+        vacuumed = False
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            conn.execute(f"PRAGMA incremental_vacuum({settings.RETENTION_VACUUM_PAGES})")
+            vacuumed = True
+    finally:
+        conn.close()
+
+    metrics.inc("retention_rows_archived" if archive else "retention_rows_deleted", moved)
+    return {"rows": moved, "archived": archive, "vacuumed": vacuumed}
+
+def drop_expired_archives(now: datetime = None) -> list:
+    """Delete whole archive months older than LOG_ARCHIVE_MONTHS"""
+    if settings.LOG_ARCHIVE_MONTHS <= 0 or not ARCHIVE_DIR.exists():
+        return []
+    keep_from = _first_kept_month(now or datetime.utcnow()).replace("-", "_")
+
+    dropped = []
+    for path in sorted(ARCHIVE_DIR.glob("request_logs_*.db")):
+        if path.stem[len("request_logs_"):] < keep_from:
+            for suffix in ("", "-wal", "-shm", "-journal"):
+                try:
+                    os.remove(f"{path}{suffix}")
+                except FileNotFoundError:
+                    pass
+            dropped.append(path.name)
+    metrics.inc("retention_archives_dropped", len(dropped))
+    return dropped
+
+def run_retention() -> dict:
+    """One retention pass. Only one worker on the host runs it at a time."""
+    with open(LOCK_PATH, "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return {"skipped": True}
+        try:
+            result = prune_request_logs()
+            result["archives_dropped"] = drop_expired_archives()
+
+            from .ratelimit import limiter
+            result["rate_limit_buckets_pruned"] = limiter.prune(
+                older_than_seconds=max(settings.RATE_LIMIT_WINDOW_SECONDS * 10, 3600)
+            )
+
+            from .jobs import prune_expired_jobs
+            result["jobs_expired"] = prune_expired_jobs()
+            return result
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _size_mb(path) -> float:
+    """Size of a database file plus its WAL"""
+    total = 0
+    for suffix in ("", "-wal"):
+        try:
+            total += os.path.getsize(f"{path}{suffix}")
+        except OSError:
+            pass
+    return round(total / (1024 * 1024), 2)
+
+def enable_incremental_vacuum() -> dict:
+    """One-off migration of a database created without auto_vacuum.
+
+    The auto_vacuum mode of an existing file only changes with a full VACUUM,
+    which rewrites the whole database and holds the write lock until done.
+    Does nothing if the mode is already INCREMENTAL.
+    """
+    with open(LOCK_PATH, "w") as lock_file:
+        # Wait for a running retention pass instead of vacuuming under it
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            conn = _connect(APP_DB_PATH)
+            try:
+                if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                    return {"auto_vacuum": "incremental", "vacuumed": False}
+                size_before = _size_mb(APP_DB_PATH)
+                started = time.monotonic()
+                conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                conn.execute("VACUUM")
+                # VACUUM in WAL mode writes the new file through the WAL; fold it back
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+            finally:
+                conn.close()
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    seconds = round(time.monotonic() - started, 1)
+    print(f"✓ Vacuumed database in {seconds}s ({size_before}MB → {_size_mb(APP_DB_PATH)}MB), auto_vacuum=INCREMENTAL")
+    return {
+        "auto_vacuum": "incremental" if mode == 2 else str(mode),
+        "vacuumed": True,
+        "seconds": seconds,
+        "size_before_mb": size_before,
+        "size_after_mb": _size_mb(APP_DB_PATH),
+    }
+
+def get_retention_status() -> dict:
+    """Database and archive sizes for the admin API"""
+    archives = []
+    if ARCHIVE_DIR.exists():
+        for path in sorted(ARCHIVE_DIR.glob("request_logs_*.db")):
+            archives.append({
+                "month": path.stem[len("request_logs_"):].replace("_", "-"),
+                "size_mb": _size_mb(path),
+            })
+    conn = _connect(APP_DB_PATH)
+    try:
+        incremental = conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    finally:
+        conn.close()
+    return {
+        "log_retention_days": settings.LOG_RETENTION_DAYS,
+        "log_archive_months": settings.LOG_ARCHIVE_MONTHS,
+        "database_size_mb": _size_mb(APP_DB_PATH),
+        "incremental_vacuum": incremental,
+        "archives": archives,
+    }
+
+async def retention_loop():
+    """Background pruning job started from the app lifespan"""
+    interval = settings.RETENTION_INTERVAL_MINUTES * 60
+    while True:
+        try:
+            result = await asyncio.to_thread(run_retention)
+            if result.get("rows") or result.get("archives_dropped"):
+                print(f"✓ Retention: moved {result['rows']} request logs, dropped archives {result['archives_dropped']}")
+            if result.get("jobs_expired"):
+                print(f"✓ Retention: deleted {result['jobs_expired']} expired jobs")
+        except Exception as e:
+            print(f"⚠ Retention job failed: {e}")
+        await asyncio.sleep(interval)
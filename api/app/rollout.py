@@ -0,0 +1,278 @@
+"""Canary and shadow evaluation of a candidate model on live traffic.
+
+At most one ModelFile has a rollout_mode. In canary mode that model serves
+rollout_percent of /detect requests. In shadow mode the active model serves
+every request and rollout_percent of them are mirrored to the candidate.
+
+Either way, sampled requests are also run through the model that did not
+serve them, at most ROLLOUT_COMPARE_PER_SECOND per worker. A comparison
+waits for an inference slot like any detection, in its own scheduler queue
+weighted below every API key and the job worker, so it only runs in slots
+live traffic leaves over. A sample is skipped instead of queued while a
+comparison is still pending or the other model is busy. Each comparison
+records both models' inference times and how well their boxes agree. The
+results are accumulated per hour and written by the request log writer, in
+the same transaction as the logs.
+"""
+import asyncio
+import random
+import threading
+import time
+from datetime import datetime
+from typing import Optional, Tuple
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select, tuple_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from . import detector
+from .config import settings
+from .database import SessionLocal
+from .metrics import metrics
+from .models.db_models import COMPARISON_COUNTERS as COUNTERS, ModelComparison, ModelFile
+from .rollups import truncate_hour
+from .scheduler import inference_scheduler
+from .sketches import DDSketch
+
+IOU_THRESHOLD = 0.5
+COMPARE_QUEUE = "rollout"  # scheduler queue for comparisons
+COMPARE_WEIGHT = 0.01  # below API keys (1 by default) and job batches (JOB_PRIORITY_WEIGHT)
+
+def _iou(a: list, b: list) -> float:
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    inter = width * height
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+def compare_boxes(primary: list, candidate: list) -> dict:
+    """Greedy one-to-one box matching by IoU (highest first), then class agreement per pair"""
+    pairs = sorted(
+        ((_iou(p["xyxy"], c["xyxy"]), i, j) for i, p in enumerate(primary) for j, c in enumerate(candidate)),
+        reverse=True
+    )
+    used_primary, used_candidate = set(), set()
+    matched = class_matches = 0
+    iou_sum = 0.0
+    for iou, i, j in pairs:
+        if iou < IOU_THRESHOLD:
+            break
+        if i in used_primary or j in used_candidate:
+            continue
+        used_primary.add(i)
+        used_candidate.add(j)
+        matched += 1
+        iou_sum += iou
+        if primary[i]["class"] == candidate[j]["class"]:
+            class_matches += 1
+    agrees = matched == class_matches == len(primary) == len(candidate)
+    return {
+        "samples": 1,
+        "agreements": int(agrees),
+        "primary_boxes": len(primary),
+        "candidate_boxes": len(candidate),
+        "matched_boxes": matched,
+        "class_matches": class_matches,
+        "iou_sum": iou_sum,
+    }
+
+class ComparisonAccumulator:
+    """In-memory (hour, primary, candidate, mode) comparison deltas waiting for the next log flush"""
+
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def add(self, primary_id: int, candidate_id: int, mode: str, counts: dict,
+            primary_ms: float = None, candidate_ms: float = None):
+        key = (truncate_hour(datetime.utcnow()), primary_id, candidate_id, mode)
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is None:
+                entry = self._pending[key] = {"primary": DDSketch(), "candidate": DDSketch(), **dict.fromkeys(COUNTERS, 0)}
+            for name, value in counts.items():
+                entry[name] += value
+            if primary_ms is not None:
+                entry["primary"].add(primary_ms)
+            if candidate_ms is not None:
+                entry["candidate"].add(candidate_ms)
+
+    def take(self) -> dict:
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        return batch
+
+    def merge_back(self, batch: dict):
+        with self._lock:
+            for key, entry in batch.items():
+                current = self._pending.get(key)
+                if current is None:
+                    self._pending[key] = entry
+                    continue
+                for name in COUNTERS:
+                    current[name] += entry[name]
+                current["primary"].merge(entry["primary"])
+                current["candidate"].merge(entry["candidate"])
+
+async def apply_comparisons(conn, delta: dict):
+    """Merge comparison deltas into model_comparisons. `conn` must already hold the write lock."""
+    if not delta:
+        return
+    table = ModelComparison.__table__
+    bucket = (table.c.hour, table.c.primary_model_id, table.c.candidate_model_id, table.c.mode)
+    result = await conn.execute(select(table).where(tuple_(*bucket).in_(list(delta.keys()))))
+    merged = {
+        key: {
+            **{name: entry[name] for name in COUNTERS},
+            "primary": DDSketch(dict(entry["primary"].bins), entry["primary"].zero_count),
+            "candidate": DDSketch(dict(entry["candidate"].bins), entry["candidate"].zero_count),
+        }
+        for key, entry in delta.items()
+    }
+    for row in result.fetchall():
+        entry = merged[(row.hour, row.primary_model_id, row.candidate_model_id, row.mode)]
+        for name in COUNTERS:
+            entry[name] += getattr(row, name)
+        entry["primary"].merge(DDSketch.from_json(row.primary_sketch))
+        entry["candidate"].merge(DDSketch.from_json(row.candidate_sketch))
+
+    stmt = sqlite_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["hour", "primary_model_id", "candidate_model_id", "mode"],
+        set_={name: stmt.excluded[name] for name in (*COUNTERS, "primary_sketch", "candidate_sketch")}
+    )
+    await conn.execute(stmt, [
+        {
+            "hour": hour, "primary_model_id": primary_id, "candidate_model_id": candidate_id, "mode": mode,
+            **{name: entry[name] for name in COUNTERS},
+            "primary_sketch": entry["primary"].to_json(),
+            "candidate_sketch": entry["candidate"].to_json(),
+        }
+        for (hour, primary_id, candidate_id, mode), entry in merged.items()
+    ])
+
+class ModelRollout:
+    """Routes /detect between the active model and a candidate, and samples comparisons"""
+
+    def __init__(self, compare_per_second: float, refresh_seconds: float):
+        self.compare_per_second = compare_per_second
+        self.refresh_seconds = refresh_seconds
+        self._config = None
+        self._expires_at = 0.0
+        # Token bucket for comparisons, at most one second's worth of burst
+        self._tokens = 0.0
+        self._refilled_at = time.monotonic()
+        self._busy = False
+        self._loop = None
+        self._pending = None
+        self._lock = threading.Lock()
+
+    def config(self) -> Optional[dict]:
+        """Current candidate, re-read from the database every refresh_seconds"""
+        if time.monotonic() >= self._expires_at:
+            db = SessionLocal()
+            try:
+                model = db.query(ModelFile).filter(ModelFile.rollout_mode != None).first()
+                config = None if model is None or model.is_active else {
+                    "model_id": model.id,
+                    "mode": model.rollout_mode,
+                    "percent": model.rollout_percent or 0.0,
+                    "file_path": model.file_path,
+                    "sha256": model.sha256,
+                }
+            finally:
+                db.close()
+            if config is None or (self._config and self._config["model_id"] != config["model_id"]):
+                detector.release_candidate()
+            self._config = config
+            self._expires_at = time.monotonic() + self.refresh_seconds
+        return self._config
+
+    def invalidate(self):
+        """Re-read the rollout on the next request (after admin changes)"""
+        self._expires_at = 0.0
+
+    def _take_token(self) -> bool:
+        now = time.monotonic()
+        rate = max(self.compare_per_second, 0.0)
+        self._tokens = min(max(rate, 1.0), self._tokens + (now - self._refilled_at) * rate)
+        self._refilled_at = now
+        if self._tokens < 1.0:
+            return False
+        self._tokens -= 1.0
+        return True
+
+    def route(self) -> tuple:
+        """(config, candidate, canary) for one request: whether the candidate serves it is drawn here"""
+        config = self.config()
+        candidate = None
+        if config is not None:
+            model, kwargs = detector.get_candidate_model(config["model_id"], config["file_path"], config["sha256"])
+            if model is not None:
+                candidate = (model, config["model_id"], kwargs)
+        chosen = candidate is not None and config["mode"] == "canary" and random.random() * 100 < config["percent"]
+        return config, candidate, chosen
+
+    def detect(self, image_bytes: bytes, include_visual: bool = True, save_file: bool = False,
+               original_filename: str = None, deadline: float = None, route: tuple = None) -> Tuple[dict, int]:
+        """(detection result, id of the model that produced it); `route` is a route() result, drawn here if None"""
+        primary = detector.require_model()
+        config, candidate, chosen = route or self.route()
+        served, other = (candidate, primary) if chosen else (primary, candidate)
+        result, inference_ms = detector.run_model(
+            *served, image_bytes, include_visual, save_file, original_filename, deadline=deadline
+        )
+
+        # Canary compares any request; shadow only the mirrored share
+        if candidate is not None and (config["mode"] == "canary" or random.random() * 100 < config["percent"]):
+            self._offer(config["mode"], primary[1], candidate[1], served is primary, result["boxes"], inference_ms, other, image_bytes)
+        return result, served[1]
+
+    def _offer(self, mode, primary_id, candidate_id, primary_served, served_boxes, served_ms, other, image_bytes):
+        # Detections run on the request threadpool, so several may offer at once
+        with self._lock:
+            if self._loop is None or self._busy or not self._take_token():
+                metrics.inc("rollout_comparisons_skipped")
+                return
+            self._busy = True
+        # The scheduler belongs to the event loop; hand the comparison over to it
+        self._pending = asyncio.run_coroutine_threadsafe(
+            self._compare(mode, primary_id, candidate_id, primary_served, served_boxes, served_ms, other, image_bytes),
+            self._loop
+        )
+
+    async def _compare(self, mode, primary_id, candidate_id, primary_served, served_boxes, served_ms, other, image_bytes):
+        try:
+            ticket = inference_scheduler.enter(COMPARE_QUEUE, COMPARE_WEIGHT, 0, shed=False)
+            async with ticket:
+                outcome = await ticket.hold(run_in_threadpool(detector.run_model, *other, image_bytes, blocking=False))
+            if outcome is None:
+                metrics.inc("rollout_comparisons_skipped")
+                return
+            other_boxes, other_ms = outcome[0]["boxes"], outcome[1]
+            if primary_served:
+                counts = compare_boxes(served_boxes, other_boxes)
+                comparison_accumulator.add(primary_id, candidate_id, mode, counts, served_ms, other_ms)
+            else:
+                counts = compare_boxes(other_boxes, served_boxes)
+                comparison_accumulator.add(primary_id, candidate_id, mode, counts, other_ms, served_ms)
+            metrics.inc("rollout_comparisons")
+        except Exception as e:
+            if primary_served:
+                comparison_accumulator.add(primary_id, candidate_id, mode, {"candidate_errors": 1})
+            print(f"⚠ Rollout comparison failed: {e}")
+        finally:
+            self._busy = False
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+
+    def shutdown(self):
+        """Stop offering comparisons and drop the pending one, if any"""
+        self._loop = None
+        if self._pending is not None:
+            self._pending.cancel()
+            self._pending = None
+
+comparison_accumulator = ComparisonAccumulator()
+model_rollout = ModelRollout(settings.ROLLOUT_COMPARE_PER_SECOND, settings.ROLLOUT_REFRESH_SECONDS)
@@ -0,0 +1,181 @@
+"""Hourly per-key usage rollups (request/success/error counts, latency sum and histogram).
+
+Every logged request is added to an in-memory accumulator, including requests
+whose raw log is sampled out or dropped under load, so rollups stay exact.
+The request log writer merges the accumulated deltas into usage_rollups in
+the same transaction as its log batch. The log INSERT takes SQLite's write
+lock first, so the read-merge-upsert of histograms cannot interleave with
+another worker's flush.
+"""
+import json
+import threading
+from datetime import datetime
+from sqlalchemy import select, tuple_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from .database import engine, read_engine
+from .models.db_models import RequestLog, UsageRollup
+
+# Upper bounds (ms) of the latency histogram buckets; one extra bucket counts slower requests
+LATENCY_BUCKETS_MS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+def truncate_hour(ts: datetime) -> datetime:
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+def latency_bucket(latency_ms: float) -> int:
+    for index, bound in enumerate(LATENCY_BUCKETS_MS):
+        if latency_ms <= bound:
+            return index
+    return len(LATENCY_BUCKETS_MS)
+
+def _new_entry() -> list:
+    # [request_count, success_count, error_count, latency_sum_ms, histogram]
+    return [0, 0, 0, 0.0, [0] * (len(LATENCY_BUCKETS_MS) + 1)]
+
+def _merge_entry(target: list, source: list):
+    target[0] += source[0]
+    target[1] += source[1]
+    target[2] += source[2]
+    target[3] += source[3]
+    for index, count in enumerate(source[4]):
+        target[4][index] += count
+
+class RollupAccumulator:
+    """In-memory (api_key_id, hour) deltas waiting for the next log flush"""
+
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.flush_count = 0  # batches this worker wrote to usage_rollups, to invalidate cached daily counts
+
+    def add(self, api_key_id: int, timestamp: datetime, status_code: int, latency_ms: float):
+        key = (api_key_id, truncate_hour(timestamp))
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is None:
+                entry = self._pending[key] = _new_entry()
+            entry[0] += 1
+            if status_code == 200:
+                entry[1] += 1
+            if status_code >= 400:
+                entry[2] += 1
+            entry[3] += latency_ms
+            entry[4][latency_bucket(latency_ms)] += 1
+
+    def pending_since(self, api_key_id: int, since: datetime) -> int:
+        """Unflushed requests for a key in hours starting at or after `since`"""
+        since = truncate_hour(since)
+        with self._lock:
+            return sum(
+                entry[0] for (key_id, hour), entry in self._pending.items()
+                if key_id == api_key_id and hour >= since
+            )
+
+    def take(self) -> dict:
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        return batch
+
+    def merge_back(self, batch: dict):
+        with self._lock:
+            for key, entry in batch.items():
+                current = self._pending.get(key)
+                if current is None:
+                    self._pending[key] = entry
+                else:
+                    _merge_entry(current, entry)
+
+def _rows_for_upsert(merged: dict) -> list:
+    return [
+        {
+            "api_key_id": key_id,
+            "hour": hour,
+            "request_count": entry[0],
+            "success_count": entry[1],
+            "error_count": entry[2],
+            "latency_sum_ms": entry[3],
+            "latency_histogram": json.dumps(entry[4]),
+        }
+        for (key_id, hour), entry in merged.items()
+    ]
+
+def _upsert_statement(overwrite: bool = True):
+    table = UsageRollup.__table__
+    stmt = sqlite_insert(table)
+    if not overwrite:
+        return stmt.on_conflict_do_nothing(index_elements=["api_key_id", "hour"])
+    return stmt.on_conflict_do_update(
+        index_elements=["api_key_id", "hour"],
+        set_={
+            name: stmt.excluded[name]
+            for name in ("request_count", "success_count", "error_count", "latency_sum_ms", "latency_histogram")
+        }
+    )
+
+def _merge_existing(rows, delta: dict) -> dict:
+    merged = {}
+    for row in rows:
+        entry = [
+            row.request_count, row.success_count, row.error_count, row.latency_sum_ms,
+            json.loads(row.latency_histogram) if row.latency_histogram else [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        ]
+        merged[(row.api_key_id, row.hour)] = entry
+    for key, entry in delta.items():
+        if key in merged:
+            _merge_entry(merged[key], entry)
+        else:
+            merged[key] = entry
+    return merged
+
+async def apply_rollups(conn, delta: dict):
+    """Merge deltas into usage_rollups. `conn` must already hold the write lock."""
+    if not delta:
+        return
+    table = UsageRollup.__table__
+    result = await conn.execute(
+        select(table).where(tuple_(table.c.api_key_id, table.c.hour).in_(list(delta.keys())))
+    )
+    merged = _merge_existing(result.fetchall(), delta)
+    await conn.execute(_upsert_statement(), _rows_for_upsert(merged))
+
+def backfill_rollups(overwrite: bool = False) -> int:
+    """Build rollups from the raw request_logs still in the live table.
+
+    By default only (key, hour) buckets with no rollup row yet are filled, so it is
+    safe to run while traffic is flowing. With overwrite=True, completed hours are
+    recomputed from the logs (hours before the current one), which undoes sampling
+    corrections, so use it only for repairs.
+    """
+    delta = {}
+    with read_engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=10000).execute(
+            select(RequestLog.api_key_id, RequestLog.timestamp, RequestLog.status_code, RequestLog.response_time_ms)
+        )
+        for api_key_id, timestamp, status_code, latency_ms in result:
+            key = (api_key_id, truncate_hour(timestamp))
+            entry = delta.get(key)
+            if entry is None:
+                entry = delta[key] = _new_entry()
+            entry[0] += 1
+            if status_code == 200:
+                entry[1] += 1
+            if status_code >= 400:
+                entry[2] += 1
+            entry[3] += latency_ms
+            entry[4][latency_bucket(latency_ms)] += 1
+
+    if overwrite:
+        current_hour = truncate_hour(datetime.utcnow())
+        delta = {key: entry for key, entry in delta.items() if key[1] < current_hour}
+
+    rows = _rows_for_upsert(delta)
+    stmt = _upsert_statement(overwrite=overwrite)
+    for start in range(0, len(rows), 1000):
+        with engine.begin() as conn:
+            conn.execute(stmt, rows[start:start + 1000])
+    return len(rows)
+
+def rollups_empty() -> bool:
+    with read_engine.connect() as conn:
+        return conn.execute(select(UsageRollup.id).limit(1)).first() is None
+
+rollup_accumulator = RollupAccumulator()
@@ -1,8 +1,8 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from datetime import datetime, timedelta
-from ..database import get_db
+from ..database import get_db, get_read_db
 from ..models.schemas import (
     ApiKeyCreate, ApiKeyUpdate, ApiKeyRenew, 
     ApiKeyResponse, ApiKeyListResponse
@@ -10,6 +10,10 @@ from ..models.schemas import (
 from ..models.db_models import AdminUser
 from ..auth import get_current_admin
 from ..crud import api_keys as crud
+from ..pagination import decode_cursor, set_next_cursor
+from ..ratelimit import invalidate_key_limits
+from ..stats import dashboard_snapshot
+from ..usage import usage_tracker
 from ..models.db_models import ApiKey
 
 router = APIRouter(prefix="/admin/keys", tags=["Admin - API Keys"])
@@ -35,14 +39,20 @@ def format_key_list_response(key) -> ApiKeyListResponse:
             else:
                 expiration_status = "active"
     
+    # Include usage not yet flushed by this worker
+    pending_count, pending_used_at = usage_tracker.pending(key.id)
+    last_used_at = key.last_used_at
+    if pending_used_at and (last_used_at is None or pending_used_at > last_used_at):
+        last_used_at = pending_used_at
+    
     return ApiKeyListResponse(
         id=key.id,
         name=key.name,
         key_value_preview=key_preview,
         created_at=key.created_at,
-        last_used_at=key.last_used_at,
+        last_used_at=last_used_at,
         is_active=key.is_active,
-        request_count=key.request_count,
+        request_count=(key.request_count or 0) + pending_count,
         expires_at=key.expires_at,
         expiration_status=expiration_status,
         days_until_expiry=days_until_expiry
@@ -50,12 +60,19 @@ def format_key_list_response(key) -> ApiKeyListResponse:
 
 @router.get("", response_model=List[ApiKeyListResponse])
 async def list_api_keys(
+    response: Response,
     filter_status: Optional[str] = None,
-    db: Session = Depends(get_db),
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_read_db),
     current_admin: AdminUser = Depends(get_current_admin)
 ):
-    """List all API keys"""
-    keys = crud.get_api_keys(db, filter_status=filter_status)
+    """List API keys, newest first. Pass the X-Next-Cursor response header back as `cursor` for the next page."""
+    keys = crud.get_api_keys(
+        db, limit=limit, filter_status=filter_status,
+        cursor=decode_cursor(cursor) if cursor else None
+    )
+    set_next_cursor(response, keys, limit, lambda key: (key.created_at, key.id))
     return [format_key_list_response(key) for key in keys]
 
 @router.post("", response_model=ApiKeyResponse, status_code=status.HTTP_201_CREATED)
@@ -71,6 +88,7 @@ async def create_api_key(
         raise HTTPException(status_code=400, detail="API key name already exists")
     
     key = crud.create_api_key(db, key_data, created_by=current_admin.username)
+    dashboard_snapshot.invalidate()
     return key
 
 @router.get("/{key_id}", response_model=ApiKeyResponse)
@@ -96,6 +114,8 @@ async def update_api_key(
     key = crud.update_api_key(db, key_id, key_data)
     if not key:
         raise HTTPException(status_code=404, detail="API key not found")
+    invalidate_key_limits()
+    dashboard_snapshot.invalidate()
     return key
 
 @router.patch("/{key_id}/renew", response_model=ApiKeyResponse)
@@ -109,6 +129,7 @@ async def renew_api_key(
     key = crud.renew_api_key(db, key_id, renew_data)
     if not key:
         raise HTTPException(status_code=404, detail="API key not found")
+    dashboard_snapshot.invalidate()
     return key
 
 @router.patch("/{key_id}/toggle", response_model=ApiKeyResponse)
@@ -125,6 +146,7 @@ async def toggle_api_key(
     key.is_active = not key.is_active
     db.commit()
     db.refresh(key)
+    dashboard_snapshot.invalidate()
     return key
 
 @router.delete("/{key_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -137,6 +159,8 @@ async def delete_api_key(
     success = crud.delete_api_key(db, key_id)
     if not success:
         raise HTTPException(status_code=404, detail="API key not found")
+    invalidate_key_limits()
+    dashboard_snapshot.invalidate()
     return None
 
 @router.get("/expiring/soon", response_model=List[ApiKeyListResponse])
@@ -1,21 +1,39 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import FileResponse
 from sqlalchemy.orm import Session
-from typing import List, Optional
 from pathlib import Path
-import shutil
+from typing import List, Optional, Tuple
 import os
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ModuleNotFoundError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+from .. import model_store
+from ..model_artifacts import build_artifact_for_model, remove_artifacts
+from ..profiler import run_profile
+from ..rollout import model_rollout
+from ..config import settings
 from ..database import get_db
-from ..models.schemas import ModelFileResponse, ModelFileUpload
+from ..models.schemas import (
+    ModelFileResponse, ModelFileUpload, ModelUploadCreate, ModelUploadStatus, ModelUploadComplete, ModelRolloutUpdate
+)
 from ..models.db_models import AdminUser, ModelFile
 from ..auth import get_current_admin
 from ..crud import models as crud
+from ..stats import dashboard_snapshot
 
 router = APIRouter(prefix="/admin/models", tags=["Admin - Models"])
 
-# Models directory
-MODELS_DIR = Path("/app/models") if os.path.exists("/app") else Path("./models")
-MODELS_DIR.mkdir(parents=True, exist_ok=True)
+# upload_model parses its form itself; this documents it in the OpenAPI schema
+UPLOAD_FORM_SCHEMA = {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+    "type": "object",
+    "required": ["file"],
+    "properties": {"file": {"type": "string", "format": "binary"}, "description": {"type": "string"}},
+}}}}}
+FORM_FIELD_MAX_BYTES = 64 * 1024
+FORM_OVERHEAD_BYTES = 64 * 1024  # boundaries, part headers and the description
+WRITE_SIZE = 1024 * 1024
 
 @router.get("", response_model=List[ModelFileResponse])
 async def list_models(
@@ -25,76 +43,291 @@ async def list_models(
     """List all model files"""
     return crud.get_model_files(db)
 
-@router.post("/upload", response_model=ModelFileResponse, status_code=status.HTTP_201_CREATED)
+@router.post("/upload", response_model=ModelFileResponse, status_code=status.HTTP_201_CREATED, openapi_extra=UPLOAD_FORM_SCHEMA)
 async def upload_model(
-    file: UploadFile = File(...),
-    description: Optional[str] = Form(None),
+    request: Request,
+    response: Response,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     current_admin: AdminUser = Depends(get_current_admin)
 ):
-    """Upload a new YOLO model file"""
+    """Upload a new YOLO model file as form field `file` (identical weights return the existing model with 200)"""
+    tmp_path = None
     try:
-        # Validate file extension
-        if not file.filename.endswith('.pt'):
-            raise HTTPException(status_code=400, detail="Only .pt model files are allowed")
-        
-        # Check if file already exists and auto-rename if needed
-        original_filename = file.filename
-        file_path = MODELS_DIR / file.filename
-        
-        # If file exists, add timestamp to make it unique
-        if file_path.exists():
-            from datetime import datetime
-            timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-            name_parts = file.filename.rsplit('.', 1)
-            file.filename = f"{name_parts[0]}_{timestamp}.{name_parts[1]}"
-            file_path = MODELS_DIR / file.filename
-            print(f"⚠ File exists, renamed to: {file.filename}")
-        
-        # Check if database record with same path exists
-        existing_record = db.query(ModelFile).filter(ModelFile.file_path == str(file_path)).first()
-        if existing_record:
-            # Delete old file if exists
-            if os.path.exists(existing_record.file_path):
-                os.remove(existing_record.file_path)
-            # Delete database record
-            db.delete(existing_record)
-            db.commit()
-            print(f"⚠ Replaced existing model record: {existing_record.filename}")
-        
-        # Save file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # Get file size
-        file_size_mb = os.path.getsize(file_path) / (1024 * 1024)
-        
-        # Create database record
-        model_file = crud.create_model_file(
-            db,
-            filename=file.filename,
-            file_path=str(file_path),
-            file_size_mb=round(file_size_mb, 2),
-            uploaded_by=current_admin.username,
-            description=description
+        tmp_path, digest, size, filename, description = await _receive_model_form(request)
+        return await _store_model(
+            response, background_tasks, db, tmp_path, digest, size, filename, current_admin.username, description
         )
-        
-        return model_file
-        
     except HTTPException:
         raise
     except Exception as e:
-        # Clean up file if database insert failed
-        if file_path.exists():
-            try:
-                os.remove(file_path)
-            except:
-                pass
         print(f"✗ Upload error: {type(e).__name__}: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to upload model: {str(e)}"
         )
+    finally:
+        # Only left behind on errors; commit_blob moves or removes it
+        if tmp_path is not None and tmp_path.exists():
+            tmp_path.unlink(missing_ok=True)
+
+async def _receive_model_form(request: Request) -> Tuple[Path, str, int, str, Optional[str]]:
+    """Parse the multipart body as it arrives: (temp file, sha256, size, filename, description).
+
+    The file part goes straight to the hasher and a .uploads temp file, so it is
+    written once and the size limit applies while it is received (Starlette's
+    form parsing would spool the whole body to a temp file of its own first).
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or not params.get(b"boundary"):
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data body")
+    max_size = settings.MODEL_UPLOAD_MAX_MB * 1024 * 1024
+    too_large = HTTPException(status_code=413, detail=f"Model exceeds {settings.MODEL_UPLOAD_MAX_MB} MB")
+    if int(request.headers.get("content-length") or 0) > max_size + FORM_OVERHEAD_BYTES:
+        raise too_large
+
+    form = {"filename": None, "description": None}
+    part = {}
+    pending = bytearray()  # file bytes not yet written
+
+    def on_part_begin():
+        part.clear()
+        part.update(headers={}, field=b"", value=b"", name=None, data=bytearray())
+
+    def on_header_field(data, start, end):
+        part["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        part["value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][part["field"].lower()] = part["value"]
+        part["field"] = part["value"] = b""
+
+    def on_headers_finished():
+        _, options = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        part["name"] = options.get(b"name", b"").decode("utf-8", "replace")
+        if part["name"] == "file":
+            if form["filename"] is not None:
+                raise HTTPException(status_code=400, detail="Only one model file per upload")
+            form["filename"] = options.get(b"filename", b"").decode("utf-8", "replace")
+            if not form["filename"].endswith(".pt"):
+                raise HTTPException(status_code=400, detail="Only .pt model files are allowed")
+
+    def on_part_data(data, start, end):
+        if part["name"] == "file":
+            pending.extend(data[start:end])
+            return
+        if len(part["data"]) + end - start > FORM_FIELD_MAX_BYTES:
+            raise HTTPException(status_code=400, detail=f"Form field {part['name']} is too large")
+        part["data"].extend(data[start:end])
+
+    def on_part_end():
+        if part["name"] == "description":
+            form["description"] = part["data"].decode("utf-8", "replace")
+
+    parser = MultipartParser(params[b"boundary"], callbacks={
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+    upload = await run_in_threadpool(model_store.TempUpload, max_size)
+    try:
+        try:
+            async for chunk in request.stream():
+                parser.write(chunk)
+                if len(pending) >= WRITE_SIZE:
+                    await run_in_threadpool(upload.write, bytes(pending))
+                    pending.clear()
+            parser.finalize()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Malformed multipart body")
+        if form["filename"] is None:
+            raise HTTPException(status_code=400, detail="Missing form field: file")
+        await run_in_threadpool(upload.write, bytes(pending))
+        tmp_path, digest, size = await run_in_threadpool(upload.finish)
+    except model_store.UploadTooLarge:
+        upload.discard()
+        raise too_large
+    except BaseException:
+        upload.discard()
+        raise
+    return tmp_path, digest, size, form["filename"], form["description"]
+
+async def _store_model(response, background_tasks, db, tmp_path, digest, size, filename, uploaded_by, description) -> ModelFile:
+    path = await run_in_threadpool(model_store.commit_blob, tmp_path, digest)
+    model_file, created = model_store.register_model(
+        db, digest, path, size, filename, uploaded_by=uploaded_by, description=description
+    )
+    if created:
+        print(f"✓ Model stored: {filename} ({digest[:12]})")
+        if settings.MODEL_ARTIFACTS:
+            background_tasks.add_task(build_artifact_for_model, model_file.id)
+        if settings.MODEL_PROFILE_ON_UPLOAD:
+            _queue_profile(db, model_file, background_tasks)
+    else:
+        response.status_code = status.HTTP_200_OK
+        print(f"⚠ Duplicate upload of {filename}, same weights as model {model_file.id} ({model_file.filename})")
+    return model_file
+
+@router.post("/uploads", response_model=ModelUploadStatus, status_code=status.HTTP_201_CREATED)
+async def create_model_upload(
+    upload: ModelUploadCreate,
+    current_admin: AdminUser = Depends(get_current_admin)
+):
+    """Start a resumable chunked upload; send chunks with PATCH /uploads/{upload_id}?offset=N"""
+    if not upload.filename.endswith('.pt'):
+        raise HTTPException(status_code=400, detail="Only .pt model files are allowed")
+    if upload.size > settings.MODEL_UPLOAD_MAX_MB * 1024 * 1024:
+        raise HTTPException(status_code=413, detail=f"Model exceeds {settings.MODEL_UPLOAD_MAX_MB} MB")
+    session = await run_in_threadpool(
+        model_store.create_session, upload.filename, upload.size, current_admin.username, upload.sha256
+    )
+    return _upload_status(session)
+
+@router.get("/uploads/{upload_id}", response_model=ModelUploadStatus)
+async def get_model_upload(
+    upload_id: str,
+    current_admin: AdminUser = Depends(get_current_admin)
+):
+    """Get the received byte count of an upload, to resume after an interruption"""
+    return _upload_status(_get_session_or_404(upload_id))
+
+@router.patch("/uploads/{upload_id}", response_model=ModelUploadStatus)
+async def append_model_upload(
+    upload_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0),
+    current_admin: AdminUser = Depends(get_current_admin)
+):
+    """Append the raw request body at `offset`; 409 with the current offset if it does not match"""
+    session = _get_session_or_404(upload_id)
+    max_chunk = settings.MODEL_UPLOAD_CHUNK_MB * 4 * 1024 * 1024
+    if int(request.headers.get("content-length") or 0) > max_chunk:
+        raise HTTPException(status_code=413, detail=f"Chunks are limited to {max_chunk} bytes")
+    if offset != session["offset"]:
+        raise HTTPException(status_code=409, detail={"message": "Offset mismatch", "offset": session["offset"]})
+    
+    # Read incrementally: without Content-Length (chunked encoding) the limit still applies as bytes arrive
+    data = bytearray()
+    async for block in request.stream():
+        data.extend(block)
+        if len(data) > max_chunk:
+            raise HTTPException(status_code=413, detail=f"Chunks are limited to {max_chunk} bytes")
+        if offset + len(data) > session["size"]:
+            raise HTTPException(status_code=400, detail="Chunk extends past the declared upload size")
+    try:
+        session["offset"] = await run_in_threadpool(model_store.append_chunk, upload_id, offset, data)
+    except ValueError as e:
+        # Another request appended in the meantime
+        raise HTTPException(status_code=409, detail={"message": "Offset mismatch", "offset": e.args[0]})
+    return _upload_status(session)
+
+@router.post("/uploads/{upload_id}/complete", response_model=ModelFileResponse, status_code=status.HTTP_201_CREATED)
+async def complete_model_upload(
+    upload_id: str,
+    response: Response,
+    background_tasks: BackgroundTasks,
+    data: ModelUploadComplete = ModelUploadComplete(),
+    db: Session = Depends(get_db),
+    current_admin: AdminUser = Depends(get_current_admin)
+):
+    """Verify and store a fully uploaded model (identical weights return the existing model with 200)"""
+    session = _get_session_or_404(upload_id)
+    try:
+        tmp_path, digest, size = await run_in_threadpool(model_store.finish_session, upload_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        return await _store_model(
+            response, background_tasks, db, tmp_path, digest, size,
+            session["filename"], current_admin.username, data.description
+        )
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+@router.delete("/uploads/{upload_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def abort_model_upload(
+    upload_id: str,
+    current_admin: AdminUser = Depends(get_current_admin)
+):
+    """Abort an upload and delete the received bytes"""
+    _get_session_or_404(upload_id)
+    await run_in_threadpool(model_store.discard_session, upload_id)
+    return None
+
+def _queue_profile(db: Session, model_file: ModelFile, background_tasks: BackgroundTasks):
+    model_file.profile_status = "pending"
+    db.commit()
+    db.refresh(model_file)
+    background_tasks.add_task(run_profile, model_file.id)
+
+def _get_session_or_404(upload_id: str) -> dict:
+    session = model_store.get_session(upload_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return session
+
+def _upload_status(session: dict) -> ModelUploadStatus:
+    return ModelUploadStatus(
+        upload_id=session["upload_id"],
+        filename=session["filename"],
+        size=session["size"],
+        offset=session["offset"],
+        chunk_size=settings.MODEL_UPLOAD_CHUNK_MB * 1024 * 1024
+    )
+
+@router.post("/{model_id}/profile", response_model=ModelFileResponse, status_code=status.HTTP_202_ACCEPTED)
+async def profile_model(
+    model_id: int,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    current_admin: AdminUser = Depends(get_current_admin)
+):
+    """(Re)run the performance benchmark for a model in the background"""
+    model = db.query(ModelFile).filter(ModelFile.id == model_id).first()
+    if not model:
+        raise HTTPException(status_code=404, detail="Model not found")
+    if model.profile_status in ("pending", "running"):
+        raise HTTPException(status_code=409, detail="Profiling already in progress")
+    _queue_profile(db, model, background_tasks)
+    return model
+
+@router.put("/{model_id}/rollout", response_model=ModelFileResponse)
+async def start_rollout(
+    model_id: int,
+    rollout: ModelRolloutUpdate,
+    db: Session = Depends(get_db),
+    current_admin: AdminUser = Depends(get_current_admin)
+):
+    """Evaluate a model against the active one: canary (serves a share of traffic) or shadow (mirrored, responses unaffected)"""
+    model = db.query(ModelFile).filter(ModelFile.id == model_id).first()
+    if not model:
+        raise HTTPException(status_code=404, detail="Model not found")
+    if model.is_active:
+        raise HTTPException(status_code=400, detail="The active model cannot be a rollout candidate")
+    
+    model = crud.set_rollout(db, model_id, rollout.mode, rollout.percent)
+    model_rollout.invalidate()
+    print(f"✓ Rollout started: {model.filename} ({rollout.mode}, {rollout.percent}%)")
+    return model
+
+@router.delete("/{model_id}/rollout", response_model=ModelFileResponse)
+async def stop_rollout(
+    model_id: int,
+    db: Session = Depends(get_db),
+    current_admin: AdminUser = Depends(get_current_admin)
+):
+    """Stop a canary or shadow rollout; the active model serves all traffic again"""
+    model = crud.clear_rollout(db, model_id)
+    if not model:
+        raise HTTPException(status_code=404, detail="Model not found")
+    model_rollout.invalidate()
+    return model
 
 @router.patch("/{model_id}/activate", response_model=ModelFileResponse)
 async def activate_model(
@@ -112,6 +345,10 @@ async def activate_model(
         from .. import detector
         detector._model = None
         detector._model_load_error = None
+        dashboard_snapshot.invalidate()
+        model_rollout.invalidate()
+        # Lets a pre-fork master reload the model and replace its workers
+        model_store.publish_activation(model.id)
         print(f"✓ Model activated: {model.filename}, cache cleared")
         
         return model
@@ -141,11 +378,14 @@ async def delete_model(
     # Delete file from disk
     if os.path.exists(model.file_path):
         os.remove(model.file_path)
+    if model.sha256:
+        remove_artifacts(model.sha256)
     
     # Delete from database
     success = crud.delete_model_file(db, model_id)
     if not success:
         raise HTTPException(status_code=404, detail="Model not found")
+    model_rollout.invalidate()
     
     return None
 
@@ -1,108 +1,281 @@
-from fastapi import APIRouter, Depends, Query
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func
 from datetime import datetime, timedelta
 from typing import List, Optional
-from ..database import get_db
-from ..models.schemas import DashboardStats, RequestLogResponse
-from ..models.db_models import AdminUser, ApiKey, RequestLog, ModelFile
-from ..auth import get_current_admin
+from ..database import get_read_db
+from ..models.schemas import DashboardStats, RequestLogResponse, UsageSeriesResponse, LatencyStatsResponse, RolloutStatsResponse
+from ..models.db_models import AdminUser, RequestLog, ModelFile
+from ..auth import STREAM_TOKEN_EXPIRE_SECONDS, create_stream_token, get_current_admin, get_current_admin_from_stream_token
 from ..crud import logs as crud_logs
 from ..crud import models as crud_models
+from ..crud import usage as crud_usage
+from ..export import EXPORT_FORMATS, MEDIA_TYPES, parquet_available, stream_request_logs
+from ..live import live_stats
+from ..metrics import metrics
+from ..pagination import decode_cursor, set_next_cursor
+from ..retention import enable_incremental_vacuum, get_retention_status
+from ..rollout import IOU_THRESHOLD
+from ..rollups import LATENCY_BUCKETS_MS, backfill_rollups, truncate_hour
+from ..sketches import RELATIVE_ACCURACY, DDSketch, summarize
+from ..stats import dashboard_snapshot
+from ..telemetry import shared_telemetry
 
 router = APIRouter(prefix="/admin/stats", tags=["Admin - Statistics"])
 
 @router.get("/dashboard", response_model=DashboardStats)
 async def get_dashboard_stats(
-    db: Session = Depends(get_db),
+    request: Request,
     current_admin: AdminUser = Depends(get_current_admin)
 ):
-    """Get dashboard statistics"""
-    now = datetime.utcnow()
-    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    week_start = now - timedelta(days=7)
-    month_start = now - timedelta(days=30)
-    
-    # Total requests
-    total_requests_today = db.query(func.count(RequestLog.id)).filter(
-        RequestLog.timestamp >= today_start
-    ).scalar() or 0
-    
-    total_requests_week = db.query(func.count(RequestLog.id)).filter(
-        RequestLog.timestamp >= week_start
-    ).scalar() or 0
-    
-    total_requests_month = db.query(func.count(RequestLog.id)).filter(
-        RequestLog.timestamp >= month_start
-    ).scalar() or 0
-    
-    # Success rate
-    total_requests = db.query(func.count(RequestLog.id)).scalar() or 0
-    successful_requests = db.query(func.count(RequestLog.id)).filter(
-        RequestLog.status_code == 200
-    ).scalar() or 0
-    success_rate = (successful_requests / total_requests * 100) if total_requests > 0 else 100.0
-    
-    # Average response time
-    avg_response_time = db.query(func.avg(RequestLog.response_time_ms)).scalar() or 0
-    
-    # API keys count
-    active_keys_count = db.query(func.count(ApiKey.id)).filter(
-        ApiKey.is_active == True
-    ).scalar() or 0
-    
-    total_keys_count = db.query(func.count(ApiKey.id)).scalar() or 0
-    
-    # Expiring keys
-    future_7_days = now + timedelta(days=7)
-    expiring_keys_count = db.query(func.count(ApiKey.id)).filter(
-        ApiKey.is_active == True,
-        ApiKey.expires_at != None,
-        ApiKey.expires_at.between(now, future_7_days)
-    ).scalar() or 0
-    
-    # Current model
-    current_model = crud_models.get_active_model(db)
+    """Get dashboard statistics (shared snapshot, refreshed every DASHBOARD_CACHE_SECONDS; supports If-None-Match)"""
+    body, etag = await dashboard_snapshot.get()
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@router.post("/stream/token")
+async def create_live_stats_token(
+    current_admin: AdminUser = Depends(get_current_admin)
+):
+    """Issue a short-lived token that only opens /admin/stats/stream"""
+    return {"token": create_stream_token(current_admin.username), "expires_in": STREAM_TOKEN_EXPIRE_SECONDS}
+
+@router.get("/stream")
+async def stream_live_stats(
+    request: Request,
+    current_admin: AdminUser = Depends(get_current_admin_from_stream_token)
+):
+    """Server-sent events with live request rate, error rate, latency, queue depth, model state and per-key usage"""
+    queue = live_stats.subscribe()
     
-    # Check if model file exists
-    from ..detector import get_model
-    model_available = get_model() is not None
+    async def events():
+        try:
+            # Reconnect delay for EventSource, and an immediate first chunk so proxies flush headers
+            yield f"retry: 5000\n: connected, tick every {live_stats.tick_seconds}s\n\n"
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=live_stats.tick_seconds * 5)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keepalive\n\n"
+                    continue
+                if message is None:
+                    break
+                yield message
+        finally:
+            live_stats.unsubscribe(queue)
     
-    return DashboardStats(
-        total_requests_today=total_requests_today,
-        total_requests_week=total_requests_week,
-        total_requests_month=total_requests_month,
-        success_rate=round(success_rate, 2),
-        avg_response_time_ms=round(avg_response_time, 2),
-        active_keys_count=active_keys_count,
-        total_keys_count=total_keys_count,
-        expiring_keys_count=expiring_keys_count,
-        current_model=current_model
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
 
 @router.get("/logs", response_model=List[RequestLogResponse])
 async def get_request_logs(
-    skip: int = Query(0, ge=0),
+    response: Response,
     limit: int = Query(50, ge=1, le=100),
+    cursor: Optional[str] = None,
     api_key_id: Optional[int] = None,
-    db: Session = Depends(get_db),
+    status_code: Optional[int] = None,
+    endpoint: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    skip: int = Query(0, ge=0, deprecated=True),
+    db: Session = Depends(get_read_db),
     current_admin: AdminUser = Depends(get_current_admin)
 ):
-    """Get request logs with pagination"""
-    logs = crud_logs.get_request_logs(db, skip=skip, limit=limit, api_key_id=api_key_id)
+    """Get request logs, newest first. Pass the X-Next-Cursor response header back as `cursor` for the next page."""
+    rows = crud_logs.get_request_logs(
+        db, skip=skip, limit=limit, api_key_id=api_key_id,
+        cursor=decode_cursor(cursor) if cursor else None,
+        status_code=status_code, endpoint=endpoint, start=start, end=end
+    )
+    set_next_cursor(response, rows, limit, lambda row: (row[0].timestamp, row[0].id))
     
-    result = []
-    for log in logs:
-        api_key = db.query(ApiKey).filter(ApiKey.id == log.api_key_id).first()
-        result.append(RequestLogResponse(
+    return [
+        RequestLogResponse(
             id=log.id,
-            api_key_name=api_key.name if api_key else "Unknown",
+            api_key_name=api_key_name or "Unknown",
             endpoint=log.endpoint,
             status_code=log.status_code,
             response_time_ms=log.response_time_ms,
             timestamp=log.timestamp,
             ip_address=log.ip_address,
             error_message=log.error_message
-        ))
+        )
+        for log, api_key_name in rows
+    ]
+
+@router.get("/logs/export")
+async def export_request_logs(
+    start: datetime,
+    end: Optional[datetime] = None,
+    format: str = Query("csv", pattern="^(" + "|".join(EXPORT_FORMATS) + ")$"),
+    api_key_id: Optional[int] = None,
+    gzip: bool = False,
+    after_timestamp: Optional[datetime] = None,
+    after_id: Optional[int] = None,
+    current_admin: AdminUser = Depends(get_current_admin)
+):
+    """Stream request logs in [start, end) oldest first. Resume an interrupted export with the timestamp and id of the last row received."""
+    end = end or datetime.utcnow()
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    if (after_timestamp is None) != (after_id is None):
+        raise HTTPException(status_code=400, detail="after_timestamp and after_id must be given together")
+    if format == "parquet":
+        if not parquet_available():
+            raise HTTPException(status_code=400, detail="Parquet export requires the pyarrow package")
+        if gzip:
+            raise HTTPException(status_code=400, detail="Parquet is already compressed; gzip applies to csv and ndjson")
+    
+    filename = f"request_logs_{start:%Y%m%d%H%M}_{end:%Y%m%d%H%M}.{format}" + (".gz" if gzip else "")
+    body = stream_request_logs(
+        format, start, end, api_key_id=api_key_id, gzip=gzip,
+        after=(after_timestamp, after_id) if after_id is not None else None
+    )
+    return StreamingResponse(
+        body,
+        media_type="application/gzip" if gzip else MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@router.get("/metrics", response_model=dict)
+async def get_runtime_metrics(
+    current_admin: AdminUser = Depends(get_current_admin)
+):
+    """Get runtime metrics (queue depths, dropped logs, counters) summed over this host's workers
+    
+    Counters are since each worker started; `per_worker` has every worker's own values.
+    """
+    snapshot = metrics.snapshot()
     
-    return result
+    def read():
+        # Publish this worker's values first so they are current
+        shared_telemetry.publish_metrics(snapshot)
+        return shared_telemetry.read_metrics(stale_seconds=live_stats.tick_seconds * 3)
+    
+    return await asyncio.to_thread(read)
+
+@router.get("/retention", response_model=dict)
+async def get_retention(
+    current_admin: AdminUser = Depends(get_current_admin)
+):
+    """Get log retention settings, database size and monthly archive files"""
+    return get_retention_status()
+
+@router.post("/retention/vacuum", response_model=dict)
+async def vacuum_database(
+    current_admin: AdminUser = Depends(get_current_admin)
+):
+    """Enable incremental vacuum on a database created before it (one-off full VACUUM; blocks writes while it runs)"""
+    return await run_in_threadpool(enable_incremental_vacuum)
+
+@router.get("/usage", response_model=UsageSeriesResponse)
+async def get_usage(
+    hours: int = Query(24, ge=1, le=24 * 90),
+    api_key_id: Optional[int] = None,
+    db: Session = Depends(get_read_db),
+    current_admin: AdminUser = Depends(get_current_admin)
+):
+    """Get hourly usage (requests, errors, latency histogram) for one key or all keys"""
+    since = truncate_hour(datetime.utcnow() - timedelta(hours=hours - 1))
+    return UsageSeriesResponse(
+        api_key_id=api_key_id,
+        latency_buckets_ms=LATENCY_BUCKETS_MS,
+        points=crud_usage.get_usage_series(db, since=since, api_key_id=api_key_id)
+    )
+
+@router.get("/latency", response_model=LatencyStatsResponse)
+async def get_latency(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    api_key_id: Optional[int] = None,
+    model_id: Optional[int] = None,
+    group_by: str = Query("none", pattern="^(none|key|model)$"),
+    db: Session = Depends(get_read_db),
+    current_admin: AdminUser = Depends(get_current_admin)
+):
+    """Get p50/p90/p99 response times over a window (UTC, hour granularity, default last 24h)"""
+    end = end or datetime.utcnow()
+    start = start or end - timedelta(hours=24)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    
+    # Hours are whole buckets: include every hour that overlaps [start, end)
+    start, end = truncate_hour(start), truncate_hour(end - timedelta(microseconds=1)) + timedelta(hours=1)
+    sketches = crud_usage.get_latency_sketches(
+        db, start=start, end=end, api_key_id=api_key_id, model_id=model_id,
+        group_by=None if group_by == "none" else group_by
+    )
+    
+    groups = []
+    for group, sketch in sorted(sketches.items(), key=lambda item: item[0] or 0):
+        summary = summarize(sketch)
+        if group_by == "key":
+            summary["api_key_id"] = group
+        elif group_by == "model":
+            summary["model_id"] = group
+        groups.append(summary)
+    if not groups and group_by == "none":
+        groups.append(summarize(DDSketch()))
+    
+    return LatencyStatsResponse(
+        start=start, end=end, group_by=group_by,
+        relative_accuracy=RELATIVE_ACCURACY, groups=groups
+    )
+
+@router.get("/rollout", response_model=RolloutStatsResponse)
+async def get_rollout_stats(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    db: Session = Depends(get_read_db),
+    current_admin: AdminUser = Depends(get_current_admin)
+):
+    """Compare canary/shadow candidates with the active model: box agreement and inference latency (default last 24h)"""
+    end = end or datetime.utcnow()
+    start = start or end - timedelta(hours=24)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    start, end = truncate_hour(start), truncate_hour(end - timedelta(microseconds=1)) + timedelta(hours=1)
+    
+    def percent(part, whole):
+        return round(part / whole * 100, 2) if whole else None
+    
+    comparisons = []
+    for (primary_id, candidate_id, mode), entry in sorted(crud_usage.get_model_comparisons(db, start, end).items()):
+        comparisons.append({
+            "primary_model_id": primary_id,
+            "candidate_model_id": candidate_id,
+            "mode": mode,
+            "samples": entry["samples"],
+            "candidate_errors": entry["candidate_errors"],
+            "agreement_rate": percent(entry["agreements"], entry["samples"]),
+            "box_match_rate": percent(2 * entry["matched_boxes"], entry["primary_boxes"] + entry["candidate_boxes"]),
+            "class_match_rate": percent(entry["class_matches"], entry["matched_boxes"]),
+            "mean_iou": round(entry["iou_sum"] / entry["matched_boxes"], 4) if entry["matched_boxes"] else None,
+            "primary_boxes": entry["primary_boxes"],
+            "candidate_boxes": entry["candidate_boxes"],
+            "primary_latency": {"model_id": primary_id, **summarize(entry["primary"])},
+            "candidate_latency": {"model_id": candidate_id, **summarize(entry["candidate"])},
+        })
+    
+    return RolloutStatsResponse(
+        start=start, end=end, iou_threshold=IOU_THRESHOLD,
+        candidate=crud_models.get_rollout_model(db), comparisons=comparisons
+    )
+
+@router.post("/usage/backfill", response_model=dict)
+async def backfill_usage(
+    overwrite: bool = False,
+    current_admin: AdminUser = Depends(get_current_admin)
+):
+    """Build hourly rollups from existing request logs (fills missing hours, or recomputes completed hours with overwrite=true)"""
+    buckets = await run_in_threadpool(backfill_rollups, overwrite)
+    return {"buckets_written": buckets, "overwrite": overwrite}
@@ -1,14 +1,92 @@
-from fastapi import APIRouter, File, UploadFile, HTTPException
+import asyncio
+import hashlib
+import time
+from functools import partial
+from typing import Optional, Tuple
+from fastapi import APIRouter, File, Header, UploadFile, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse
-from ..detector import detect_image_bytes
+from ..capture import capture_writer
+from ..coalesce import detect_flight
+from ..config import settings
+from ..detector import get_loaded_model_id
+from ..metrics import metrics
+from ..rollout import model_rollout
+from ..scheduler import DeadlineExceeded, Overloaded, QueueFull, inference_scheduler
 
 router = APIRouter()
 
+async def detect_image(
+    state,
+    image_bytes: bytes,
+    include_visual: bool = True,
+    save_file: bool = False,
+    filename: Optional[str] = None,
+    deadline: Optional[float] = None
+) -> Tuple[dict, int]:
+    """(result, model id) for one image, scheduled for the key in `state`; errors raise HTTPException
+    
+    `state` is the request or WebSocket state set by the API key check (api_key_id,
+    priority_weight, max_queue_length); `deadline` is a time.monotonic() value.
+    """
+    try:
+        coalesce = settings.DETECT_COALESCE and not save_file
+        # Served by the active model, or by a canary candidate for a share of requests. Merged
+        # requests must be served by the same model, so draw that before building their key
+        route = await run_in_threadpool(model_rollout.route) if coalesce else None
+        run = partial(
+            run_in_threadpool, model_rollout.detect,
+            image_bytes, 
+            include_visual=include_visual,
+            save_file=save_file,
+            original_filename=filename,
+            route=route
+        )
+        
+        def detect(current_deadline) -> asyncio.Task:
+            # Queue for an inference slot shared fairly between API keys (Overloaded and QueueFull are raised here)
+            ticket = inference_scheduler.enter(state.api_key_id, state.priority_weight, state.max_queue_length)
+            
+            async def scheduled():
+                async with ticket:
+                    # Drop the work if it can't finish before the (last waiting) client gives up
+                    work_deadline = current_deadline()
+                    inference_scheduler.check_deadline(work_deadline)
+                    return await ticket.hold(run(deadline=work_deadline))
+            task = asyncio.ensure_future(scheduled())
+            # A task cancelled before its first step never enters the ticket
+            task.add_done_callback(lambda _: ticket.discard())
+            return task
+        
+        if deadline is not None and time.monotonic() >= deadline:
+            raise DeadlineExceeded("Deadline already passed")
+        if not coalesce:
+            work = detect(lambda: deadline)
+            return await (work if deadline is None else asyncio.wait_for(work, deadline - time.monotonic()))
+        # Identical images already being detected in this worker by the same model share that inference
+        config, candidate, canary = route
+        model_id = candidate[1] if canary else get_loaded_model_id()
+        key = (hashlib.blake2b(image_bytes, digest_size=16).digest(), model_id, include_visual)
+        return await detect_flight.do(key, partial(detect, partial(detect_flight.deadline, key)), deadline)
+    except Overloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except (DeadlineExceeded, asyncio.TimeoutError):
+        metrics.inc("deadline_expired")
+        raise HTTPException(status_code=504, detail="Request timeout expired before the detection finished")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Detection failed: {str(e)}")
+
 @router.post("/detect")
 async def detect_captcha(
+    request: Request,
     file: UploadFile = File(...),
     include_visual: bool = True,
-    save_file: bool = False
+    save_file: bool = False,
+    x_request_timeout: Optional[float] = Header(None, gt=0)
 ):
     """Detect objects in captcha image using YOLOv8 model
     
@@ -16,22 +94,27 @@ async def detect_captcha(
         file: Image file to detect
         include_visual: Include base64 visualization in response
         save_file: Save visualization to temp folder
+        X-Request-Timeout: Seconds the client will wait, from the request's arrival; late work is dropped (504)
     """
-    try:
-        if not file.content_type.startswith('image/'):
-            raise HTTPException(status_code=400, detail="File must be an image")
-        
-        image_bytes = await file.read()
-        result = detect_image_bytes(
-            image_bytes, 
-            include_visual=include_visual,
-            save_file=save_file,
-            original_filename=file.filename
-        )
-        
-        return JSONResponse(content=result)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Detection failed: {str(e)}")
+    # Set by the start_request_deadline middleware, before the upload was received
+    deadline = getattr(request.state, "deadline", None)
+    if not file.content_type.startswith('image/'):
+        raise HTTPException(status_code=400, detail="File must be an image")
+    
+    image_bytes = await file.read()
+    capture_writer.record(image_bytes, file.content_type, include_visual, save_file, x_request_timeout)
+    result, model_id = await detect_image(
+        request.state, image_bytes,
+        include_visual=include_visual,
+        save_file=save_file,
+        filename=file.filename,
+        deadline=deadline
+    )
+    
+    # Recorded with the request log for per-model latency stats
+    request.state.model_id = model_id
+    
+    return JSONResponse(content=result)
 
 @router.get("/health")
 async def health_check():
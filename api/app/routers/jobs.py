@@ -0,0 +1,117 @@
+import asyncio
+import json
+import time
+from typing import List
+from fastapi import APIRouter, File, HTTPException, Query, Request, Response, UploadFile
+from ..config import settings
+from ..crud import jobs as crud_jobs
+from ..database import AsyncReadSessionLocal, AsyncSessionLocal, begin_immediate
+from ..metrics import metrics
+from ..models.schemas import JobItemResult, JobResponse
+
+router = APIRouter()
+
+def _job_response(job, items: list = None) -> JobResponse:
+    return JobResponse(
+        job_id=job.id,
+        status=job.status,
+        image_count=job.image_count,
+        done_count=job.done_count,
+        failed_count=job.failed_count,
+        created_at=job.created_at,
+        finished_at=job.finished_at,
+        expires_at=job.expires_at,
+        results=None if items is None else [
+            JobItemResult(
+                index=item.position,
+                filename=item.filename,
+                status=item.status,
+                result=json.loads(item.result) if item.result else None,
+                error=item.error
+            )
+            for item in items
+        ]
+    )
+
+@router.post("/jobs", response_model=JobResponse, status_code=202)
+async def submit_job(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    include_visual: bool = False
+):
+    """Queue images for background detection and return the job id at once
+    
+    Args:
+        files: Images to detect (at most JOB_MAX_IMAGES)
+        include_visual: Include base64 visualizations in the results
+    """
+    if len(files) > settings.JOB_MAX_IMAGES:
+        raise HTTPException(status_code=400, detail=f"Too many images ({len(files)}), at most {settings.JOB_MAX_IMAGES} per job")
+    for file in files:
+        if not (file.content_type or "").startswith('image/'):
+            raise HTTPException(status_code=400, detail=f"File must be an image: {file.filename}")
+    
+    quota = request.state.job_image_quota
+    if quota is None:
+        quota = settings.JOB_MAX_PENDING_IMAGES
+    
+    async def check_quota(db):
+        pending = await crud_jobs.get_pending_job_images_async(db, request.state.api_key_id)
+        if pending + len(files) > quota:
+            raise HTTPException(
+                status_code=429,
+                detail=f"Job quota exceeded: {pending} images still pending, at most {quota} per API key"
+            )
+    
+    # Refuse an over-quota job before reading its images into memory
+    if quota:
+        async with AsyncReadSessionLocal() as db:
+            await check_quota(db)
+    images = [(file.filename, await file.read()) for file in files]
+    
+    async with AsyncSessionLocal() as db:
+        if quota:
+            # Check again under the write lock, so concurrent submissions (in any worker) can't both fit
+            await begin_immediate(db)
+            await check_quota(db)
+        job = await crud_jobs.create_job_async(db, request.state.api_key_id, images, include_visual)
+    
+    metrics.inc("jobs_submitted")
+    return _job_response(job)
+
+@router.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(
+    request: Request,
+    job_id: str,
+    wait: float = Query(0, ge=0),
+    partial: bool = False
+):
+    """Job status, with results once it is done
+    
+    Args:
+        wait: Long-poll up to this many seconds (at most JOB_MAX_WAIT_SECONDS) for the job to finish
+        partial: Include the results finished so far while the job is still running
+    """
+    deadline = time.monotonic() + min(wait, settings.JOB_MAX_WAIT_SECONDS)
+    while True:
+        async with AsyncReadSessionLocal() as db:
+            job = await crud_jobs.get_job_async(db, job_id, request.state.api_key_id)
+            if not job:
+                raise HTTPException(status_code=404, detail="Job not found")
+            
+            finished = job.status == "done"
+            if finished or time.monotonic() >= deadline:
+                items = await crud_jobs.get_job_items_async(db, job_id) if finished or partial else None
+                return _job_response(job, items)
+        
+        await asyncio.sleep(min(settings.JOB_POLL_SECONDS, max(deadline - time.monotonic(), 0)))
+
+@router.delete("/jobs/{job_id}", status_code=204)
+async def delete_job(request: Request, job_id: str):
+    """Cancel a job, or delete a finished job's results"""
+    async with AsyncSessionLocal() as db:
+        job = await crud_jobs.get_job_async(db, job_id, request.state.api_key_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+        await crud_jobs.delete_job_async(db, job_id)
+    return Response(status_code=204)
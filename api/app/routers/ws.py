@@ -0,0 +1,247 @@
+"""Persistent WebSocket connection for high-frequency detection clients.
+
+The client authenticates once, when connecting (X-API-Key header, or
+?api_key= for clients that cannot set headers), and then sends one binary
+message per image:
+
+    request id  uint32, big-endian
+    timeout_ms  uint16, big-endian (0 = none; like X-Request-Timeout)
+    flags       uint8 (bit 0: include_visual)
+    image bytes
+
+Every message is answered by one JSON text message, in completion order:
+{"id": ..., "status": 200, "result": {...}} or {"id": ..., "status": 4xx/5xx,
+"error": "..."}, with the status codes /detect would return. At most
+WS_MAX_IN_FLIGHT images per connection are processed at once; the server
+stops reading until one finishes, so a fast client is slowed down by TCP
+backpressure instead of queueing without bound.
+
+Each image counts as one request: it is rate limited, counted against
+daily_limit and logged as /api/v1/ws (frames cut off by a disconnect as
+499). The daily limit is checked on every frame against the key's count
+across all of this worker's connections and HTTP requests. The key itself
+is checked again every WS_RECHECK_SECONDS, so a disabled key closes its
+connections.
+"""
+import asyncio
+import functools
+import struct
+import time
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+from starlette.status import HTTP_429_TOO_MANY_REQUESTS, WS_1008_POLICY_VIOLATION
+from ..config import settings
+from ..crud.logs import get_today_request_count_async
+from ..database import AsyncReadSessionLocal
+from ..deps import check_api_key
+from ..live import live_stats
+from ..log_writer import request_log_writer
+from ..metrics import metrics
+from ..ratelimit import check_rate_limit
+from ..rollups import rollup_accumulator
+from ..usage import usage_tracker
+from .captcha import detect_image
+
+router = APIRouter()
+
+FRAME_HEADER = struct.Struct(">IHB")
+FLAG_INCLUDE_VISUAL = 1
+DAILY_COUNT_CACHE_SECONDS = 1.0
+STATUS_CLIENT_CLOSED = 499
+
+_connections = 0
+metrics.gauge("ws_connections", lambda: _connections)
+
+_daily_counts = {}  # api_key_id -> (requests in usage_rollups today, monotonic time read, rollup flush_count)
+_unlogged = {}  # api_key_id -> frames admitted by this worker whose log is not enqueued yet
+
+async def used_today(api_key_id: int) -> int:
+    """Today's requests for a key as this worker sees them, for the per-frame daily limit.
+
+    The usage_rollups total is cached for DAILY_COUNT_CACHE_SECONDS, or until this
+    worker flushes rollups; requests not flushed yet and frames still running
+    are counted from memory.
+    """
+    cached = _daily_counts.get(api_key_id)
+    now = time.monotonic()
+    if cached is None or now - cached[1] > DAILY_COUNT_CACHE_SECONDS or cached[2] != rollup_accumulator.flush_count:
+        flush_count = rollup_accumulator.flush_count
+        async with AsyncReadSessionLocal() as db:
+            count = await get_today_request_count_async(db, api_key_id)
+        cached = _daily_counts[api_key_id] = (count, now, flush_count)
+    return cached[0] + request_log_writer.pending_today(api_key_id) + _unlogged.get(api_key_id, 0)
+
+class DetectStream:
+    """One authenticated connection: reads frames, runs them concurrently, sends results"""
+
+    def __init__(self, websocket: WebSocket, key_value: str):
+        self.websocket = websocket
+        self.key_value = key_value
+        self.endpoint = websocket.url.path
+        self.ip_address = websocket.client.host if websocket.client else None
+        self.user_agent = websocket.headers.get("user-agent")
+        self.slots = asyncio.Semaphore(settings.WS_MAX_IN_FLIGHT)
+        self.tasks = set()
+        self._started = set()  # tasks whose handle() ran, and so logs its frame
+        self._send_lock = asyncio.Lock()
+        self._checked_at = 0.0
+        self._exhausted = False
+
+    async def authenticate(self):
+        """Check the key (raises HTTPException)"""
+        async with AsyncReadSessionLocal() as db:
+            try:
+                key_record = await check_api_key(db, self.key_value)
+                self._exhausted = False
+            except HTTPException as e:
+                if e.status_code != HTTP_429_TOO_MANY_REQUESTS or self._checked_at == 0.0:
+                    raise
+                # Over the daily limit mid-connection: refuse frames until the next check
+                self._exhausted = True
+                self._checked_at = time.monotonic()
+                return
+
+        self.daily_limit = key_record.daily_limit
+        self._checked_at = time.monotonic()
+        state = self.websocket.state
+        state.api_key_id = key_record.id
+        state.priority_weight = key_record.priority_weight
+        state.max_queue_length = key_record.max_queue_length
+
+    async def send(self, message: dict):
+        async with self._send_lock:
+            try:
+                await self.websocket.send_json(message)
+            except Exception:
+                pass  # The client went away; the receive loop notices
+
+    async def admit(self, request_id: int) -> bool:
+        """Rate limit and daily limit for one frame; answers refused frames itself"""
+        if time.monotonic() - self._checked_at > settings.WS_RECHECK_SECONDS:
+            await self.authenticate()
+
+        try:
+            result = await check_rate_limit(self.key_value)
+        except Exception as e:
+            print(f"⚠ Rate limiter error: {e}")
+            result = None
+        if result is not None and not result.allowed:
+            await self.send({
+                "id": request_id, "status": 429, "retry_after": result.retry_after,
+                "error": f"Rate limit exceeded ({result.limit} requests per {settings.RATE_LIMIT_WINDOW_SECONDS}s)"
+            })
+            return False
+
+        key_id = self.websocket.state.api_key_id
+        if self._exhausted or (self.daily_limit and self.daily_limit > 0 and await used_today(key_id) >= self.daily_limit):
+            await self.send({"id": request_id, "status": 429, "error": f"Daily request limit ({self.daily_limit}) exceeded"})
+            return False
+
+        # Counted until handle() logs the frame, which moves it into pending_today
+        _unlogged[key_id] = _unlogged.get(key_id, 0) + 1
+        usage_tracker.record(key_id)
+        return True
+
+    def log_frame(self, status: int, start_time: float, model_id: int = None):
+        """Log an admitted frame; called exactly once per frame"""
+        api_key_id = self.websocket.state.api_key_id
+        process_time = (time.time() - start_time) * 1000  # ms
+        _unlogged[api_key_id] -= 1
+        request_log_writer.enqueue(
+            api_key_id=api_key_id,
+            endpoint=self.endpoint,
+            status_code=status,
+            response_time_ms=round(process_time, 2),
+            ip_address=self.ip_address,
+            user_agent=self.user_agent,
+            model_id=model_id
+        )
+        live_stats.record(api_key_id, status, process_time)
+        metrics.inc("ws_frames")
+
+    async def handle(self, request_id: int, timeout_ms: int, flags: int, image_bytes: bytes):
+        self._started.add(asyncio.current_task())
+        start_time = time.time()
+        state = self.websocket.state
+        model_id = None
+        message = {"id": request_id, "status": 500, "error": "Internal server error"}
+        try:
+            if not image_bytes:
+                raise HTTPException(status_code=400, detail="Frame has no image")
+            deadline = time.monotonic() + timeout_ms / 1000 if timeout_ms else None
+            result, model_id = await detect_image(
+                state, image_bytes,
+                include_visual=bool(flags & FLAG_INCLUDE_VISUAL),
+                deadline=deadline
+            )
+            message = {"id": request_id, "status": 200, "result": result}
+        except HTTPException as e:
+            message = {"id": request_id, "status": e.status_code, "error": e.detail}
+        except asyncio.CancelledError:
+            # The connection closed; the frame was admitted and counted, so it is still logged
+            message = {"id": request_id, "status": STATUS_CLIENT_CLOSED, "error": "Client disconnected"}
+            raise
+        finally:
+            self.slots.release()
+            self.log_frame(message["status"], start_time, model_id)
+        await self.send(message)
+
+    def _frame_done(self, admitted_at: float, task: asyncio.Task):
+        self.tasks.discard(task)
+        if task in self._started:
+            self._started.discard(task)
+            return
+        # Cancelled before its first step (the connection closed right after admitting it)
+        self.slots.release()
+        self.log_frame(STATUS_CLIENT_CLOSED, admitted_at)
+
+    async def serve(self):
+        await self.send({
+            "ready": True,
+            "max_in_flight": settings.WS_MAX_IN_FLIGHT,
+            "max_frame_bytes": settings.WS_MAX_FRAME_KB * 1024
+        })
+        while True:
+            # Flow control: don't read the next frame until a slot is free
+            await self.slots.acquire()
+            message = await self.websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                self.slots.release()
+                return
+
+            frame = message.get("bytes")
+            if frame is None or len(frame) < FRAME_HEADER.size:
+                self.slots.release()
+                await self.send({"id": None, "status": 400, "error": "Frames must be binary: uint32 id, uint16 timeout_ms, uint8 flags, image"})
+                continue
+            request_id, timeout_ms, flags = FRAME_HEADER.unpack_from(frame)
+            if len(frame) - FRAME_HEADER.size > settings.WS_MAX_FRAME_KB * 1024:
+                self.slots.release()
+                await self.send({"id": request_id, "status": 413, "error": f"Image larger than {settings.WS_MAX_FRAME_KB}KB"})
+                continue
+
+            if not await self.admit(request_id):
+                self.slots.release()
+                continue
+            task = asyncio.create_task(self.handle(request_id, timeout_ms, flags, frame[FRAME_HEADER.size:]))
+            self.tasks.add(task)
+            task.add_done_callback(functools.partial(self._frame_done, time.time()))
+
+@router.websocket("/ws")
+async def detect_stream(websocket: WebSocket):
+    """Stream images over one connection; see the module docstring for the frame format"""
+    global _connections
+    await websocket.accept()
+    stream = DetectStream(websocket, websocket.headers.get("x-api-key") or websocket.query_params.get("api_key"))
+    _connections += 1
+    try:
+        await stream.authenticate()
+        await stream.serve()
+    except HTTPException as e:
+        await websocket.close(code=WS_1008_POLICY_VIOLATION, reason=str(e.detail))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        _connections -= 1
+        # Nobody is left to answer; cancelling also frees queued scheduler slots
+        for task in list(stream.tasks):
+            task.cancel()
@@ -0,0 +1,192 @@
+"""Weighted fair scheduling of inference across API keys.
+
+Each worker runs at most INFERENCE_SLOTS detections at once. Requests that
+arrive while every slot is busy wait in a queue per API key. Freed slots are
+handed out by deficit round-robin. When a key reaches the head of the round,
+its priority_weight is added to its deficit, and it is served while the
+deficit covers its next request. A weight-3 key therefore gets three
+requests in for every one of a weight-1 key, and a flood from one key mostly
+delays that key. A batch costs one unit per image. A key whose queue
+already holds max_queue_length requests is refused (429) instead of growing
+the queue for everyone.
+
+The scheduler also tracks how long a slot is usually held, so work granted a
+slot too late to finish before its client's deadline can be dropped (504).
+Admissions as a whole are capped by an adaptive limiter (see shedding.py),
+which refuses new requests with 503 while queueing delay stays too high.
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Optional
+from .config import settings
+from .metrics import metrics
+from .shedding import AdaptiveLimiter
+
+# Weights below this are raised to it: a weight <= 0 never earns a turn, so _next
+# would spin forever, and a tiny one takes cost / weight rounds to be served
+MIN_WEIGHT = 0.001
+
+class QueueFull(Exception):
+    """The key already has its maximum number of requests waiting"""
+
+class DeadlineExceeded(Exception):
+    """The client's deadline passed, or would pass before the work could finish"""
+
+class Overloaded(Exception):
+    """The worker is shedding load: admissions are at the adaptive limit"""
+
+class Ticket:
+    """A granted or queued inference slot; `async with ticket:` waits for and holds it"""
+
+    def __init__(self, scheduler: "FairScheduler", key_id, future: asyncio.Future, cost: int):
+        self.scheduler = scheduler
+        self.key_id = key_id
+        self.future = future
+        self.cost = cost
+        self.created_at = time.monotonic()
+        self._settled = False  # entered, or given back
+        self._work = None
+
+    def discard(self):
+        """Give the slot or queue place back if the ticket was never entered (safe to call twice)"""
+        if not self._settled:
+            self._settled = True
+            self.scheduler._abandon(self.key_id, self.future)
+
+    async def __aenter__(self):
+        try:
+            await self.future
+        except asyncio.CancelledError:
+            self.discard()
+            raise
+        self._settled = True
+        self.granted_at = time.monotonic()
+        self.scheduler.limiter.observe(self.granted_at - self.created_at)
+
+    async def hold(self, awaitable):
+        """Await the slot's work. If the caller is cancelled (e.g. a deadline), the slot
+        stays taken until the work itself finishes: a thread can't be interrupted."""
+        work = self._work = asyncio.ensure_future(awaitable)
+        return await asyncio.shield(work)
+
+    async def __aexit__(self, exc_type, exc, tb):
+        work = self._work
+        if work is not None and not work.done():
+            work.add_done_callback(self._release_after)
+            return
+        if exc_type is None:
+            self.scheduler._observe((time.monotonic() - self.granted_at) / self.cost)
+        self.scheduler._release()
+
+    def _release_after(self, work: asyncio.Future):
+        if not work.cancelled():
+            work.exception()  # Retrieved; nobody is waiting for it any more
+        self.scheduler._release()
+
+class FairScheduler:
+    """Per-key queues in front of a fixed number of inference slots (one event loop)"""
+
+    def __init__(self, slots: int, limiter: AdaptiveLimiter):
+        self.slots = max(1, slots)
+        self.limiter = limiter
+        self._running = 0
+        self._queues = {}  # key_id -> deque of waiting (future, cost)
+        self._weights = {}
+        self._deficits = {}
+        self._round = deque()  # keys with waiting requests, in round-robin order
+        self._service_seconds = 0.0  # moving average of how long a slot is held, per unit of cost
+        metrics.gauge("scheduler_queued", lambda: sum(len(queue) for queue in self._queues.values()))
+
+    def enter(self, key_id, weight: Optional[float] = None, max_queue: Optional[int] = None,
+              cost: int = 1, shed: bool = True) -> Ticket:
+        """Take a free slot or a place in the key's queue; raises Overloaded or QueueFull right away
+
+        `key_id` is an ApiKey.id, or a name for internal work such as the job worker,
+        which limits itself and passes shed=False.
+        """
+        if shed and not self.limiter.admit(self._running + sum(len(queue) for queue in self._queues.values())):
+            raise Overloaded("Server is overloaded, please retry shortly")
+        future = asyncio.get_running_loop().create_future()
+        if self._running < self.slots and not self._round:
+            self._running += 1
+            future.set_result(None)
+            return Ticket(self, key_id, future, cost)
+
+        if max_queue is None:
+            max_queue = settings.SCHEDULER_MAX_QUEUE
+        queue = self._queues.get(key_id)
+        if queue is None:
+            queue = self._queues[key_id] = deque()
+            self._deficits[key_id] = 0.0
+            self._round.append(key_id)
+        elif max_queue and len(queue) >= max_queue:
+            metrics.inc("scheduler_rejected")
+            raise QueueFull(f"Too many queued requests for this API key ({max_queue})")
+        weight = 1.0 if weight is None else weight
+        self._weights[key_id] = weight if weight >= MIN_WEIGHT else MIN_WEIGHT  # also catches NaN
+        queue.append((future, cost))
+        return Ticket(self, key_id, future, cost)
+
+    def check_deadline(self, deadline: Optional[float]):
+        """Raise DeadlineExceeded if work started now would finish after `deadline` (time.monotonic())"""
+        if deadline is not None and time.monotonic() + self._service_seconds > deadline:
+            metrics.inc("deadline_dropped")
+            raise DeadlineExceeded("Deadline exceeded before the detection could run")
+
+    def _observe(self, seconds: float):
+        self._service_seconds = 0.8 * self._service_seconds + 0.2 * seconds if self._service_seconds else seconds
+
+    def _next(self) -> Optional[asyncio.Future]:
+        """Pop the next waiter by deficit round-robin"""
+        while self._round:
+            key_id = self._round[0]
+            queue = self._queues[key_id]
+            if not queue:
+                # Keys leave the round when idle and lose any unused deficit
+                self._round.popleft()
+                del self._queues[key_id], self._deficits[key_id], self._weights[key_id]
+                continue
+            deficit = self._deficits[key_id]
+            cost = queue[0][1]
+            if deficit < cost:
+                # A new turn; small weights and large batches add up over several rounds
+                deficit += self._weights[key_id]
+                if deficit < cost:
+                    self._deficits[key_id] = deficit
+                    self._round.rotate(-1)
+                    continue
+            self._deficits[key_id] = deficit - cost
+            future = queue.popleft()[0]
+            if not queue or self._deficits[key_id] < queue[0][1]:
+                self._round.rotate(-1)
+            return future
+        return None
+
+    def _release(self):
+        self._running -= 1
+        while self._running < self.slots:
+            future = self._next()
+            if future is None:
+                break
+            self._running += 1
+            future.set_result(None)
+
+    def _abandon(self, key_id: int, future: asyncio.Future):
+        """A waiter was cancelled: give its slot back, or leave the queue"""
+        if future.done() and not future.cancelled():
+            self._release()
+            return
+        queue = self._queues.get(key_id)
+        if queue is not None:
+            for entry in queue:
+                if entry[0] is future:
+                    queue.remove(entry)
+                    break
+
+inference_scheduler = FairScheduler(settings.INFERENCE_SLOTS, AdaptiveLimiter(
+    settings.SHED_TARGET_DELAY_MS,
+    settings.SHED_INTERVAL_MS,
+    min_limit=settings.INFERENCE_SLOTS + 1,
+    max_limit=settings.SHED_MAX_ADMITTED,
+))
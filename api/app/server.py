@@ -0,0 +1,282 @@
+"""Pre-fork multi-worker server.
+
+    python -m api.app.server --host 0.0.0.0 --port 8000 --workers 4
+
+The master process runs the one-time startup tasks, then loads the active
+model, then forks the workers. A model without a compiled artifact is
+served from its .pt file while a forked builder process exports the
+artifact for the next generation. Workers inherit the loaded weights and
+share their memory pages copy-on-write, so N workers cost roughly one copy
+of the model instead of N. All workers accept on one listening socket.
+
+The master never runs inference: that would start torch's OpenMP thread
+pool, and a child forked from a process with a running pool can hang in its
+first parallel region. Each worker sets its thread count and runs the
+warm-up inference itself before accepting requests.
+
+Activating a model rewrites MODELS_DIR/.active_version (see model_store).
+The master polls that file. When it changes, the master loads the new model,
+forks a fresh set of workers and sends SIGTERM to the old ones. The old
+workers finish in-flight requests within the graceful-shutdown timeout.
+Crashed workers are replaced. SIGHUP forces a reload; SIGTERM/SIGINT stop
+everything.
+"""
+import argparse
+import gc
+import math
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from . import detector, main, model_store
+from .config import settings
+from .database import SessionLocal, engine, read_engine
+from .startup import startup_report
+
+# How long the master waits for leftover threads before forking
+THREAD_JOIN_TIMEOUT_SECONDS = 30
+
+def cpu_count() -> int:
+    """Usable cores: CPU affinity, capped by a cgroup v2 CPU quota (docker --cpus)"""
+    try:
+        count = len(os.sched_getaffinity(0))
+    except AttributeError:
+        count = os.cpu_count() or 1
+    try:
+        quota, period = open("/sys/fs/cgroup/cpu.max").read().split()
+        if quota != "max":
+            count = min(count, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return count
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+class Master:
+    """Forks and supervises uvicorn workers that share one listening socket"""
+
+    def __init__(self, sock: socket.socket, workers: int, graceful_timeout: int):
+        self.sock = sock
+        self.workers = workers
+        self.graceful_timeout = graceful_timeout
+        # Split the cores between workers instead of every worker using all of them
+        self.threads_per_worker = max(1, cpu_count() // workers)
+        self.children = {}  # pid -> generation
+        self.generation = 0
+        self.version = None
+        self.builder = None  # pid of the artifact builder, while it runs
+        self._reload = False
+        self._stop = False
+
+    def load_model(self):
+        """Load (unpickle) the active model in the master before forking (blocking)"""
+        missing_artifact = None
+        if settings.ENABLE_INFERENCE:
+            from .crud.models import get_active_model
+            from .model_artifacts import find_artifact
+
+            gc.unfreeze()
+            detector._model = None
+            detector._model_load_error = None
+            with startup_report.phase("model"):
+                db = SessionLocal()
+                try:
+                    active = get_active_model(db)
+                finally:
+                    db.close()
+                # Don't hold up the first workers for an export: they load the .pt
+                if active and settings.MODEL_ARTIFACTS and active.sha256 and find_artifact(active.sha256) is None:
+                    missing_artifact = (active.file_path, active.sha256)
+                # Load only; the workers warm up after fork (see the module docstring)
+                if detector.get_model() is None:
+                    print("⚠ Master could not load the model, workers will try on first request")
+
+        # Threads don't survive fork and SQLite connections must not be shared with children
+        deadline = time.monotonic() + THREAD_JOIN_TIMEOUT_SECONDS
+        for thread in threading.enumerate():
+            if thread is not threading.main_thread():
+                thread.join(max(0.0, deadline - time.monotonic()))
+                if thread.is_alive():
+                    raise RuntimeError(f"Thread {thread.name!r} still running after {THREAD_JOIN_TIMEOUT_SECONDS}s, refusing to fork")
+        engine.dispose()
+        read_engine.dispose()
+        # Objects that exist now are never collected, so the collector doesn't write to shared pages
+        gc.collect()
+        gc.freeze()
+        if missing_artifact:
+            self.spawn_builder(*missing_artifact)
+
+    def spawn_builder(self, model_path: str, digest: str):
+        """Export the artifact in a forked process; workers started after it finishes load it"""
+        from .model_artifacts import build_artifact
+
+        if self.builder is not None:
+            return  # build_artifact's lock file would turn a second builder away anyway
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                # Finish the export even if the master stops; build_artifact cleans up on failure
+                for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+                    signal.signal(signum, signal.SIG_IGN)
+                build_artifact(model_path, digest)
+            except BaseException as e:
+                print(f"⚠ Artifact builder {os.getpid()} failed: {e}")
+                code = 1
+            finally:
+                os._exit(code)
+        self.builder = pid
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                self._run_worker()
+            except BaseException as e:
+                print(f"✗ Worker {os.getpid()} crashed: {e}")
+                code = 1
+            finally:
+                os._exit(code)
+        self.children[pid] = self.generation
+
+    def _run_worker(self):
+        import uvicorn
+
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, signal.SIG_DFL)
+        detector.SCHEDULE_ARTIFACT_BUILDS = True
+        torch = sys.modules.get("torch")
+        if torch is not None:
+            torch.set_num_threads(self.threads_per_worker)
+        cv2 = sys.modules.get("cv2")
+        if cv2 is not None:
+            cv2.setNumThreads(self.threads_per_worker)
+        if detector.get_model_status() == "loaded":
+            try:
+                detector.warm_up()
+            except Exception as e:
+                print(f"⚠ Worker {os.getpid()} warm-up failed: {e}")
+
+        config = uvicorn.Config(main.app, timeout_graceful_shutdown=self.graceful_timeout)
+        uvicorn.Server(config).run(sockets=[self.sock])
+
+    def _spawn_generation(self):
+        for _ in range(self.workers):
+            self.spawn()
+        print(f"✓ Started {self.workers} workers (generation {self.generation}, "
+              f"{self.threads_per_worker} threads each): {sorted(pid for pid, gen in self.children.items() if gen == self.generation)}")
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if pid == self.builder:
+                self.builder = None
+                continue
+            generation = self.children.pop(pid, None)
+            if generation == self.generation and not self._stop:
+                print(f"⚠ Worker {pid} exited with status {status}, restarting")
+                self.spawn()
+
+    def reload(self):
+        """Load the newly activated model, then replace all workers"""
+        print("↻ Model activation detected, reloading workers")
+        old = [pid for pid, generation in self.children.items() if generation == self.generation]
+        self.load_model()
+        self.generation += 1
+        self._spawn_generation()
+        for pid in old:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def _handle_stop(self, signum, frame):
+        self._stop = True
+
+    def _handle_reload(self, signum, frame):
+        self._reload = True
+
+    def run(self, admin_id: int = None):
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGHUP, self._handle_reload)
+
+        self.version = model_store.read_activation()
+        self._spawn_generation()
+        if admin_id is not None:
+            main._sync_admin_password(admin_id)
+            engine.dispose()
+
+        try:
+            while not self._stop:
+                time.sleep(settings.SERVER_RELOAD_POLL_SECONDS)
+                self._reap()
+                version = model_store.read_activation()
+                if self._stop:
+                    break
+                if self._reload or version != self.version:
+                    self._reload = False
+                    self.version = version
+                    self.reload()
+        except Exception as e:
+            # Forking now is unsafe: stop the workers and exit so the supervisor restarts us
+            print(f"✗ Master failed: {e}")
+            raise
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        """SIGTERM all workers, wait for their graceful shutdown, then SIGKILL stragglers"""
+        print(f"Stopping {len(self.children)} workers")
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + self.graceful_timeout + 10
+        while self.children and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+def run():
+    parser = argparse.ArgumentParser(description="Pre-fork server: load the model once, share it with all workers")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=settings.SERVER_WORKERS, help="0 = one per CPU core")
+    parser.add_argument("--timeout-graceful-shutdown", type=int, default=5)
+    args = parser.parse_args()
+    workers = args.workers or cpu_count()
+
+    startup_report.record("imports", startup_report.origin)
+    admin_id = main.run_startup_tasks()
+    sock = bind_socket(args.host, args.port)
+    master = Master(sock, workers, args.timeout_graceful_shutdown)
+    detector.SCHEDULE_ARTIFACT_BUILDS = False
+    master.load_model()
+    main.PREFORKED = True
+    startup_report.ready()
+    print(f"✓ Listening on {args.host}:{args.port} (master {os.getpid()})")
+    master.run(admin_id)
+
+if __name__ == "__main__":
+    run()
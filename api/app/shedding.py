@@ -0,0 +1,65 @@
+"""Adaptive load shedding for inference admissions.
+
+Without admission control a spike makes every detection slow instead of
+failing a few fast. The limiter caps how many detections a worker has
+admitted (running plus queued) and steers that cap by queueing delay, the
+time from admission to getting an inference slot.
+
+It works like CoDel: if even the shortest queueing delay seen during an
+interval is above the target, the queue never drained and is standing. The
+limit is then cut in proportion to target / delay, at most by half. If the
+delay stayed under target while the limit was actually reached, the limit
+grows by one. Requests over the limit are refused at once with 503, so
+admitted requests keep a bounded wait.
+"""
+import time
+from typing import Optional
+from .metrics import metrics
+
+class AdaptiveLimiter:
+    """Concurrency limit steered by queueing delay; target_ms=0 disables shedding"""
+
+    def __init__(self, target_ms: float, interval_ms: float, min_limit: int, max_limit: int):
+        self.target = target_ms / 1000
+        self.interval = interval_ms / 1000
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = self.max_limit
+        self._window_start = time.monotonic()
+        self._window_min: Optional[float] = None
+        self._saturated = False
+        metrics.gauge("shed_limit", lambda: self.limit if self.enabled else None)
+
+    @property
+    def enabled(self) -> bool:
+        return self.target > 0
+
+    def admit(self, in_flight: int) -> bool:
+        """Whether one more request may be admitted next to `in_flight` already admitted"""
+        if not self.enabled:
+            return True
+        if in_flight + 1 >= self.limit:
+            self._saturated = True
+        if in_flight >= self.limit:
+            metrics.inc("shed_rejected")
+            return False
+        return True
+
+    def observe(self, queue_delay: float):
+        """Record one admitted request's wait (seconds) for an inference slot"""
+        if not self.enabled:
+            return
+        if self._window_min is None or queue_delay < self._window_min:
+            self._window_min = queue_delay
+        now = time.monotonic()
+        if now - self._window_start < self.interval:
+            return
+
+        if self._window_min > self.target:
+            gradient = max(0.5, self.target / self._window_min)
+            self.limit = max(self.min_limit, min(self.limit - 1, int(self.limit * gradient)))
+        elif self._saturated:
+            self.limit = min(self.max_limit, self.limit + 1)
+        self._window_start = now
+        self._window_min = None
+        self._saturated = False
@@ -0,0 +1,168 @@
+"""Mergeable latency quantile sketches (DDSketch) per hour, API key and model.
+
+A DDSketch maps each value x > 0 to the bin ceil(log_gamma(x)) with
+gamma = (1 + a) / (1 - a), so every quantile it returns is within relative
+error `a` of the true value. Two sketches merge by adding bin counts, so
+p50/p90/p99 over any window, key or model are computed by merging the
+stored hourly sketches instead of sorting request_logs.
+
+Sketch deltas are accumulated in memory and merged into latency_sketches
+by the request log writer, in the same transaction as rollups.
+"""
+import json
+import math
+import threading
+from datetime import datetime
+from typing import Iterable, Optional
+from sqlalchemy import select, tuple_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from .database import engine, read_engine
+from .models.db_models import LatencySketch, RequestLog
+from .rollups import truncate_hour
+
+RELATIVE_ACCURACY = 0.01
+_GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+_MIN_VALUE = 1e-3  # ms; anything smaller is counted in the zero bin
+
+class DDSketch:
+    """Relative-error quantile sketch over positive values"""
+
+    def __init__(self, bins: dict = None, zero_count: int = 0):
+        self.bins = bins or {}
+        self.zero_count = zero_count
+
+    @property
+    def count(self) -> int:
+        return self.zero_count + sum(self.bins.values())
+
+    def add(self, value: float, count: int = 1):
+        if value <= _MIN_VALUE:
+            self.zero_count += count
+            return
+        index = math.ceil(math.log(value) / _LOG_GAMMA)
+        self.bins[index] = self.bins.get(index, 0) + count
+
+    def merge(self, other: "DDSketch"):
+        self.zero_count += other.zero_count
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+
+    def quantile(self, q: float) -> Optional[float]:
+        total = self.count
+        if total == 0:
+            return None
+        rank = q * (total - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                return 2 * _GAMMA ** index / (_GAMMA + 1)
+        return 2 * _GAMMA ** max(self.bins) / (_GAMMA + 1)
+
+    def to_json(self) -> str:
+        return json.dumps({"z": self.zero_count, "b": {str(k): v for k, v in self.bins.items()}})
+
+    @classmethod
+    def from_json(cls, data: str) -> "DDSketch":
+        if not data:
+            return cls()
+        parsed = json.loads(data)
+        return cls({int(k): v for k, v in parsed.get("b", {}).items()}, parsed.get("z", 0))
+
+def merge_sketches(sketches: Iterable[DDSketch]) -> DDSketch:
+    merged = DDSketch()
+    for sketch in sketches:
+        merged.merge(sketch)
+    return merged
+
+def summarize(sketch: DDSketch) -> dict:
+    """Count and p50/p90/p99 in ms, rounded for API responses"""
+    def q(value):
+        result = sketch.quantile(value)
+        return round(result, 2) if result is not None else None
+    return {"count": sketch.count, "p50_ms": q(0.5), "p90_ms": q(0.9), "p99_ms": q(0.99)}
+
+class SketchAccumulator:
+    """In-memory (hour, api_key_id, model_id) sketch deltas waiting for the next log flush"""
+
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def add(self, api_key_id: int, model_id: Optional[int], timestamp: datetime, latency_ms: float):
+        # model_id 0 = unknown/no model, so the unique key never contains NULL
+        key = (truncate_hour(timestamp), api_key_id, model_id or 0)
+        with self._lock:
+            sketch = self._pending.get(key)
+            if sketch is None:
+                sketch = self._pending[key] = DDSketch()
+            sketch.add(latency_ms)
+
+    def take(self) -> dict:
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        return batch
+
+    def merge_back(self, batch: dict):
+        with self._lock:
+            for key, sketch in batch.items():
+                current = self._pending.get(key)
+                if current is None:
+                    self._pending[key] = sketch
+                else:
+                    current.merge(sketch)
+
+async def apply_sketches(conn, delta: dict):
+    """Merge sketch deltas into latency_sketches. `conn` must already hold the write lock."""
+    if not delta:
+        return
+    table = LatencySketch.__table__
+    result = await conn.execute(
+        select(table).where(tuple_(table.c.hour, table.c.api_key_id, table.c.model_id).in_(list(delta.keys())))
+    )
+    merged = {key: DDSketch(dict(sketch.bins), sketch.zero_count) for key, sketch in delta.items()}
+    for row in result.fetchall():
+        merged[(row.hour, row.api_key_id, row.model_id)].merge(DDSketch.from_json(row.sketch))
+
+    stmt = sqlite_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["hour", "api_key_id", "model_id"],
+        set_={"sketch": stmt.excluded.sketch, "count": stmt.excluded.count}
+    )
+    await conn.execute(stmt, [
+        {"hour": hour, "api_key_id": key_id, "model_id": model_id, "sketch": sketch.to_json(), "count": sketch.count}
+        for (hour, key_id, model_id), sketch in merged.items()
+    ])
+
+def backfill_sketches() -> int:
+    """Build sketches for buckets that have none yet from the raw request_logs still in the live table"""
+    delta = {}
+    with read_engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=10000).execute(
+            select(RequestLog.timestamp, RequestLog.api_key_id, RequestLog.model_id, RequestLog.response_time_ms)
+        )
+        for timestamp, api_key_id, model_id, latency_ms in result:
+            key = (truncate_hour(timestamp), api_key_id, model_id or 0)
+            sketch = delta.get(key)
+            if sketch is None:
+                sketch = delta[key] = DDSketch()
+            sketch.add(latency_ms)
+
+    rows = [
+        {"hour": hour, "api_key_id": key_id, "model_id": model_id, "sketch": sketch.to_json(), "count": sketch.count}
+        for (hour, key_id, model_id), sketch in delta.items()
+    ]
+    stmt = sqlite_insert(LatencySketch.__table__).on_conflict_do_nothing(index_elements=["hour", "api_key_id", "model_id"])
+    for start in range(0, len(rows), 1000):
+        with engine.begin() as conn:
+            conn.execute(stmt, rows[start:start + 1000])
+    return len(rows)
+
+def sketches_empty() -> bool:
+    with read_engine.connect() as conn:
+        return conn.execute(select(LatencySketch.id).limit(1)).first() is None
+
+sketch_accumulator = SketchAccumulator()
@@ -0,0 +1,41 @@
+"""Startup phase timing.
+
+Import this module first: its import time is the origin of the report, so
+the "imports" phase covers loading the app modules. The lifespan wraps each
+startup step in startup_report.phase(name). Steps that overlap with others,
+such as the inference preload, are recorded when they finish. The report is
+printed once the app is ready and exported as startup_* metrics.
+"""
+import time
+from contextlib import contextmanager
+from .metrics import metrics
+
+class StartupReport:
+    """Named phase durations (ms) since process import"""
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.phases = {}
+        self.total_ms = None
+
+    def record(self, name: str, started: float):
+        self.phases[name] = round((time.perf_counter() - started) * 1000, 1)
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, started)
+
+    def ready(self):
+        self.total_ms = round((time.perf_counter() - self.origin) * 1000, 1)
+        breakdown = " · ".join(f"{name} {ms:.0f}ms" for name, ms in self.phases.items())
+        print(f"✓ Startup complete in {self.total_ms:.0f}ms ({breakdown})")
+
+    def snapshot(self) -> dict:
+        return {"total_ms": self.total_ms, **self.phases}
+
+startup_report = StartupReport()
+metrics.gauge("startup_ms", startup_report.snapshot)
@@ -0,0 +1,115 @@
+"""Dashboard statistics, cached as one short-lived snapshot per worker.
+
+Every admin viewer polling the dashboard shares the same snapshot, so the
+aggregates are computed at most once per DASHBOARD_CACHE_SECONDS. Concurrent
+misses wait for a single recompute. The snapshot is served with an ETag, so
+unchanged polls get an empty 304.
+"""
+import asyncio
+import hashlib
+import time
+from datetime import datetime, timedelta
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func
+from .config import settings
+from .crud import models as crud_models
+from .crud import usage as crud_usage
+from .database import ReadSessionLocal
+from .detector import get_model_status
+from .models.db_models import ApiKey
+from .models.schemas import DashboardStats
+from .rollups import truncate_hour
+from .sketches import DDSketch, summarize
+
+def compute_dashboard_stats() -> DashboardStats:
+    """Aggregate dashboard statistics (blocking; run in a worker thread)"""
+    now = datetime.utcnow()
+    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    week_start = now - timedelta(days=7)
+    month_start = now - timedelta(days=30)
+
+    db = ReadSessionLocal()
+    try:
+        # Request totals from the hourly rollups (a few rows per key and hour, no log scans)
+        total_requests_today = crud_usage.get_usage_totals(db, since=today_start)["request_count"]
+        total_requests_week = crud_usage.get_usage_totals(db, since=truncate_hour(week_start))["request_count"]
+        total_requests_month = crud_usage.get_usage_totals(db, since=truncate_hour(month_start))["request_count"]
+
+        # Success rate and average response time over all time
+        totals = crud_usage.get_usage_totals(db)
+        total_requests = totals["request_count"]
+        success_rate = (totals["success_count"] / total_requests * 100) if total_requests > 0 else 100.0
+        avg_response_time = (totals["latency_sum_ms"] / total_requests) if total_requests > 0 else 0
+
+        # Tail latency over the last 24h, merged from hourly sketches
+        sketches = crud_usage.get_latency_sketches(db, start=truncate_hour(now - timedelta(hours=23)))
+        percentiles = summarize(sketches.get(None, DDSketch()))
+
+        # API keys count
+        active_keys_count = db.query(func.count(ApiKey.id)).filter(
+            ApiKey.is_active == True
+        ).scalar() or 0
+
+        total_keys_count = db.query(func.count(ApiKey.id)).scalar() or 0
+
+        # Expiring keys
+        future_7_days = now + timedelta(days=7)
+        expiring_keys_count = db.query(func.count(ApiKey.id)).filter(
+            ApiKey.is_active == True,
+            ApiKey.expires_at != None,
+            ApiKey.expires_at.between(now, future_7_days)
+        ).scalar() or 0
+
+        # Current model
+        current_model = crud_models.get_active_model(db)
+
+        return DashboardStats(
+            total_requests_today=total_requests_today,
+            total_requests_week=total_requests_week,
+            total_requests_month=total_requests_month,
+            success_rate=round(success_rate, 2),
+            avg_response_time_ms=round(avg_response_time, 2),
+            p50_response_time_ms=percentiles["p50_ms"],
+            p90_response_time_ms=percentiles["p90_ms"],
+            p99_response_time_ms=percentiles["p99_ms"],
+            active_keys_count=active_keys_count,
+            total_keys_count=total_keys_count,
+            expiring_keys_count=expiring_keys_count,
+            current_model=current_model,
+            # Read from the detector's state; never loads the model
+            model_status=get_model_status()
+        )
+    finally:
+        db.close()
+
+class DashboardSnapshot:
+    """TTL-cached serialized DashboardStats with an ETag"""
+
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self._body = None
+        self._etag = None
+        self._expires_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def _fresh(self) -> bool:
+        return self._body is not None and time.monotonic() < self._expires_at
+
+    async def get(self) -> tuple:
+        """(json_body, etag), recomputed by one caller when the snapshot is stale"""
+        if self._fresh():
+            return self._body, self._etag
+        async with self._lock:
+            if not self._fresh():
+                stats = await run_in_threadpool(compute_dashboard_stats)
+                body = stats.model_dump_json().encode()
+                self._body = body
+                self._etag = '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+                self._expires_at = time.monotonic() + self.ttl_seconds
+            return self._body, self._etag
+
+    def invalidate(self):
+        """Force a recompute on the next request (after admin changes)"""
+        self._expires_at = 0.0
+
+dashboard_snapshot = DashboardSnapshot(settings.DASHBOARD_CACHE_SECONDS)
@@ -0,0 +1,127 @@
+"""Telemetry shared between the worker processes of one host.
+
+Live counters and runtime metrics are kept in memory per process. Under the
+pre-fork server (server.py) an admin request reaches one worker, which would
+see only its own share of the traffic. Every worker therefore publishes its
+numbers into a small SQLite file next to the main database (like the rate
+limiter's buckets), and readers add them up:
+
+- live_ticks: one row per worker per live tick with that tick's request and
+  error counts, latency sketch, per-key usage and log queue depth. The SSE
+  broadcaster of each worker reads the rows of all workers since its last
+  tick, so every request is counted exactly once per stream.
+- worker_metrics: the latest metrics snapshot of each worker. Workers that
+  stopped publishing (exited) are left out.
+
+The file uses WAL with synchronous=OFF; losing it only loses a few seconds of
+live counters. All calls block and are made from worker threads.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from .database import DB_DIR
+from .sketches import DDSketch
+
+TELEMETRY_DB_PATH = DB_DIR / "telemetry.db"
+
+class SharedTelemetry:
+    """Per-worker rows in a shared SQLite file, summed on read"""
+
+    def __init__(self, path=TELEMETRY_DB_PATH):
+        self.path = str(path)
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS live_ticks ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, pid INTEGER NOT NULL, tick_at REAL NOT NULL, "
+                "requests INTEGER NOT NULL, errors INTEGER NOT NULL, sketch TEXT NOT NULL, "
+                "key_usage TEXT NOT NULL, log_queue_depth INTEGER NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_live_ticks_tick_at ON live_ticks (tick_at)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS worker_metrics ("
+                "pid INTEGER PRIMARY KEY, updated_at REAL NOT NULL, snapshot TEXT NOT NULL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def publish_tick(self, requests: int, errors: int, sketch: DDSketch, key_usage: dict,
+                     log_queue_depth: int, keep_seconds: float) -> int:
+        """Record this worker's tick (returns its row id) and drop ticks older than keep_seconds"""
+        now = time.time()
+        conn = self._connection()
+        cursor = conn.execute(
+            "INSERT INTO live_ticks (pid, tick_at, requests, errors, sketch, key_usage, log_queue_depth) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (os.getpid(), now, requests, errors, sketch.to_json(),
+             json.dumps({str(key_id): count for key_id, count in key_usage.items()}), log_queue_depth)
+        )
+        row_id = cursor.lastrowid
+        conn.execute("DELETE FROM live_ticks WHERE tick_at < ?", (now - keep_seconds,))
+        return row_id
+
+    def read_ticks(self, after_id: int, window_seconds: float) -> dict:
+        """All workers' ticks: totals since row after_id, and over the last window_seconds"""
+        now = time.time()
+        rows = self._connection().execute(
+            "SELECT id, pid, requests, errors, sketch, key_usage, log_queue_depth FROM live_ticks "
+            "WHERE tick_at >= ? OR id > ? ORDER BY id",
+            (now - window_seconds, after_id)
+        ).fetchall()
+
+        result = {
+            "last_id": after_id, "requests": 0, "errors": 0, "key_usage": {},
+            "window_requests": 0, "window_errors": 0, "window_sketch": DDSketch(),
+            "log_queue_depth": 0, "workers": 0,
+        }
+        queue_depths = {}
+        for row_id, pid, requests, errors, sketch, key_usage, log_queue_depth in rows:
+            result["window_requests"] += requests
+            result["window_errors"] += errors
+            result["window_sketch"].merge(DDSketch.from_json(sketch))
+            queue_depths[pid] = log_queue_depth  # latest per worker
+            if row_id > after_id:
+                result["requests"] += requests
+                result["errors"] += errors
+                for key_id, count in json.loads(key_usage).items():
+                    result["key_usage"][key_id] = result["key_usage"].get(key_id, 0) + count
+                result["last_id"] = row_id
+        result["log_queue_depth"] = sum(queue_depths.values())
+        result["workers"] = len(queue_depths)
+        return result
+
+    def publish_metrics(self, snapshot: dict):
+        self._connection().execute(
+            "INSERT INTO worker_metrics (pid, updated_at, snapshot) VALUES (?, ?, ?) "
+            "ON CONFLICT(pid) DO UPDATE SET updated_at = excluded.updated_at, snapshot = excluded.snapshot",
+            (os.getpid(), time.time(), json.dumps(snapshot))
+        )
+
+    def read_metrics(self, stale_seconds: float) -> dict:
+        """Numeric metrics summed over the workers that published within stale_seconds"""
+        conn = self._connection()
+        cutoff = time.time() - stale_seconds
+        conn.execute("DELETE FROM worker_metrics WHERE updated_at < ?", (cutoff,))
+        rows = conn.execute("SELECT pid, snapshot FROM worker_metrics ORDER BY pid").fetchall()
+
+        totals = {}
+        per_worker = {}
+        for pid, snapshot in rows:
+            snapshot = json.loads(snapshot)
+            per_worker[str(pid)] = snapshot
+            for name, value in snapshot.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    totals[name] = totals.get(name, 0) + value
+        totals["workers"] = len(per_worker)
+        totals["per_worker"] = per_worker
+        return totals
+
+shared_telemetry = SharedTelemetry()
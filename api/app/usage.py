@@ -0,0 +1,134 @@
+"""Write-behind accounting of API key usage (request_count, last_used_at).
+
+Requests only bump an in-memory counter; a background task flushes all
+pending deltas in one batched UPDATE every USAGE_FLUSH_INTERVAL_MS and on
+shutdown. Updates are relative (request_count + n) and last_used_at only
+moves forward, so several workers can flush the same keys in any order.
+If a worker is killed without shutdown, at most one flush interval of
+counts from that worker is lost; nothing is ever counted twice.
+"""
+import asyncio
+import atexit
+import threading
+from datetime import datetime
+from sqlalchemy import bindparam, case, func
+from .config import settings
+from .database import engine, async_engine
+from .models.db_models import ApiKey
+
+class UsageTracker:
+    """Accumulates per-key usage deltas in memory and flushes them in batches"""
+
+    def __init__(self):
+        self._pending = {}  # api_key_id -> [request_delta, last_used_at]
+        self._lock = threading.Lock()
+        self._task = None
+
+    def record(self, api_key_id: int, when: datetime = None):
+        """Count one request for a key"""
+        when = when or datetime.utcnow()
+        with self._lock:
+            entry = self._pending.get(api_key_id)
+            if entry is None:
+                self._pending[api_key_id] = [1, when]
+            else:
+                entry[0] += 1
+                if when > entry[1]:
+                    entry[1] = when
+
+    def pending(self, api_key_id: int):
+        """Unflushed (request_delta, last_used_at) for a key in this worker"""
+        with self._lock:
+            entry = self._pending.get(api_key_id)
+            return (entry[0], entry[1]) if entry else (0, None)
+
+    def _merge_back(self, batch: dict):
+        """Return a failed batch to the pending set so the next flush retries it"""
+        with self._lock:
+            for key_id, (count, when) in batch.items():
+                entry = self._pending.get(key_id)
+                if entry is None:
+                    self._pending[key_id] = [count, when]
+                else:
+                    entry[0] += count
+                    if when > entry[1]:
+                        entry[1] = when
+
+    def _take_batch(self):
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return batch, None, None
+
+        table = ApiKey.__table__
+        stmt = (
+            table.update()
+            .where(table.c.id == bindparam("key_id"))
+            .values(
+                request_count=func.coalesce(table.c.request_count, 0) + bindparam("delta"),
+                last_used_at=case(
+                    (table.c.last_used_at == None, bindparam("used_at")),
+                    (table.c.last_used_at < bindparam("used_at"), bindparam("used_at")),
+                    else_=table.c.last_used_at
+                )
+            )
+        )
+        params = [
+            {"key_id": key_id, "delta": count, "used_at": when}
+            for key_id, (count, when) in batch.items()
+        ]
+        return batch, stmt, params
+
+    async def flush(self) -> int:
+        """Write all pending deltas in one transaction. Returns the number of keys updated."""
+        batch, stmt, params = self._take_batch()
+        if not batch:
+            return 0
+        try:
+            async with async_engine.begin() as conn:
+                await conn.execute(stmt, params)
+        except Exception as e:
+            self._merge_back(batch)
+            print(f"⚠ Usage flush failed, will retry: {e}")
+            return 0
+        return len(params)
+
+    def flush_sync(self) -> int:
+        """Blocking flush for interpreter exit, when no event loop is running"""
+        batch, stmt, params = self._take_batch()
+        if not batch:
+            return 0
+        try:
+            with engine.begin() as conn:
+                conn.execute(stmt, params)
+        except Exception as e:
+            print(f"⚠ Usage flush failed at exit: {e}")
+            return 0
+        return len(params)
+
+    async def run(self):
+        """Flush periodically until cancelled"""
+        interval = settings.USAGE_FLUSH_INTERVAL_MS / 1000
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Stop the flusher and write whatever is still pending"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+usage_tracker = UsageTracker()
+
+# Last-chance flush for interpreter exits that skip the lifespan shutdown
+atexit.register(usage_tracker.flush_sync)
@@ -0,0 +1,203 @@
+"""SQLite engine profile benchmark.
+
+Simulates concurrent /detect traffic (one request log insert plus an API key
+usage update per request) while an admin thread runs the dashboard aggregate
+queries, and reports write throughput, "database is locked" errors and admin
+query latency for each engine profile:
+
+  baseline     bare create_engine(): rollback journal, synchronous=FULL
+  wal          production profile (WAL, synchronous=NORMAL, busy_timeout,
+               cache/mmap), per-request commits, read-only admin pool
+  wal-batched  production profile with writes batched by a single writer
+               (how the API writes usage and request logs)
+
+Usage:
+    python scripts/bench_sqlite.py --seconds 10 --writers 8 --seed-rows 200000
+"""
+import argparse
+import os
+import queue
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sqlalchemy import create_engine, func, insert, update
+from sqlalchemy.exc import OperationalError
+from api.app.database import Base, apply_sqlite_profile
+from api.app.models.db_models import ApiKey, RequestLog
+
+KEY_COUNT = 20
+
+def make_engines(path: str, profile: str):
+    url = f"sqlite:///{path}"
+    if profile == "baseline":
+        writer = create_engine(url, connect_args={"check_same_thread": False})
+        return writer, writer
+    writer = apply_sqlite_profile(create_engine(url, connect_args={"check_same_thread": False}))
+    reader = apply_sqlite_profile(
+        create_engine(url, connect_args={"check_same_thread": False}, pool_size=4, max_overflow=0),
+        readonly=True
+    )
+    return writer, reader
+
+def seed(writer, rows: int):
+    Base.metadata.create_all(bind=writer)
+    now = datetime.utcnow()
+    with writer.begin() as conn:
+        conn.execute(insert(ApiKey), [
+            {"name": f"bench-{i}", "key_value": f"bench-key-{i}", "request_count": 0}
+            for i in range(1, KEY_COUNT + 1)
+        ])
+        for start in range(0, rows, 10000):
+            conn.execute(insert(RequestLog), [
+                {
+                    "api_key_id": (i % KEY_COUNT) + 1,
+                    "endpoint": "/api/v1/detect",
+                    "status_code": 200 if i % 20 else 500,
+                    "response_time_ms": 50 + (i % 300),
+                    "timestamp": now - timedelta(seconds=i * 10),
+                }
+                for i in range(start, min(rows, start + 10000))
+            ])
+
+def log_row(i: int) -> dict:
+    return {
+        "api_key_id": (i % KEY_COUNT) + 1,
+        "endpoint": "/api/v1/detect",
+        "status_code": 200,
+        "response_time_ms": 42.0,
+        "timestamp": datetime.utcnow(),
+    }
+
+def admin_queries(reader):
+    """Roughly the aggregate queries run on every dashboard load"""
+    now = datetime.utcnow()
+    with reader.connect() as conn:
+        for since in (now.replace(hour=0, minute=0, second=0), now - timedelta(days=7), now - timedelta(days=30)):
+            conn.execute(func.count(RequestLog.id).select().where(RequestLog.timestamp >= since)).scalar()
+        conn.execute(func.count(RequestLog.id).select().where(RequestLog.status_code == 200)).scalar()
+        conn.execute(func.avg(RequestLog.response_time_ms).select()).scalar()
+
+def run_profile(profile: str, args) -> dict:
+    tmpdir = tempfile.mkdtemp(prefix="bench_sqlite_")
+    path = os.path.join(tmpdir, "app.db")
+    writer, reader = make_engines(path, profile)
+    seed(writer, args.seed_rows)
+
+    stop = threading.Event()
+    writes = [0]
+    lock_errors = [0]
+    counter_lock = threading.Lock()
+    admin_latencies = []
+    pending = queue.Queue()
+
+    def request_worker(worker_id: int):
+        i = worker_id
+        while not stop.is_set():
+            i += args.writers
+            if profile == "wal-batched":
+                pending.put(log_row(i))
+                with counter_lock:
+                    writes[0] += 1
+                time.sleep(0.0005)  # stand-in for inference time between requests
+                continue
+            try:
+                with writer.begin() as conn:
+                    conn.execute(insert(RequestLog), [log_row(i)])
+                    conn.execute(
+                        update(ApiKey).where(ApiKey.id == (i % KEY_COUNT) + 1)
+                        .values(request_count=ApiKey.request_count + 1, last_used_at=datetime.utcnow())
+                    )
+                with counter_lock:
+                    writes[0] += 1
+            except OperationalError:
+                with counter_lock:
+                    lock_errors[0] += 1
+
+    def batch_writer():
+        while not stop.is_set() or not pending.empty():
+            time.sleep(0.25)
+            batch = []
+            while True:
+                try:
+                    batch.append(pending.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                continue
+            usage = {}
+            for row in batch:
+                usage[row["api_key_id"]] = usage.get(row["api_key_id"], 0) + 1
+            with writer.begin() as conn:
+                conn.execute(insert(RequestLog), batch)
+                for key_id, count in usage.items():
+                    conn.execute(
+                        update(ApiKey).where(ApiKey.id == key_id)
+                        .values(request_count=ApiKey.request_count + count, last_used_at=datetime.utcnow())
+                    )
+
+    def admin_worker():
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                admin_queries(reader)
+                admin_latencies.append((time.perf_counter() - started) * 1000)
+            except OperationalError:
+                with counter_lock:
+                    lock_errors[0] += 1
+            time.sleep(0.05)
+
+    threads = [threading.Thread(target=request_worker, args=(n,)) for n in range(args.writers)]
+    threads.append(threading.Thread(target=admin_worker))
+    if profile == "wal-batched":
+        threads.append(threading.Thread(target=batch_writer))
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    writer.dispose()
+    reader.dispose()
+
+    admin_latencies.sort()
+    def pct(p):
+        if not admin_latencies:
+            return float("nan")
+        return admin_latencies[min(len(admin_latencies) - 1, int(len(admin_latencies) * p))]
+
+    return {
+        "profile": profile,
+        "writes_per_sec": writes[0] / elapsed,
+        "lock_errors": lock_errors[0],
+        "admin_queries": len(admin_latencies),
+        "admin_p50_ms": statistics.median(admin_latencies) if admin_latencies else float("nan"),
+        "admin_p95_ms": pct(0.95),
+        "admin_p99_ms": pct(0.99),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--writers", type=int, default=8, help="concurrent simulated /detect requests")
+    parser.add_argument("--seed-rows", type=int, default=200000, help="existing request_logs rows")
+    parser.add_argument("--profiles", default="baseline,wal,wal-batched")
+    args = parser.parse_args()
+
+    print(f"{'profile':<12} {'writes/s':>10} {'locked':>8} {'admin n':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for profile in args.profiles.split(","):
+        r = run_profile(profile.strip(), args)
+        print(
+            f"{r['profile']:<12} {r['writes_per_sec']:>10.0f} {r['lock_errors']:>8} {r['admin_queries']:>8} "
+            f"{r['admin_p50_ms']:>8.1f} {r['admin_p95_ms']:>8.1f} {r['admin_p99_ms']:>8.1f}"
+        )
+
+if __name__ == "__main__":
+    main()
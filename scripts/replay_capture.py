@@ -0,0 +1,180 @@
+"""Replay captured /detect traffic against an instance.
+
+Reads the segments written with CAPTURE_ENABLED (see api/app/capture.py) and
+sends the captured images, with their content type and options, to
+/api/v1/detect of the target. Requests are sent open-loop, on the captured
+schedule: --rate 1 reproduces the original request rate (gaps between sampled
+requests are divided by 1/sample_rate), --rate 2 twice that, and --rate 0
+sends back to back as fast as --concurrency allows.
+
+Latency is measured from each request's scheduled send time, so time spent
+waiting for a free client thread counts too (otherwise an overloaded target
+would look faster than it is). Run it once per build or model and compare
+the printed tables, or the --json summaries.
+
+Usage:
+    python scripts/replay_capture.py capture/ --url http://localhost:8000 --api-key KEY --rate 1
+    python scripts/replay_capture.py capture/ --rate 0 --concurrency 16 --limit 5000 --json new-model.json
+"""
+import argparse
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+FORMAT = "captcha-capture/1"
+EXTENSIONS = {"image/png": "png", "image/jpeg": "jpg", "image/gif": "gif", "image/webp": "webp", "image/bmp": "bmp"}
+
+def read_segment(path: Path) -> list:
+    """Records of one segment; a record cut short by a crash ends the segment"""
+    records = []
+    with open(path, "rb") as f:
+        header = json.loads(f.readline())
+        if header.get("format") != FORMAT:
+            raise ValueError(f"{path}: not a capture segment")
+        while True:
+            line = f.readline()
+            if not line:
+                break
+            try:
+                meta = json.loads(line)
+            except ValueError:
+                print(f"⚠ {path.name}: unreadable record, skipping the rest of the segment")
+                break
+            image = f.read(meta["size"])
+            if len(image) < meta["size"]:
+                print(f"⚠ {path.name}: truncated last record")
+                break
+            meta["image"] = image
+            meta["sample_rate"] = header["sample_rate"]
+            records.append(meta)
+    return records
+
+def load_capture(paths: list) -> list:
+    """All records of the given segment files and directories, in arrival order"""
+    files = []
+    for path in map(Path, paths):
+        files.extend(sorted(path.glob("capture-*.bin")) if path.is_dir() else [path])
+    records = []
+    for path in files:
+        records.extend(read_segment(path))
+    records.sort(key=lambda record: record["ts"])
+    return records
+
+def schedule(records: list, rate: float) -> list:
+    """Send offsets in seconds from the start of the replay"""
+    if rate <= 0 or not records:
+        return [0.0] * len(records)
+    first = records[0]["ts"]
+    return [(record["ts"] - first) * record["sample_rate"] / rate for record in records]
+
+def build_request(url: str, api_key: str, record: dict) -> urllib.request.Request:
+    content_type = record["content_type"] or "application/octet-stream"
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="capture.{EXTENSIONS.get(content_type, "bin")}"\r\n'
+        f"Content-Type: {content_type}\r\n\r\n"
+    ).encode() + record["image"] + f"\r\n--{boundary}--\r\n".encode()
+    query = f"include_visual={str(record['include_visual']).lower()}&save_file={str(record['save_file']).lower()}"
+    headers = {"X-API-Key": api_key, "Content-Type": f"multipart/form-data; boundary={boundary}"}
+    if record.get("timeout"):
+        headers["X-Request-Timeout"] = str(record["timeout"])
+    return urllib.request.Request(f"{url.rstrip('/')}/api/v1/detect?{query}", data=body, headers=headers, method="POST")
+
+def replay(records: list, args) -> dict:
+    offsets = schedule(records, args.rate)
+    results = []  # (status, latency ms)
+    results_lock = threading.Lock()
+
+    def send(record: dict, scheduled: float):
+        # Back to back (--rate 0): measure from the actual send
+        if args.rate <= 0:
+            scheduled = time.perf_counter()
+        try:
+            with urllib.request.urlopen(build_request(args.url, args.api_key, record), timeout=args.timeout) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except Exception:
+            status = 0  # connection error or client timeout
+        latency = (time.perf_counter() - scheduled) * 1000
+        with results_lock:
+            results.append((status, latency))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for record, offset in zip(records, offsets):
+            delay = started + offset - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(send, record, started + offset)
+    elapsed = time.perf_counter() - started
+
+    def pct(latencies: list, p: float):
+        if not latencies:
+            return None  # nothing succeeded
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 1)
+
+    statuses = {}
+    for status, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    ok = sorted(latency for status, latency in results if status == 200)
+    return {
+        "label": args.label,
+        "requests": len(results),
+        "seconds": round(elapsed, 2),
+        "offered_per_sec": round(len(records) / offsets[-1], 1) if offsets and offsets[-1] > 0 else None,
+        "throughput_per_sec": round(len(results) / elapsed, 1) if elapsed else None,
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "p50_ms": pct(ok, 0.50),
+        "p90_ms": pct(ok, 0.90),
+        "p99_ms": pct(ok, 0.99),
+        "max_ms": pct(ok, 1.0),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="capture directory or segment files")
+    parser.add_argument("--url", default="http://localhost:8000", help="target instance")
+    parser.add_argument("--api-key", default=os.environ.get("API_KEY"), help="key on the target (default: $API_KEY)")
+    parser.add_argument("--rate", type=float, default=1.0, help="multiple of the captured request rate, 0 = back to back")
+    parser.add_argument("--concurrency", type=int, default=32, help="requests in flight at most")
+    parser.add_argument("--limit", type=int, default=0, help="replay only the first N captured requests")
+    parser.add_argument("--timeout", type=float, default=30, help="client timeout per request (seconds)")
+    parser.add_argument("--label", default="", help="name for this run in the report")
+    parser.add_argument("--json", help="also write the summary to this file")
+    args = parser.parse_args()
+    if not args.api_key:
+        parser.error("--api-key or $API_KEY is required")
+
+    records = load_capture(args.paths)
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        parser.error("no captured requests found")
+    distinct = len({record["digest"] for record in records})
+    print(f"✓ Loaded {len(records)} requests ({distinct} distinct images, "
+          f"{sum(record['size'] for record in records) / len(records) / 1024:.1f}KB average)")
+
+    r = replay(records, args)
+    print(f"{'label':<12} {'requests':>9} {'offered/s':>10} {'done/s':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}  statuses")
+    offered = f"{r['offered_per_sec']:.1f}" if r["offered_per_sec"] else "max"
+    ms = lambda value: "-" if value is None else f"{value:.1f}"
+    print(
+        f"{r['label'] or '-':<12} {r['requests']:>9} {offered:>10} {r['throughput_per_sec']:>8.1f} "
+        f"{ms(r['p50_ms']):>8} {ms(r['p90_ms']):>8} {ms(r['p99_ms']):>8} {ms(r['max_ms']):>8}  "
+        + " ".join(f"{status}:{count}" for status, count in r["statuses"].items())
+    )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(r, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import sys
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+# The app is imported as the api.app package, like `python -m api.app.server`
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from api.app.database import Base  # noqa: E402
+
+@pytest.fixture
+def db_path(tmp_path):
+    """A fresh SQLite file with every table created"""
+    path = tmp_path / "app.db"
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    engine.dispose()
+    return path
+
+@pytest.fixture
+def db_session(db_path):
+    engine = create_engine(f"sqlite:///{db_path}")
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+    engine.dispose()
+
+@pytest.fixture
+def async_sessionmaker_factory(db_path):
+    """Returns (engine, sessionmaker) for the test database; dispose the engine inside the test's loop"""
+    def make():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+        return engine, async_sessionmaker(engine, expire_on_commit=False)
+    return make
@@ -0,0 +1,137 @@
+import asyncio
+import time
+
+import pytest
+
+from api.app.coalesce import SingleFlight
+
+class Work:
+    """fn() for SingleFlight.do that counts calls and finishes when released"""
+
+    def __init__(self, result="result", error: Exception = None):
+        self.calls = 0
+        self.cancelled = False
+        self.release = asyncio.Event()
+        self.result = result
+        self.error = error
+
+    async def __call__(self):
+        self.calls += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+def test_concurrent_callers_share_one_call():
+    async def main():
+        flight = SingleFlight("test_share")
+        work = Work()
+        callers = [asyncio.create_task(flight.do("key", work)) for _ in range(5)]
+        await asyncio.sleep(0)
+        work.release.set()
+        assert await asyncio.gather(*callers) == ["result"] * 5
+        assert work.calls == 1
+        assert flight._inflight == {}
+    asyncio.run(main())
+
+def test_different_keys_run_separately():
+    async def main():
+        flight = SingleFlight("test_keys")
+        first, second = Work("a"), Work("b")
+        callers = [asyncio.create_task(flight.do("a", first)), asyncio.create_task(flight.do("b", second))]
+        await asyncio.sleep(0)
+        first.release.set()
+        second.release.set()
+        assert await asyncio.gather(*callers) == ["a", "b"]
+    asyncio.run(main())
+
+def test_nothing_is_kept_after_the_flight():
+    async def main():
+        flight = SingleFlight("test_no_cache")
+        work = Work()
+        work.release.set()
+        await flight.do("key", work)
+        await flight.do("key", work)
+        assert work.calls == 2
+    asyncio.run(main())
+
+def test_errors_reach_every_caller():
+    async def main():
+        flight = SingleFlight("test_errors")
+        work = Work(error=ValueError("bad image"))
+        callers = [asyncio.create_task(flight.do("key", work)) for _ in range(3)]
+        await asyncio.sleep(0)
+        work.release.set()
+        results = await asyncio.gather(*callers, return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+        assert work.calls == 1
+    asyncio.run(main())
+
+def test_caller_deadline_does_not_cancel_shared_work():
+    async def main():
+        flight = SingleFlight("test_deadline")
+        work = Work()
+        patient = asyncio.create_task(flight.do("key", work))
+        hasty = asyncio.create_task(flight.do("key", work, deadline=time.monotonic() + 0.05))
+        with pytest.raises(asyncio.TimeoutError):
+            await hasty
+        assert not work.cancelled
+        work.release.set()
+        assert await patient == "result"
+    asyncio.run(main())
+
+def test_cancelled_caller_leaves_others_waiting():
+    async def main():
+        flight = SingleFlight("test_cancel_one")
+        work = Work()
+        first = asyncio.create_task(flight.do("key", work))
+        second = asyncio.create_task(flight.do("key", work))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        assert not work.cancelled
+        work.release.set()
+        assert await second == "result"
+    asyncio.run(main())
+
+def test_work_is_cancelled_when_every_caller_left():
+    async def main():
+        flight = SingleFlight("test_cancel_all")
+        work = Work()
+        callers = [asyncio.create_task(flight.do("key", work)) for _ in range(2)]
+        await asyncio.sleep(0)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0)
+        assert work.cancelled
+        assert flight._inflight == {}
+
+        # The next caller starts fresh work instead of joining the cancelled one
+        work.release.set()
+        assert await flight.do("key", work) == "result"
+        assert work.calls == 2
+    asyncio.run(main())
+
+def test_deadline_is_the_latest_of_the_waiters():
+    async def main():
+        flight = SingleFlight("test_deadline_max")
+        work = Work()
+        now = time.monotonic()
+        callers = [
+            asyncio.create_task(flight.do("key", work, deadline=now + 10)),
+            asyncio.create_task(flight.do("key", work, deadline=now + 20)),
+        ]
+        await asyncio.sleep(0)
+        assert flight.deadline("key") == now + 20
+        callers.append(asyncio.create_task(flight.do("key", work)))
+        await asyncio.sleep(0)
+        assert flight.deadline("key") is None  # one waiter has no deadline
+        work.release.set()
+        await asyncio.gather(*callers)
+        assert flight.deadline("key") is None
+    asyncio.run(main())
@@ -0,0 +1,136 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from api.app.crud import jobs as crud
+from api.app.models.db_models import DetectionJob, DetectionJobItem
+
+TTL = timedelta(hours=1)
+
+def run_with_db(async_sessionmaker_factory, test):
+    """Run test(Session) on the test database in a fresh event loop"""
+    async def main():
+        engine, Session = async_sessionmaker_factory()
+        try:
+            await test(Session)
+        finally:
+            await engine.dispose()
+    asyncio.run(main())
+
+async def make_job(Session, images: int = 5) -> DetectionJob:
+    async with Session() as db:
+        return await crud.create_job_async(db, 1, [(f"{i}.png", b"img%d" % i) for i in range(images)])
+
+async def statuses(Session) -> list:
+    async with Session() as db:
+        return (await db.execute(select(DetectionJobItem.status).order_by(DetectionJobItem.id))).scalars().all()
+
+def outcomes(rows, error=None) -> list:
+    return [(row.id, row.job_id, None if error else '{"boxes": []}', error, 7) for row in rows]
+
+def test_claims_are_oldest_first_and_disjoint(async_sessionmaker_factory):
+    async def test(Session):
+        job = await make_job(Session)
+        async with Session() as db:
+            first = await crud.claim_job_items_async(db, 3)
+        async with Session() as db:
+            second = await crud.claim_job_items_async(db, 3)
+        async with Session() as db:
+            assert await crud.claim_job_items_async(db, 3) == []
+            job = await crud.get_job_async(db, job.id, 1)
+        assert [row.image for row in first] == [b"img0", b"img1", b"img2"]
+        assert [row.image for row in second] == [b"img3", b"img4"]
+        assert job.status == "running"
+        assert await statuses(Session) == ["running"] * 5
+    run_with_db(async_sessionmaker_factory, test)
+
+def test_concurrent_claims_never_share_an_item(async_sessionmaker_factory):
+    async def test(Session):
+        await make_job(Session, images=20)
+
+        async def claim():
+            async with Session() as db:
+                return await crud.claim_job_items_async(db, 4)
+
+        # Claims that lose the race come back short or empty; claim in rounds until the queue is drained
+        ids = []
+        for _ in range(20):
+            batches = await asyncio.gather(*(claim() for _ in range(4)))
+            ids.extend(row.id for batch in batches for row in batch)
+            if not any(batches):
+                break
+        assert len(ids) == len(set(ids)) == 20
+    run_with_db(async_sessionmaker_factory, test)
+
+def test_completion_finishes_the_job(async_sessionmaker_factory):
+    async def test(Session):
+        job = await make_job(Session, images=3)
+        async with Session() as db:
+            rows = await crud.claim_job_items_async(db, 3)
+            await crud.complete_job_items_async(db, outcomes(rows[:2]) + outcomes(rows[2:], error="bad image"), TTL)
+            job = await crud.get_job_async(db, job.id, 1)
+            items = await crud.get_job_items_async(db, job.id)
+        assert (job.status, job.done_count, job.failed_count) == ("done", 2, 1)
+        assert job.expires_at is not None
+        assert [item.status for item in items] == ["done", "done", "failed"]
+        async with Session() as db:
+            images = (await db.execute(select(DetectionJobItem.image))).scalars().all()
+        assert images == [None, None, None]  # dropped once processed
+    run_with_db(async_sessionmaker_factory, test)
+
+def test_expired_lease_is_requeued_and_late_outcome_ignored(async_sessionmaker_factory):
+    async def test(Session):
+        job = await make_job(Session, images=2)
+        async with Session() as db:
+            stale = await crud.claim_job_items_async(db, 2)
+
+        async with Session() as db:
+            # Leases still running are left alone
+            assert await crud.requeue_stale_job_items_async(db, datetime.utcnow() - timedelta(minutes=5)) == 0
+            # Past the lease (claimed before the cutoff): back to the queue
+            assert await crud.requeue_stale_job_items_async(db, datetime.utcnow() + timedelta(seconds=1)) == 2
+        assert await statuses(Session) == ["queued", "queued"]
+
+        async with Session() as db:
+            fresh = await crud.claim_job_items_async(db, 2)
+            # The presumed-dead worker reports after the new claim finished the items: ignored
+            await crud.complete_job_items_async(db, outcomes(fresh), TTL)
+            await crud.complete_job_items_async(db, outcomes(stale), TTL)
+            job = await crud.get_job_async(db, job.id, 1)
+        assert (job.done_count, job.failed_count, job.status) == (2, 0, "done")
+    run_with_db(async_sessionmaker_factory, test)
+
+def test_outcome_for_requeued_item_is_dropped(async_sessionmaker_factory):
+    async def test(Session):
+        job = await make_job(Session, images=1)
+        async with Session() as db:
+            stale = await crud.claim_job_items_async(db, 1)
+            await crud.requeue_stale_job_items_async(db, datetime.utcnow() + timedelta(seconds=1))
+            await crud.complete_job_items_async(db, outcomes(stale), TTL)
+            job = await crud.get_job_async(db, job.id, 1)
+        assert (job.done_count, job.status) == (0, "running")
+        assert await statuses(Session) == ["queued"]
+    run_with_db(async_sessionmaker_factory, test)
+
+def test_released_items_are_claimed_again(async_sessionmaker_factory):
+    async def test(Session):
+        await make_job(Session, images=2)
+        async with Session() as db:
+            rows = await crud.claim_job_items_async(db, 2)
+            await crud.release_job_items_async(db, [row.id for row in rows])
+            again = await crud.claim_job_items_async(db, 2)
+        assert [row.id for row in again] == [row.id for row in rows]
+    run_with_db(async_sessionmaker_factory, test)
+
+def test_pending_images_count_unfinished_jobs_only(async_sessionmaker_factory):
+    async def test(Session):
+        await make_job(Session, images=2)
+        await make_job(Session, images=3)
+        async with Session() as db:
+            assert await crud.get_pending_job_images_async(db, 1) == 5
+            rows = await crud.claim_job_items_async(db, 2)
+            await crud.complete_job_items_async(db, outcomes(rows), TTL)
+            assert await crud.get_pending_job_images_async(db, 1) == 3
+            assert await crud.get_pending_job_images_async(db, 2) == 0
+    run_with_db(async_sessionmaker_factory, test)
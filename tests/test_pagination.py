@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException, Response
+
+from api.app.crud.api_keys import get_api_keys
+from api.app.crud.logs import get_request_logs
+from api.app.models.db_models import ApiKey, RequestLog
+from api.app.pagination import NEXT_CURSOR_HEADER, decode_cursor, encode_cursor, set_next_cursor
+
+T0 = datetime(2026, 3, 1, 12, 0, 0, 123456)
+
+def test_cursor_round_trip():
+    cursor = encode_cursor(T0, 42)
+    assert "=" not in cursor  # safe in a query string
+    assert decode_cursor(cursor) == (T0, 42)
+
+@pytest.mark.parametrize("cursor", ["", "not-a-cursor", encode_cursor(T0, 1)[:-3], "WyJ4IiwxXQ"])
+def test_invalid_cursor_is_400(cursor):
+    with pytest.raises(HTTPException) as raised:
+        decode_cursor(cursor)
+    assert raised.value.status_code == 400
+
+def test_next_cursor_only_on_full_pages():
+    rows = [(T0, 3), (T0, 2)]
+    response = Response()
+    set_next_cursor(response, rows, 2, lambda row: row)
+    assert decode_cursor(response.headers[NEXT_CURSOR_HEADER]) == (T0, 2)
+
+    response = Response()
+    set_next_cursor(response, rows, 3, lambda row: row)
+    assert NEXT_CURSOR_HEADER not in response.headers
+
+def read_all_logs(db, limit: int, **filters) -> list:
+    """Page through get_request_logs with cursors, like a client following X-Next-Cursor"""
+    seen, cursor = [], None
+    while True:
+        rows = get_request_logs(db, limit=limit, cursor=cursor, **filters)
+        seen.extend(log.id for log, _ in rows)
+        response = Response()
+        set_next_cursor(response, rows, limit, lambda row: (row[0].timestamp, row[0].id))
+        if NEXT_CURSOR_HEADER not in response.headers:
+            return seen
+        cursor = decode_cursor(response.headers[NEXT_CURSOR_HEADER])
+
+def test_log_pages_break_timestamp_ties_by_id(db_session):
+    db_session.add(ApiKey(name="k", key_value="k"))
+    # Seven rows share one timestamp, so a page boundary falls inside the tie
+    timestamps = [T0 + timedelta(seconds=1)] + [T0] * 7 + [T0 - timedelta(seconds=1)] * 2
+    logs = [RequestLog(api_key_id=1, endpoint="/x", status_code=200, response_time_ms=1.0, timestamp=ts) for ts in timestamps]
+    db_session.add_all(logs)
+    db_session.commit()
+
+    expected = [log.id for log in sorted(logs, key=lambda log: (log.timestamp, log.id), reverse=True)]
+    for limit in (1, 3, 4, 10):
+        assert read_all_logs(db_session, limit) == expected
+
+    rows = get_request_logs(db_session, limit=10)
+    assert rows[0][1] == "k"  # key name joined in
+
+def test_log_pages_keep_filters(db_session):
+    db_session.add_all([
+        RequestLog(api_key_id=1 + i % 2, endpoint="/x", status_code=200 if i % 3 else 500,
+                   response_time_ms=1.0, timestamp=T0)
+        for i in range(20)
+    ])
+    db_session.commit()
+    ids = read_all_logs(db_session, 2, api_key_id=2, status_code=200)
+    rows = db_session.query(RequestLog).filter(RequestLog.api_key_id == 2, RequestLog.status_code == 200).all()
+    assert sorted(ids, reverse=True) == ids
+    assert set(ids) == {log.id for log in rows}
+
+def test_key_pages_break_created_at_ties_by_id(db_session):
+    db_session.add_all([ApiKey(name=f"k{i}", key_value=f"k{i}", created_at=T0) for i in range(5)])
+    db_session.commit()
+    seen, cursor = [], None
+    while True:
+        keys = get_api_keys(db_session, limit=2, cursor=cursor)
+        seen.extend(key.id for key in keys)
+        if len(keys) < 2:
+            break
+        cursor = decode_cursor(encode_cursor(keys[-1].created_at, keys[-1].id))
+    assert seen == [5, 4, 3, 2, 1]
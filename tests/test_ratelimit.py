@@ -0,0 +1,70 @@
+import pytest
+
+from api.app import ratelimit
+from api.app.ratelimit import TokenBucketLimiter
+
+class Clock:
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit.time, "time", clock)
+    return clock
+
+@pytest.fixture
+def limiter(tmp_path):
+    return TokenBucketLimiter(tmp_path / "ratelimit.db")
+
+def test_burst_then_refused(limiter, clock):
+    # 60 per minute = 1 token per second, bucket of 5
+    results = [limiter.consume("k", 60, 60, 5) for _ in range(6)]
+    assert [result.allowed for result in results] == [True] * 5 + [False]
+    assert [result.remaining for result in results[:5]] == [4, 3, 2, 1, 0]
+    assert results[-1].retry_after == 1
+    assert results[-1].reset_after == 5
+
+def test_refill_at_limit_per_window(limiter, clock):
+    for _ in range(5):
+        limiter.consume("k", 60, 60, 5)
+    clock.now += 2.5
+    results = [limiter.consume("k", 60, 60, 5) for _ in range(3)]
+    assert [result.allowed for result in results] == [True, True, False]
+    assert results[-1].retry_after == 1  # half a token left, one more needs 0.5s
+
+def test_refill_stops_at_burst(limiter, clock):
+    limiter.consume("k", 60, 60, 5)
+    clock.now += 3600
+    results = [limiter.consume("k", 60, 60, 5) for _ in range(6)]
+    assert [result.allowed for result in results] == [True] * 5 + [False]
+
+def test_refused_requests_cost_nothing(limiter, clock):
+    for _ in range(10):
+        limiter.consume("k", 60, 60, 2)
+    clock.now += 1
+    assert limiter.consume("k", 60, 60, 2).allowed
+
+def test_buckets_are_independent_and_shared_across_instances(limiter, clock, tmp_path):
+    for _ in range(3):
+        limiter.consume("a", 60, 60, 3)
+    assert not limiter.consume("a", 60, 60, 3).allowed
+    assert limiter.consume("b", 60, 60, 3).allowed
+    # Another worker process opens the same file
+    other = TokenBucketLimiter(tmp_path / "ratelimit.db")
+    assert not other.consume("a", 60, 60, 3).allowed
+
+def test_cost_takes_several_tokens(limiter, clock):
+    assert limiter.consume("k", 60, 60, 5, cost=4).allowed
+    result = limiter.consume("k", 60, 60, 5, cost=4)
+    assert not result.allowed
+    assert result.retry_after == 3
+
+def test_prune_drops_idle_buckets(limiter, clock):
+    limiter.consume("old", 60, 60, 5)
+    clock.now += 7200
+    limiter.consume("new", 60, 60, 5)
+    assert limiter.prune(older_than_seconds=3600) == 1
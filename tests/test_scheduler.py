@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+from api.app.scheduler import FairScheduler, QueueFull
+from api.app.shedding import AdaptiveLimiter
+
+def make_scheduler(slots: int = 1) -> FairScheduler:
+    # target 0 disables load shedding, so only the DRR order is under test
+    return FairScheduler(slots, AdaptiveLimiter(0, 1000, min_limit=slots + 1, max_limit=64))
+
+async def serve_order(scheduler: FairScheduler, requests: list) -> list:
+    """Hold the only slot, queue (key, weight, cost) requests, then release and record the grant order"""
+    blocker = scheduler.enter("blocker", shed=False)
+    await blocker.__aenter__()
+    order = []
+
+    async def request(key, weight, cost):
+        async with scheduler.enter(key, weight, 0, cost=cost, shed=False):
+            order.append(key)
+
+    tasks = [asyncio.create_task(request(*args)) for args in requests]
+    await asyncio.sleep(0)  # every request is queued
+    await blocker.__aexit__(None, None, None)
+    await asyncio.wait_for(asyncio.gather(*tasks), timeout=5)
+    return order
+
+def test_free_slot_is_granted_immediately():
+    async def main():
+        scheduler = make_scheduler(slots=2)
+        ticket = scheduler.enter(1, shed=False)
+        assert ticket.future.done()
+    asyncio.run(main())
+
+def test_equal_weights_alternate():
+    order = asyncio.run(serve_order(make_scheduler(), [("a", 1, 1)] * 3 + [("b", 1, 1)] * 3))
+    assert order == ["a", "b", "a", "b", "a", "b"]
+
+def test_weights_set_the_share():
+    order = asyncio.run(serve_order(make_scheduler(), [("heavy", 3, 1)] * 6 + [("light", 1, 1)] * 2))
+    assert order == ["heavy", "heavy", "heavy", "light", "heavy", "heavy", "heavy", "light"]
+
+def test_batches_cost_one_unit_per_image():
+    # A 3-image batch at weight 1 waits for three turns' worth of deficit
+    order = asyncio.run(serve_order(make_scheduler(), [("batch", 1, 3)] + [("single", 1, 1)] * 3))
+    assert order == ["single", "single", "batch", "single"]
+
+def test_small_weight_still_gets_served():
+    # Deficit grows by 0.25 per turn: the job is served on its fourth
+    order = asyncio.run(serve_order(make_scheduler(), [("jobs", 0.25, 1)] + [("key", 1, 1)] * 6))
+    assert order == ["key", "key", "key", "jobs", "key", "key", "key"]
+
+@pytest.mark.parametrize("weight", [0, -1, float("nan")])
+def test_non_positive_weights_do_not_hang(weight):
+    order = asyncio.run(serve_order(make_scheduler(), [("bad", weight, 1)] * 2 + [("key", 1, 1)] * 2))
+    assert sorted(order) == ["bad", "bad", "key", "key"]
+
+def test_queue_full_per_key():
+    async def main():
+        scheduler = make_scheduler()
+        blocker = scheduler.enter("blocker", shed=False)
+        scheduler.enter("a", max_queue=2, shed=False)
+        scheduler.enter("a", max_queue=2, shed=False)
+        with pytest.raises(QueueFull):
+            scheduler.enter("a", max_queue=2, shed=False)
+        scheduler.enter("b", max_queue=2, shed=False)  # other keys are unaffected
+        blocker.discard()
+    asyncio.run(main())
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def main():
+        scheduler = make_scheduler()
+        blocker = scheduler.enter("blocker", shed=False)
+        await blocker.__aenter__()
+        waiting = scheduler.enter("a", shed=False)
+        task = asyncio.create_task(waiting.__aenter__())
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await blocker.__aexit__(None, None, None)
+        assert scheduler._running == 0
+        assert "a" not in scheduler._queues
+    asyncio.run(main())
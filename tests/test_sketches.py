@@ -0,0 +1,74 @@
+import random
+
+import pytest
+
+from api.app.sketches import RELATIVE_ACCURACY, DDSketch, merge_sketches, summarize
+
+QUANTILES = [0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99, 0.999]
+
+def exact_quantile(values: list, q: float) -> float:
+    """The value at rank q * (n - 1), the rank DDSketch.quantile uses"""
+    ordered = sorted(values)
+    return ordered[int(q * (len(ordered) - 1))]
+
+def assert_within_accuracy(sketch: DDSketch, values: list):
+    for q in QUANTILES:
+        expected = exact_quantile(values, q)
+        assert sketch.quantile(q) == pytest.approx(expected, rel=RELATIVE_ACCURACY), q
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_quantiles_within_relative_accuracy(seed):
+    rng = random.Random(seed)
+    # Latency-like: mostly 5-50ms with a long tail into seconds
+    values = [rng.lognormvariate(3, 1.2) for _ in range(20000)]
+    sketch = DDSketch()
+    for value in values:
+        sketch.add(value)
+    assert sketch.count == len(values)
+    assert_within_accuracy(sketch, values)
+
+def test_merge_equals_one_sketch_over_all_values():
+    rng = random.Random(7)
+    parts = [[rng.expovariate(1 / (10 * (i + 1))) for _ in range(3000)] for i in range(4)]
+    sketches = []
+    for part in parts:
+        sketch = DDSketch()
+        for value in part:
+            sketch.add(value)
+        sketches.append(sketch)
+
+    merged = merge_sketches(sketches)
+    combined = DDSketch()
+    for value in [value for part in parts for value in part]:
+        combined.add(value)
+    assert merged.bins == combined.bins
+    assert merged.count == combined.count
+    assert_within_accuracy(merged, [value for part in parts for value in part])
+
+def test_tiny_values_count_as_zero():
+    sketch = DDSketch()
+    sketch.add(0.0)
+    sketch.add(0.0005)
+    sketch.add(100.0)
+    assert sketch.zero_count == 2
+    assert sketch.quantile(0.0) == 0.0
+    assert sketch.quantile(1.0) == pytest.approx(100.0, rel=RELATIVE_ACCURACY)
+
+def test_json_round_trip():
+    sketch = DDSketch()
+    for value in (0.0, 1.5, 20.0, 20.1, 3000.0):
+        sketch.add(value)
+    restored = DDSketch.from_json(sketch.to_json())
+    assert restored.bins == sketch.bins
+    assert restored.zero_count == sketch.zero_count
+    assert DDSketch.from_json("").count == 0
+
+def test_summarize_empty_and_filled():
+    assert summarize(DDSketch()) == {"count": 0, "p50_ms": None, "p90_ms": None, "p99_ms": None}
+    sketch = DDSketch()
+    for value in range(1, 101):
+        sketch.add(float(value))
+    summary = summarize(sketch)
+    assert summary["count"] == 100
+    assert summary["p50_ms"] == pytest.approx(50, rel=RELATIVE_ACCURACY)
+    assert summary["p99_ms"] == pytest.approx(99, rel=RELATIVE_ACCURACY)
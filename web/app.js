@@ -11,8 +11,16 @@ function app() {
         loginForm: { username: '', password: '' },
         loginError: '',
         stats: {},
+        usage: { points: [] },
+        usageKeyId: '',
+        live: null,
+        liveSource: null,
+        liveRetry: null,
         apiKeys: [],
         models: [],
+        uploadProgress: null,
+        modelsRefreshTimer: null,
+        rolloutStats: null,
         showAddKeyModal: false,
         newKey: {
             name: '',
@@ -66,6 +74,7 @@ function app() {
         },
 
         logout() {
+            this.stopLiveStream();
             this.isAuthenticated = false;
             this.token = null;
             this.username = '';
@@ -76,8 +85,81 @@ function app() {
 
         async loadDashboard() {
             await this.loadStats();
+            await this.loadUsage();
             await this.loadApiKeys();
             await this.loadModels();
+            this.startLiveStream();
+        },
+
+        async startLiveStream() {
+            // One server-pushed stream instead of polling. EventSource cannot send headers, so trade the
+            // admin token for a short-lived one that only opens the stream and put that in the URL instead
+            this.stopLiveStream();
+            let token;
+            try {
+                const response = await fetch(`${API_BASE}/admin/stats/stream/token`, {
+                    method: 'POST',
+                    headers: { 'Authorization': `Bearer ${this.token}` }
+                });
+                if (response.status === 401) return;  // admin session expired: nothing to retry with
+                if (!response.ok) throw new Error(response.status);
+                token = (await response.json()).token;
+            } catch (error) {
+                this.scheduleLiveRestart();
+                return;
+            }
+            if (!this.isAuthenticated || this.liveSource) return;
+            const source = new EventSource(`${API_BASE}/admin/stats/stream?token=${encodeURIComponent(token)}`);
+            source.addEventListener('tick', (event) => this.applyLiveTick(JSON.parse(event.data)));
+            source.onerror = () => {
+                this.live = null;
+                if (source.readyState === EventSource.CLOSED) {
+                    // Reconnects reuse the URL, whose token soon expires: start over with a fresh one
+                    this.liveSource = null;
+                    this.scheduleLiveRestart();
+                }
+            };
+            this.liveSource = source;
+        },
+
+        scheduleLiveRestart() {
+            if (!this.isAuthenticated || this.liveRetry) return;
+            this.liveRetry = setTimeout(() => {
+                this.liveRetry = null;
+                if (this.isAuthenticated) this.startLiveStream();
+            }, 5000);
+        },
+
+        stopLiveStream() {
+            if (this.liveRetry) {
+                clearTimeout(this.liveRetry);
+                this.liveRetry = null;
+            }
+            if (this.liveSource) {
+                this.liveSource.close();
+                this.liveSource = null;
+            }
+            this.live = null;
+        },
+
+        applyLiveTick(tick) {
+            this.live = tick;
+            if (tick.requests && this.stats.total_requests_today !== undefined) {
+                this.stats.total_requests_today += tick.requests;
+                this.stats.total_requests_week += tick.requests;
+                this.stats.total_requests_month += tick.requests;
+            }
+            for (const [keyId, usage] of Object.entries(tick.key_usage)) {
+                const key = this.apiKeys.find(k => k.id === Number(keyId));
+                if (key) {
+                    key.request_count += usage.requests;
+                    key.last_used_at = usage.last_used_at;
+                }
+            }
+            if (tick.model_changed) {
+                this.loadStats();
+                this.loadModels();
+            }
         },
 
         async loadStats() {
@@ -93,6 +175,26 @@ function app() {
             }
         },
 
+        async loadUsage() {
+            try {
+                const params = new URLSearchParams({ hours: 24 });
+                if (this.usageKeyId) params.append('api_key_id', this.usageKeyId);
+                const response = await fetch(`${API_BASE}/admin/stats/usage?${params}`, {
+                    headers: { 'Authorization': `Bearer ${this.token}` }
+                });
+                if (response.ok) {
+                    this.usage = await response.json();
+                }
+            } catch (error) {
+                console.error('Failed to load usage:', error);
+            }
+        },
+
+        usageBarHeight(point) {
+            const max = Math.max(1, ...this.usage.points.map(p => p.request_count));
+            return Math.max(2, Math.round(point.request_count / max * 100)) + '%';
+        },
+
         async loadApiKeys() {
             try {
                 const response = await fetch(`${API_BASE}/admin/keys`, {
@@ -113,12 +215,105 @@ function app() {
                 });
                 if (response.ok) {
                     this.models = await response.json();
+                    // Refresh until background profiles finish
+                    const profiling = this.models.some(m => m.profile_status === 'pending' || m.profile_status === 'running');
+                    if (this.models.some(m => m.rollout_mode)) {
+                        await this.loadRolloutStats();
+                    }
+                    if (profiling && !this.modelsRefreshTimer) {
+                        this.modelsRefreshTimer = setTimeout(() => {
+                            this.modelsRefreshTimer = null;
+                            if (this.isAuthenticated) this.loadModels();
+                        }, 5000);
+                    }
                 }
             } catch (error) {
                 console.error('Failed to load models:', error);
             }
         },
 
+        profileSummary(model) {
+            const p = model.profile;
+            if (model.profile_status === 'done' && p) {
+                return `load ${Math.round(p.load_time_ms)}ms · ${p.single.median_ms}ms/img · `
+                    + `${p.batch.per_image_ms}ms/img @ batch ${p.batch.size} · ${Math.round(p.peak_rss_mb)}MB RSS`;
+            }
+            if (model.profile_status === 'failed') return 'Profiling failed' + (p && p.error ? ': ' + p.error.slice(0, 80) : '');
+            if (model.profile_status) return 'Profiling ' + model.profile_status + '...';
+            return 'Not profiled';
+        },
+
+        async loadRolloutStats() {
+            try {
+                const response = await fetch(`${API_BASE}/admin/stats/rollout`, {
+                    headers: { 'Authorization': `Bearer ${this.token}` }
+                });
+                if (response.ok) {
+                    this.rolloutStats = await response.json();
+                }
+            } catch (error) {
+                console.error('Failed to load rollout stats:', error);
+            }
+        },
+
+        rolloutSummary(model) {
+            const stats = this.rolloutStats && this.rolloutStats.comparisons.find(
+                c => c.candidate_model_id === model.id && c.mode === model.rollout_mode
+            );
+            if (!stats || !stats.samples) return 'No comparisons yet';
+            return `${stats.samples} compared · ${stats.agreement_rate}% agree · IoU ${stats.mean_iou ?? '-'} · `
+                + `p50 ${stats.candidate_latency.p50_ms}ms vs ${stats.primary_latency.p50_ms}ms`;
+        },
+
+        async startRollout(modelId, mode) {
+            const label = mode === 'canary' ? 'Percent of requests served by this model' : 'Percent of requests mirrored to this model';
+            const percent = parseFloat(prompt(label, mode === 'canary' ? '5' : '25'));
+            if (isNaN(percent)) return;
+            try {
+                const response = await fetch(`${API_BASE}/admin/models/${modelId}/rollout`, {
+                    method: 'PUT',
+                    headers: { 'Authorization': `Bearer ${this.token}`, 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ mode, percent })
+                });
+                if (response.ok) {
+                    await this.loadModels();
+                } else {
+                    const error = await response.json();
+                    alert('Failed to start rollout' + (error.detail ? ': ' + JSON.stringify(error.detail) : ''));
+                }
+            } catch (error) {
+                alert('Failed to start rollout');
+            }
+        },
+
+        async stopRollout(modelId) {
+            try {
+                const response = await fetch(`${API_BASE}/admin/models/${modelId}/rollout`, {
+                    method: 'DELETE',
+                    headers: { 'Authorization': `Bearer ${this.token}` }
+                });
+                if (response.ok) {
+                    await this.loadModels();
+                }
+            } catch (error) {
+                alert('Failed to stop rollout');
+            }
+        },
+
+        async profileModel(modelId) {
+            try {
+                const response = await fetch(`${API_BASE}/admin/models/${modelId}/profile`, {
+                    method: 'POST',
+                    headers: { 'Authorization': `Bearer ${this.token}` }
+                });
+                if (response.ok) {
+                    await this.loadModels();
+                }
+            } catch (error) {
+                alert('Failed to start profiling');
+            }
+        },
+
         async createApiKey() {
             try {
                 const payload = {
@@ -230,28 +425,82 @@ function app() {
         async uploadModel(event) {
             const file = event.target.files[0];
             if (!file) return;
-
-            const formData = new FormData();
-            formData.append('file', file);
+            event.target.value = '';
 
             try {
-                const response = await fetch(`${API_BASE}/admin/models/upload`, {
-                    method: 'POST',
-                    headers: { 'Authorization': `Bearer ${this.token}` },
-                    body: formData
-                });
+                // Large files go through a resumable chunked upload
+                const response = file.size > 16 * 1024 * 1024
+                    ? await this.uploadModelChunked(file)
+                    : await this.uploadModelSingle(file);
 
                 if (response.ok) {
                     await this.loadModels();
-                    alert('Model uploaded successfully!');
+                    alert(response.status === 200 ? 'This model was already uploaded' : 'Model uploaded successfully!');
                 } else {
-                    alert('Failed to upload model');
+                    const error = await response.json().catch(() => ({}));
+                    alert('Failed to upload model' + (error.detail ? ': ' + JSON.stringify(error.detail) : ''));
                 }
             } catch (error) {
                 alert('Failed to upload model: ' + error.message);
+            } finally {
+                this.uploadProgress = null;
             }
         },
 
+        async uploadModelSingle(file) {
+            const formData = new FormData();
+            formData.append('file', file);
+            return fetch(`${API_BASE}/admin/models/upload`, {
+                method: 'POST',
+                headers: { 'Authorization': `Bearer ${this.token}` },
+                body: formData
+            });
+        },
+
+        async uploadModelChunked(file) {
+            const auth = { 'Authorization': `Bearer ${this.token}` };
+            const created = await fetch(`${API_BASE}/admin/models/uploads`, {
+                method: 'POST',
+                headers: { ...auth, 'Content-Type': 'application/json' },
+                body: JSON.stringify({ filename: file.name, size: file.size })
+            });
+            if (!created.ok) return created;
+            let session = await created.json();
+
+            let failures = 0;
+            while (session.offset < file.size) {
+                this.uploadProgress = Math.floor(session.offset / file.size * 100);
+                const chunk = file.slice(session.offset, session.offset + session.chunk_size);
+                try {
+                    const response = await fetch(`${API_BASE}/admin/models/uploads/${session.upload_id}?offset=${session.offset}`, {
+                        method: 'PATCH',
+                        headers: { ...auth, 'Content-Type': 'application/octet-stream' },
+                        body: chunk
+                    });
+                    if (response.ok || response.status === 409) {
+                        // 409: the server has a different offset, continue from there
+                        session = response.ok ? await response.json() : { ...session, offset: (await response.json()).detail.offset };
+                        failures = 0;
+                        continue;
+                    }
+                    if (response.status < 500) return response;
+                } catch (error) {
+                    // Network error, retry below
+                }
+                if (++failures > 5) throw new Error('upload interrupted, too many failed retries');
+                await new Promise(resolve => setTimeout(resolve, 1000 * failures));
+                const status = await fetch(`${API_BASE}/admin/models/uploads/${session.upload_id}`, { headers: auth });
+                if (status.ok) session = await status.json();
+            }
+
+            this.uploadProgress = 100;
+            return fetch(`${API_BASE}/admin/models/uploads/${session.upload_id}/complete`, {
+                method: 'POST',
+                headers: { ...auth, 'Content-Type': 'application/json' },
+                body: JSON.stringify({})
+            });
+        },
+
         async activateModel(modelId) {
             try {
                 const response = await fetch(`${API_BASE}/admin/models/${modelId}/activate`, {